@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Procesamiento por lotes sin interfaz gráfica.
+
+Envía una carpeta (o patrones glob) de imágenes al modelo con un número
+acotado de peticiones simultáneas y escribe un archivo .tsv/.txt por imagen
+más un manifest.jsonl. Si se interrumpe, al volver a ejecutarlo con la misma
+carpeta de salida se saltan las imágenes ya procesadas.
+
+Uso:
+    python batch_cli.py capturas/ --modo Excel --salida resultados/ --workers 4
+    python batch_cli.py capturas/ --exportar resultados.xlsx
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from PIL import Image
+
+import openrouter_client
+from config_manager import load_config, get_api_key, DEFAULT_CONFIG, DEFAULT_MODEL, MODEL_MAP
+from image_encoder import encode_image, get_encoding_settings
+from image_preprocess import preprocess_image, get_preprocess_settings
+from prompts import build_prompt, build_payload, strip_code_fences
+from request_scheduler import RequestScheduler
+from result_cache import ResultCache, make_key
+from table_export import export_format, write_delimited, write_workbook, DEFAULT_CSV_DELIMITER
+from table_parser import parse_table
+from telemetry import TelemetryStore, usage_fields
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif", ".tif", ".tiff")
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def collect_images(inputs):
+    """Expande carpetas y patrones glob a una lista ordenada de imágenes sin duplicados"""
+    paths = []
+    for entrada in inputs:
+        if os.path.isdir(entrada):
+            candidatos = [os.path.join(entrada, nombre) for nombre in os.listdir(entrada)]
+        else:
+            candidatos = glob.glob(entrada, recursive=True)
+        paths.extend(p for p in candidatos if p.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(p))
+    return sorted(set(os.path.abspath(p) for p in paths))
+
+
+def output_names(paths, extension):
+    """Asigna a cada imagen un nombre de salida único (añade -2, -3... si se repite)"""
+    nombres = {}
+    usados = {}
+    for path in paths:
+        base = os.path.splitext(os.path.basename(path))[0]
+        usados[base] = usados.get(base, 0) + 1
+        sufijo = "" if usados[base] == 1 else f"-{usados[base]}"
+        nombres[path] = f"{base}{sufijo}{extension}"
+    return nombres
+
+
+def image_signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def load_manifest(manifest_path):
+    """Lee el manifest existente y devuelve {ruta: entrada} de las imágenes ya procesadas"""
+    hechos = {}
+    if not os.path.exists(manifest_path):
+        return hechos
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for linea in f:
+            try:
+                entrada = json.loads(linea)
+            except json.JSONDecodeError:
+                continue  # Línea truncada por una interrupción
+            if entrada.get("status") == "ok":
+                hechos[entrada["image"]] = entrada
+    return hechos
+
+
+def percentile(values, p):
+    """Percentil p (0-100) por interpolación lineal"""
+    if not values:
+        return 0.0
+    ordenados = sorted(values)
+    k = (len(ordenados) - 1) * p / 100
+    inferior = int(k)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (k - inferior)
+
+
+def _write_atomic(path, text):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _record_telemetry(telemetry, model_id, mode, encoded, inicio, timings, info, usage=None, error=None,
+                      preprocess_ms=None):
+    if telemetry is None:
+        return
+    telemetry.record(
+        model_id, mode, source="lote", status="error" if error else "ok", error=str(error)[:300] if error else None,
+        preprocess_ms=preprocess_ms, encode_ms=encoded["encode_ms"], image_bytes=encoded["encoded_bytes"],
+        total_ms=(time.perf_counter() - inicio) * 1000, request_bytes=timings.get("request_bytes"),
+        upload_ms=timings["upload_s"] * 1000 if "upload_s" in timings else None,
+        ttfb_ms=timings["ttfb_s"] * 1000 if "ttfb_s" in timings else None,
+        retries=info["retries"], wait_ms=info["wait_seconds"] * 1000, **usage_fields(usage))
+
+
+def process_image(path, output_path, api_key, model_id, mode, prompt, encoding_settings, cache, scheduler,
+                  telemetry=None, preprocess_settings=None):
+    """Procesa una imagen y escribe su salida; devuelve la entrada del manifest"""
+    inicio = time.perf_counter()
+    info = {"retries": 0, "wait_seconds": 0.0}
+    with Image.open(path) as img:
+        img.load()
+        cache_key = make_key(img, model_id, mode, prompt) if cache else None
+        output = cache.get(cache_key) if cache else None
+        desde_cache = output is not None
+        if output is None:
+            preprocess_ms = None
+            if preprocess_settings:
+                img, pasos = preprocess_image(img, preprocess_settings)
+                preprocess_ms = sum(p["ms"] for p in pasos)
+            encoded = encode_image(img, encoding_settings)
+            payload = build_payload(model_id, prompt, encoded)
+            inicio_peticion, timings = time.perf_counter(), {}
+            try:
+                response, info = scheduler.call(
+                    model_id, lambda timeout: openrouter_client.post_chat_completion(api_key, payload, timeout, timings))
+                result = response.json()
+            except Exception as e:
+                _record_telemetry(telemetry, model_id, mode, encoded, inicio_peticion, timings, info, error=e,
+                                  preprocess_ms=preprocess_ms)
+                raise
+            _record_telemetry(telemetry, model_id, mode, encoded, inicio_peticion, timings, info, result.get("usage"),
+                              preprocess_ms=preprocess_ms)
+            output = result['choices'][0]['message']['content']
+            # En Excel se guarda el TSV ya limpio (sin ```, frases del modelo ni JSON de celdas)
+            output = parse_table(output).to_tsv() if mode == "Excel" else strip_code_fences(output)
+            if cache:
+                cache.put(cache_key, output, model=model_id, mode=mode)
+    _write_atomic(output_path, output + "\n")
+    return {
+        "status": "ok",
+        "output": os.path.basename(output_path),
+        "latency": round(time.perf_counter() - inicio, 3),
+        "cached": desde_cache,
+        "retries": info["retries"],
+        "wait_seconds": round(info["wait_seconds"], 3),
+    }
+
+
+def run_batch(paths, output_dir, api_key, model_id, mode, prompt, workers=4, encoding_settings=None, cache=None,
+              scheduler=None, telemetry=None, preprocess_settings=None):
+    """Procesa las imágenes en paralelo, saltando las ya completadas, y devuelve el resumen"""
+    scheduler = scheduler or RequestScheduler()
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    hechos = load_manifest(manifest_path)
+    nombres = output_names(paths, ".tsv" if mode == "Excel" else ".txt")
+
+    pendientes = []
+    for path in paths:
+        previo = hechos.get(path)
+        if (previo and previo.get("signature") == image_signature(path)
+                and os.path.exists(os.path.join(output_dir, previo["output"]))):
+            continue
+        pendientes.append(path)
+
+    print(f"{len(paths)} imágenes, {len(paths) - len(pendientes)} ya procesadas, {len(pendientes)} pendientes")
+    manifest_lock = threading.Lock()
+    latencias = []
+    fallos = []
+    inicio = time.perf_counter()
+
+    with open(manifest_path, 'a', encoding='utf-8') as manifest, ThreadPoolExecutor(max_workers=workers) as pool:
+        futuros = {
+            pool.submit(process_image, path, os.path.join(output_dir, nombres[path]),
+                        api_key, model_id, mode, prompt, encoding_settings, cache, scheduler, telemetry,
+                        preprocess_settings): path
+            for path in pendientes
+        }
+        for i, futuro in enumerate(as_completed(futuros), 1):
+            path = futuros[futuro]
+            try:
+                entrada = futuro.result()
+                latencias.append(entrada["latency"])
+                print(f"[{i}/{len(pendientes)}] OK {os.path.basename(path)} ({entrada['latency']:.2f} s)")
+            except Exception as e:
+                entrada = {"status": "error", "error": str(e)}
+                fallos.append(path)
+                print(f"[{i}/{len(pendientes)}] ERROR {os.path.basename(path)}: {e}")
+            entrada.update(image=path, signature=image_signature(path), model=model_id, mode=mode)
+            with manifest_lock:
+                manifest.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+                manifest.flush()
+
+    duracion = time.perf_counter() - inicio
+    return {
+        "total": len(paths),
+        "processed": len(latencias),
+        "skipped": len(paths) - len(pendientes),
+        "failed": len(fallos),
+        "failures": fallos,
+        "seconds": round(duracion, 3),
+        "images_per_minute": round(len(latencias) / duracion * 60, 2) if duracion > 0 else 0.0,
+        "latency_p50": round(percentile(latencias, 50), 3),
+        "latency_p90": round(percentile(latencias, 90), 3),
+        "latency_p99": round(percentile(latencias, 99), 3),
+        "retries": scheduler.stats.get(model_id, {}).get("retries", 0),
+        "wait_seconds": round(scheduler.stats.get(model_id, {}).get("wait_seconds", 0.0), 3),
+    }
+
+
+def _tsv_rows(path):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        yield from csv.reader(f, delimiter="\t")
+
+
+def export_batch(paths, output_dir, export_path, csv_delimiter=DEFAULT_CSV_DELIMITER, numbers=True, decimal=None):
+    """
+    Reúne las tablas del lote en un solo archivo: una hoja por imagen en .xlsx o
+    todas seguidas en CSV/TSV. Lee cada .tsv fila a fila; devuelve las filas escritas.
+    """
+    hechos = load_manifest(os.path.join(output_dir, MANIFEST_NAME))
+    salidas = [(os.path.splitext(os.path.basename(path))[0], os.path.join(output_dir, hechos[path]["output"]))
+               for path in paths if path in hechos]
+    salidas = [(nombre, salida) for nombre, salida in salidas if os.path.exists(salida)]
+    if export_format(export_path) == "xlsx":
+        return write_workbook(export_path, ((nombre, _tsv_rows(salida)) for nombre, salida in salidas),
+                              numbers=numbers, decimal=decimal)
+    delimitador = "\t" if export_format(export_path) == "tsv" else csv_delimiter
+    return write_delimited(export_path, (fila for _, salida in salidas for fila in _tsv_rows(salida)), delimitador)
+
+
+def resolve_model(nombre):
+    """Acepta tanto el nombre visible de MODEL_MAP como el id del modelo"""
+    return MODEL_MAP.get(nombre, nombre)
+
+
+def main(argv=None):
+    config = load_config()
+    parser = argparse.ArgumentParser(description="Procesa imágenes por lotes con OpenRouter (Excel → TSV, Docs → texto).")
+    parser.add_argument("entradas", nargs="+", help="Carpetas o patrones glob de imágenes")
+    parser.add_argument("--salida", default="resultados", help="Carpeta de salida (también guarda el manifest)")
+    parser.add_argument("--modo", choices=["Excel", "Docs"], default=config.get('output_mode', 'Excel'))
+    parser.add_argument("--modelo", default=config.get('selected_model', DEFAULT_MODEL),
+                        help="Nombre de MODEL_MAP o id de modelo de OpenRouter")
+    parser.add_argument("--workers", type=int, default=4, help="Peticiones simultáneas como máximo")
+    parser.add_argument("--columnas", type=int, help="Número exacto de columnas (modo Excel)")
+    parser.add_argument("--filas", type=int, help="Número exacto de filas (modo Excel)")
+    parser.add_argument("--sin-cache", action="store_true", help="No usar la caché de resultados")
+    parser.add_argument("--sin-preprocesado", action="store_true", help="Envía las imágenes sin recortar ni simplificar")
+    parser.add_argument("--exportar", metavar="ARCHIVO",
+                        help="Reúne todas las tablas en un .xlsx (una hoja por imagen), .csv o .tsv (modo Excel)")
+    args = parser.parse_args(argv)
+    if args.exportar:
+        if args.modo != "Excel":
+            parser.error("--exportar solo está disponible en modo Excel")
+        try:
+            export_format(args.exportar)
+        except ValueError as e:
+            parser.error(str(e))
+
+    api_key = get_api_key()
+    if not api_key:
+        print("No hay API key configurada. Ejecuta la aplicación una vez para guardarla.", file=sys.stderr)
+        return 2
+
+    paths = collect_images(args.entradas)
+    if not paths:
+        print("No se encontraron imágenes.", file=sys.stderr)
+        return 1
+
+    model_id = resolve_model(args.modelo)
+    prompt_usuario = config.get('prompt_excel' if args.modo == "Excel" else 'prompt_docs',
+                                DEFAULT_CONFIG['prompt_excel' if args.modo == "Excel" else 'prompt_docs'])
+    prompt = build_prompt(args.modo, prompt_usuario, args.columnas, args.filas)
+    encoding_settings = get_encoding_settings(config.get('image_encoding', DEFAULT_CONFIG['image_encoding']), model_id)
+    cache = None if args.sin_cache or not config.get('cache_enabled', True) else ResultCache.from_config(config)
+    telemetry = TelemetryStore() if config.get('telemetry_enabled', True) else None
+    preprocess_settings = get_preprocess_settings(config.get('image_preprocess'))
+    # En lote no se muestra el informe por pasos, así que no se miden los bytes intermedios
+    preprocess_settings = (None if args.sin_preprocesado or not preprocess_settings["enabled"]
+                           else dict(preprocess_settings, measure_bytes=False))
+
+    try:
+        resumen = run_batch(paths, args.salida, api_key, model_id, args.modo, prompt,
+                            max(1, args.workers), encoding_settings, cache, RequestScheduler.from_config(config),
+                            telemetry, preprocess_settings)
+    finally:
+        openrouter_client.close_session()
+        if telemetry is not None:
+            telemetry.close()
+
+    print()
+    print(f"Procesadas: {resumen['processed']}  Omitidas: {resumen['skipped']}  Fallidas: {resumen['failed']}")
+    print(f"Rendimiento: {resumen['images_per_minute']} imágenes/min en {resumen['seconds']} s")
+    print(f"Latencia p50/p90/p99: {resumen['latency_p50']} / {resumen['latency_p90']} / {resumen['latency_p99']} s")
+    print(f"Reintentos: {resumen['retries']}  Espera por límites: {resumen['wait_seconds']} s")
+    for path in resumen['failures']:
+        print(f"  Falló: {path}")
+    if args.exportar:
+        filas = export_batch(paths, args.salida, args.exportar, config.get('export_csv_delimiter', DEFAULT_CSV_DELIMITER),
+                             config.get('export_numbers', True), config.get('export_decimal_separator') or None)
+        print(f"Exportadas {filas} filas a {args.exportar}")
+    return 1 if resumen['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
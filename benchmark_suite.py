@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+"""
+Benchmarks sin conexión: un servidor local imita a OpenRouter
+(/api/v1/chat/completions y /api/v1/key) con latencia, streaming y errores
+configurables, y un corpus de capturas de tablas y texto se genera al vuelo
+en varias resoluciones. No hace falta API key ni red.
+
+    python benchmark_suite.py --salida bench.json
+    python benchmark_suite.py --salida nuevo.json --comparar bench.json
+
+El resultado es un JSON con p50/p95 por prueba (ms), pensado para comparar
+entre commits.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_API_KEY = "sk-or-v1-" + "0" * 64
+BENCH_MODEL = "qwen/qwen2.5-vl-72b-instruct:free"
+DEFAULT_RESOLUTIONS = ((640, 360), (1280, 720), (1920, 1080), (2560, 1440))
+DEFAULT_TSV_ROWS = (100, 1000, 10000, 50000)
+SUITES = ("codificacion", "preprocesado", "tsv", "config", "key", "stream", "lote", "captura")
+
+
+def summarize(valores_ms):
+    """p50/p95/media/mín/máx de una lista de tiempos en ms"""
+    from batch_cli import percentile
+
+    return {
+        "n": len(valores_ms),
+        "p50": round(percentile(valores_ms, 50), 3),
+        "p95": round(percentile(valores_ms, 95), 3),
+        "mean": round(sum(valores_ms) / len(valores_ms), 3) if valores_ms else 0.0,
+        "min": round(min(valores_ms), 3) if valores_ms else 0.0,
+        "max": round(max(valores_ms), 3) if valores_ms else 0.0,
+    }
+
+
+def _medir(funcion, repeticiones, calentamiento=1):
+    """Ejecuta funcion() varias veces y devuelve los tiempos en ms (sin el calentamiento)"""
+    tiempos = []
+    for i in range(calentamiento + repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        if i >= calentamiento:
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+    return tiempos
+
+
+def fake_table(filas, columnas, semilla=0):
+    """Respuesta TSV determinista de filas x columnas"""
+    rng = random.Random(semilla)
+    cabecera = "\t".join(f"Columna {c + 1}" for c in range(columnas))
+    cuerpo = ("\t".join(f"{rng.randint(0, 99999)},{rng.randint(0, 99):02d}" if c else f"Fila {f + 1}"
+                        for c in range(columnas)) for f in range(filas))
+    return cabecera + "\n" + "\n".join(cuerpo)
+
+
+class MockOpenRouter:
+    """
+    Servidor HTTP local compatible con las rutas de OpenRouter que usa la
+    aplicación. latency: segundos antes de responder; error_rate: fracción
+    de peticiones que devuelven 429/503; stream_chunks y chunk_delay controlan
+    la respuesta SSE; rows y columns el tamaño de la tabla devuelta.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, error_rate=0.0, stream_chunks=20, chunk_delay=0.005,
+                 rows=30, columns=6, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stream_chunks = stream_chunks
+        self.chunk_delay = chunk_delay
+        self.content = fake_table(rows, columns, seed)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"chat": 0, "key": 0, "errors": 0, "bytes_received": 0}
+        servidor = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Cabeceras y cuerpo van en escrituras separadas: con Nagle cada respuesta tardaría ~40 ms más
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status, datos, headers=None):
+                cuerpo = json.dumps(datos).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(cuerpo)))
+                for clave, valor in (headers or {}).items():
+                    self.send_header(clave, valor)
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                if self.path.rstrip("/") != "/api/v1/key":
+                    return self._json(404, {"error": {"message": "ruta desconocida", "code": 404}})
+                servidor._contar("key")
+                if not self.headers.get("Authorization", "").startswith("Bearer sk-or-"):
+                    return self._json(401, {"error": {"message": "No auth credentials found", "code": 401}})
+                self._json(200, {"data": {"label": "bench", "usage": 0.0, "limit": None, "is_free_tier": True}})
+
+            def do_POST(self):
+                longitud = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(longitud) or b"{}")
+                if self.path.rstrip("/") != "/api/v1/chat/completions":
+                    return self._json(404, {"error": {"message": "ruta desconocida", "code": 404}})
+                servidor._contar("chat", bytes_received=longitud)
+                time.sleep(servidor._espera())
+                error = servidor._error()
+                if error:
+                    # Retry-After 0 para que los reintentos no dominen la medida
+                    return self._json(error, {"error": {"message": "Error simulado", "code": error}},
+                                      {"Retry-After": "0"} if error == 429 else None)
+                usage = {"prompt_tokens": longitud // 4, "completion_tokens": len(servidor.content) // 4, "cost": 0}
+                if payload.get("stream"):
+                    return self._stream(payload, usage)
+                self._json(200, {
+                    "id": "gen-bench", "model": payload.get("model"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": servidor.content},
+                                 "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+
+            def _stream(self, payload, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def evento(texto):
+                    datos = texto.encode("utf-8")
+                    self.wfile.write(f"{len(datos):x}\r\n".encode("ascii") + datos + b"\r\n")
+                    self.wfile.flush()
+
+                evento(": OPENROUTER PROCESSING\n\n")
+                contenido = servidor.content
+                paso = max(1, len(contenido) // servidor.stream_chunks)
+                for i in range(0, len(contenido), paso):
+                    chunk = {"choices": [{"index": 0, "delta": {"content": contenido[i:i + paso]}}]}
+                    evento(f"data: {json.dumps(chunk)}\n\n")
+                    time.sleep(servidor.chunk_delay)
+                evento(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n")
+                evento("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-openrouter", daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/api/v1"
+
+    def _contar(self, clave, bytes_received=0):
+        with self._lock:
+            self.stats[clave] += 1
+            self.stats["bytes_received"] += bytes_received
+
+    def _espera(self):
+        with self._lock:
+            return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+    def _error(self):
+        with self._lock:
+            if self._rng.random() >= self.error_rate:
+                return None
+            self.stats["errors"] += 1
+            return self._rng.choice((429, 503))
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _fuente(tamano):
+    from PIL import ImageFont
+    try:
+        return ImageFont.load_default(size=tamano)
+    except TypeError:  # Pillow sin FreeType
+        return ImageFont.load_default()
+
+
+def make_table_image(width, height, semilla=0):
+    """Captura sintética de una hoja de cálculo: cuadrícula, cabecera y números"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(semilla)
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    fuente = _fuente(max(10, height // 45))
+    alto_fila, ancho_col = max(16, height // 30), max(60, width // 9)
+    draw.rectangle((0, 0, width, alto_fila), fill=(217, 225, 242))
+    for y in range(0, height, alto_fila):
+        draw.line((0, y, width, y), fill=(212, 212, 212))
+    for x in range(0, width, ancho_col):
+        draw.line((x, 0, x, height), fill=(212, 212, 212))
+    for f, y in enumerate(range(0, height - alto_fila, alto_fila)):
+        for c, x in enumerate(range(0, width - ancho_col, ancho_col)):
+            texto = f"Columna {c + 1}" if f == 0 else f"{rng.randint(0, 99999)},{rng.randint(0, 99):02d}"
+            draw.text((x + 4, y + 2), texto, fill="black", font=fuente)
+    return img
+
+
+def make_text_image(width, height, semilla=0):
+    """Captura sintética de un documento: párrafos de texto sobre fondo blanco con márgenes"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(semilla)
+    palabras = ("factura importe cliente fecha total pedido entrega servicio mensual resumen "
+                "informe datos análisis según anexo período cuenta").split()
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    tamano = max(10, height // 50)
+    fuente = _fuente(tamano)
+    margen, y = width // 10, height // 12
+    while y < height - height // 12:
+        linea = " ".join(rng.choice(palabras) for _ in range(max(4, width // (tamano * 6))))
+        draw.text((margen, y), linea.capitalize(), fill=(30, 30, 30), font=fuente)
+        y += int(tamano * 1.6) if rng.random() > 0.15 else tamano * 3
+    return img
+
+
+def generate_corpus(resolutions=DEFAULT_RESOLUTIONS):
+    """Lista de capturas sintéticas (tabla y texto) en cada resolución"""
+    corpus = []
+    for i, (width, height) in enumerate(resolutions):
+        corpus.append({"name": f"tabla_{width}x{height}", "kind": "Excel", "image": make_table_image(width, height, i)})
+        corpus.append({"name": f"texto_{width}x{height}", "kind": "Docs", "image": make_text_image(width, height, i)})
+    return corpus
+
+
+def bench_encoding(corpus, repeticiones, model_id=BENCH_MODEL):
+    """Lo mismo que RecorteApp._imagen_a_base64 sin presupuesto: ajustes del modelo y encode_image"""
+    from config_manager import DEFAULT_CONFIG
+    from image_encoder import encode_image, get_encoding_settings
+
+    settings = get_encoding_settings(DEFAULT_CONFIG["image_encoding"], model_id)
+    resultados = {}
+    for entrada in corpus:
+        info = encode_image(entrada["image"], settings)
+        resultados[entrada["name"]] = dict(summarize(_medir(lambda: encode_image(entrada["image"], settings), repeticiones)),
+                                           bytes=info["encoded_bytes"], format=info["format"])
+    return resultados
+
+
+def bench_preprocess(corpus, repeticiones, model_id=BENCH_MODEL):
+    from config_manager import DEFAULT_CONFIG
+    from image_encoder import get_encoding_settings
+    from image_preprocess import preprocess_image, get_preprocess_settings
+
+    settings = dict(get_preprocess_settings(DEFAULT_CONFIG["image_preprocess"]), measure_bytes=False)
+    encoding = get_encoding_settings(DEFAULT_CONFIG["image_encoding"], model_id)
+    resultados = {}
+    for entrada in corpus:
+        resultados[entrada["name"]] = summarize(_medir(
+            lambda: preprocess_image(entrada["image"], settings, model_id, encoding), repeticiones))
+    return resultados
+
+
+def bench_tsv(repeticiones, filas=DEFAULT_TSV_ROWS, columnas=8):
+    """
+    Conversión de la respuesta en filas para la tabla, como en
+    _mostrar_tabla_tsv_en_widget (sin dibujar), con TSV limpio, con bloque ```
+    y frase inicial, con celdas entrecomilladas y en JSON de celdas; más la
+    generación del TSV al copiar.
+    """
+    from table_parser import parse_table
+
+    resultados = {}
+    for n in filas:
+        texto = fake_table(n, columnas, n)
+        tabla = parse_table(texto)
+        lineas = texto.split("\n")
+        variantes = {
+            "": texto,
+            "_markdown": "Aquí tienes la tabla:\n```tsv\n" + texto + "\n```",
+            "_comillas": "\n".join(linea + '\t"nota\tcon tab"' if i % 10 == 0 else linea + "\tnota"
+                                   for i, linea in enumerate(lineas)),
+            "_json": json.dumps([{"row": f + 1, "column": c + 1, "text": celda} for f, fila in enumerate(tabla.rows())
+                                 for c, celda in enumerate(fila)]),
+        }
+        for sufijo, variante in variantes.items():
+            resultados[f"{n}_filas{sufijo}"] = summarize(_medir(lambda: parse_table(variante).rows(), repeticiones))
+        resultados[f"{n}_filas_copiar"] = summarize(_medir(tabla.to_tsv, repeticiones))
+    return resultados
+
+
+def bench_config(repeticiones):
+    """Cambio en memoria, escritura atómica y lectura en frío (con la API key encriptada)"""
+    import config_manager
+
+    config_manager.set_api_key(BENCH_API_KEY)
+    config_manager.flush_config()
+    contador = iter(range(10 ** 9))
+    return {
+        "update_config": summarize(_medir(lambda: config_manager.update_config("bench_counter", next(contador)), repeticiones)),
+        "update_y_flush": summarize(_medir(lambda: (config_manager.update_config("bench_counter", next(contador)),
+                                                    config_manager.flush_config()), repeticiones)),
+        "lectura_en_frio": summarize(_medir(config_manager._read_config_file, repeticiones)),
+    }
+
+
+def bench_key(repeticiones):
+    import openrouter_client
+
+    return {"get_key_info": summarize(_medir(lambda: openrouter_client.get_key_info(BENCH_API_KEY).close(), repeticiones))}
+
+
+def bench_stream(repeticiones, model_id=BENCH_MODEL):
+    """Primer fragmento y respuesta completa por SSE"""
+    import openrouter_client
+
+    payload = {"model": model_id, "messages": [{"role": "user", "content": "bench"}]}
+    primeros, totales = [], []
+    for _ in range(repeticiones + 1):
+        inicio = time.perf_counter()
+        primero = None
+        for _fragmento in openrouter_client.iter_chat_stream(openrouter_client.open_chat_stream(BENCH_API_KEY, payload)):
+            if primero is None:
+                primero = (time.perf_counter() - inicio) * 1000
+        primeros.append(primero)
+        totales.append((time.perf_counter() - inicio) * 1000)
+    return {"primer_fragmento": summarize(primeros[1:]), "total": summarize(totales[1:])}
+
+
+def bench_batch(corpus, carpeta, workers=(1, 4, 8), copias=3, model_id=BENCH_MODEL):
+    """Rendimiento de batch_cli.run_batch de extremo a extremo contra el servidor simulado"""
+    from batch_cli import run_batch
+    from config_manager import DEFAULT_CONFIG
+    from image_encoder import get_encoding_settings
+    from prompts import build_prompt
+    from request_scheduler import RequestScheduler
+
+    entradas = os.path.join(carpeta, "corpus")
+    os.makedirs(entradas, exist_ok=True)
+    paths = []
+    for entrada in corpus:
+        if entrada["kind"] == "Excel":
+            for copia in range(copias):
+                path = os.path.join(entradas, f"{entrada['name']}_{copia}.png")
+                entrada["image"].save(path)
+                paths.append(path)
+    settings = get_encoding_settings(DEFAULT_CONFIG["image_encoding"], model_id)
+    prompt = build_prompt("Excel", DEFAULT_CONFIG["prompt_excel"])
+    resultados = {}
+    for n in workers:
+        # Sin límite de ritmo y con esperas cortas: se mide la aplicación, no el cubo de fichas
+        scheduler = RequestScheduler(rate_per_minute=60000, burst=1000, base_delay=0.01, max_delay=0.05)
+        resumen = run_batch(paths, os.path.join(carpeta, f"salida_{n}"), BENCH_API_KEY, model_id, "Excel",
+                            prompt, n, settings, None, scheduler)
+        resultados[f"{n}_workers"] = {k: resumen[k] for k in ("processed", "failed", "seconds", "images_per_minute",
+                                                               "latency_p50", "latency_p90", "retries")}
+    return resultados
+
+
+def bench_capture(corpus, repeticiones, model_id=BENCH_MODEL):
+    """Recorte → preprocesado → codificación → petición → tabla, por fases (sin dibujar en Tk)"""
+    import openrouter_client
+    from config_manager import DEFAULT_CONFIG
+    from image_encoder import encode_image, get_encoding_settings
+    from image_preprocess import preprocess_image, get_preprocess_settings
+    from prompts import build_prompt, build_payload
+    from table_parser import parse_table
+
+    pantalla = next(e["image"] for e in corpus if e["kind"] == "Excel" and e["image"].width >= 1920)
+    region = (pantalla.width // 8, pantalla.height // 8, pantalla.width * 5 // 8, pantalla.height * 5 // 8)
+    preprocess = dict(get_preprocess_settings(DEFAULT_CONFIG["image_preprocess"]), measure_bytes=False)
+    encoding = get_encoding_settings(DEFAULT_CONFIG["image_encoding"], model_id)
+    prompt = build_prompt("Excel", DEFAULT_CONFIG["prompt_excel"])
+    fases = {"recorte": [], "preprocesado": [], "codificacion": [], "peticion": [], "tabla": [], "total": []}
+    for i in range(repeticiones + 1):
+        marcas = [time.perf_counter()]
+        recorte = pantalla.crop(region)
+        marcas.append(time.perf_counter())
+        recorte, _ = preprocess_image(recorte, preprocess, model_id, encoding)
+        marcas.append(time.perf_counter())
+        codificada = encode_image(recorte, encoding)
+        marcas.append(time.perf_counter())
+        response = openrouter_client.post_chat_completion(BENCH_API_KEY, build_payload(model_id, prompt, codificada))
+        output = response.json()["choices"][0]["message"]["content"]
+        marcas.append(time.perf_counter())
+        parse_table(output).rows()
+        marcas.append(time.perf_counter())
+        if i == 0:
+            continue  # calentamiento
+        for fase, inicio, fin in zip(("recorte", "preprocesado", "codificacion", "peticion", "tabla"), marcas, marcas[1:]):
+            fases[fase].append((fin - inicio) * 1000)
+        fases["total"].append((marcas[-1] - marcas[0]) * 1000)
+    return {fase: summarize(valores) for fase, valores in fases.items()}
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_suite(suites=SUITES, repeticiones=10, latency=0.05, error_rate=0.0, resolutions=DEFAULT_RESOLUTIONS,
+              guardar_corpus=None):
+    """Ejecuta las pruebas indicadas con una carpeta de configuración temporal y devuelve el informe"""
+    with tempfile.TemporaryDirectory(prefix="snip_bench_") as carpeta:
+        # La configuración, la caché y la telemetría del usuario no se tocan
+        os.environ["HOME"] = os.environ["APPDATA"] = carpeta
+        import openrouter_client
+
+        servidor = MockOpenRouter(latency=latency, error_rate=error_rate).start()
+        openrouter_client.set_base_url(servidor.base_url)
+        inicio = time.perf_counter()
+        corpus = generate_corpus(resolutions)
+        print(f"Corpus: {len(corpus)} capturas generadas en {time.perf_counter() - inicio:.1f} s")
+        if guardar_corpus:
+            os.makedirs(guardar_corpus, exist_ok=True)
+            for entrada in corpus:
+                entrada["image"].save(os.path.join(guardar_corpus, entrada["name"] + ".png"))
+
+        pruebas = {
+            "codificacion": lambda: bench_encoding(corpus, repeticiones),
+            "preprocesado": lambda: bench_preprocess(corpus, repeticiones),
+            "tsv": lambda: bench_tsv(repeticiones),
+            "config": lambda: bench_config(repeticiones * 5),
+            "key": lambda: bench_key(repeticiones),
+            "stream": lambda: bench_stream(repeticiones),
+            "lote": lambda: bench_batch(corpus, carpeta),
+            "captura": lambda: bench_capture(corpus, repeticiones),
+        }
+        resultados = {}
+        try:
+            for nombre in suites:
+                print(f"Ejecutando {nombre}…")
+                resultados[nombre] = pruebas[nombre]()
+        finally:
+            openrouter_client.close_session()
+            servidor.shutdown()
+
+    return {
+        "timestamp": time.time(),
+        "commit": _commit_actual(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"repeats": repeticiones, "latency_s": latency, "error_rate": error_rate,
+                     "resolutions": [list(r) for r in resolutions]},
+        "server": servidor.stats,
+        "results": resultados,
+    }
+
+
+def _aplanar(resultados, prefijo=""):
+    """{"a": {"b": {"p50": 1}}} → {"a/b": {"p50": 1}} para comparar informes"""
+    plano = {}
+    for clave, valor in resultados.items():
+        if isinstance(valor, dict) and "p50" not in valor and "images_per_minute" not in valor:
+            plano.update(_aplanar(valor, f"{prefijo}{clave}/"))
+        else:
+            plano[f"{prefijo}{clave}"] = valor
+    return plano
+
+
+def compare(anterior, actual, umbral=0.10):
+    """
+    Líneas con el cambio de p50 (o de imágenes por minuto en el lote) entre dos
+    informes; devuelve (líneas, número de empeoramientos por encima del umbral).
+    """
+    previos, nuevos = _aplanar(anterior["results"]), _aplanar(actual["results"])
+    lineas, peores = [], 0
+    for clave in sorted(set(previos) & set(nuevos)):
+        metrica = "images_per_minute" if "images_per_minute" in nuevos[clave] else "p50"
+        antes, despues = previos[clave].get(metrica), nuevos[clave].get(metrica)
+        if not antes or despues is None:
+            continue
+        cambio = despues / antes - 1
+        # En el lote más es mejor; en los tiempos, menos
+        empeora = cambio < -umbral if metrica == "images_per_minute" else cambio > umbral
+        peores += empeora
+        lineas.append(f"{'!' if empeora else ' '} {clave:<45}{antes:>12.2f}{despues:>12.2f}{cambio:>+9.0%}")
+    return lineas, peores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks sin conexión con un servidor OpenRouter simulado.")
+    parser.add_argument("--salida", help="Archivo JSON donde guardar el resultado")
+    parser.add_argument("--repeticiones", type=int, default=10)
+    parser.add_argument("--latencia", type=float, default=0.05, help="Latencia simulada del servidor (s)")
+    parser.add_argument("--errores", type=float, default=0.0, help="Fracción de respuestas 429/503 simuladas")
+    parser.add_argument("--solo", help=f"Pruebas separadas por comas ({', '.join(SUITES)})")
+    parser.add_argument("--comparar", help="Informe JSON anterior con el que comparar")
+    parser.add_argument("--umbral", type=float, default=0.10, help="Empeoramiento tolerado al comparar (0.10 = 10%%)")
+    parser.add_argument("--guardar-corpus", help="Carpeta donde guardar las capturas generadas")
+    args = parser.parse_args(argv)
+
+    suites = SUITES
+    if args.solo:
+        suites = [s.strip() for s in args.solo.split(",") if s.strip()]
+        desconocidas = [s for s in suites if s not in SUITES]
+        if desconocidas:
+            parser.error(f"pruebas desconocidas: {', '.join(desconocidas)}")
+
+    informe = run_suite(suites, args.repeticiones, args.latencia, args.errores, guardar_corpus=args.guardar_corpus)
+    texto = json.dumps(informe, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto)
+        print(f"Resultado guardado en {args.salida}")
+    else:
+        print(texto)
+
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f:
+            anterior = json.load(f)
+        lineas, peores = compare(anterior, informe, args.umbral)
+        print(f"\n  {'Prueba':<45}{'Antes':>12}{'Ahora':>12}{'Cambio':>9}")
+        print("\n".join(lineas))
+        if peores:
+            print(f"\n{peores} pruebas empeoran más de un {args.umbral:.0%}")
+            return 3
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
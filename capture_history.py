@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Historial local de capturas: imagen original, miniatura, modelo, modo,
+prompt, resultado, latencia y coste de cada captura procesada.
+
+Se guarda en history.sqlite3 en la carpeta de configuración. Las imágenes se
+guardan una sola vez (PNG) aunque se procesen con varios modelos, y el texto
+extraído tiene un índice de texto completo (FTS5). Los límites de tamaño,
+número de capturas y antigüedad se aplican al añadir. Para buscar:
+
+    python capture_history.py "factura 2024"
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+
+DB_FILENAME = "history.sqlite3"
+DEFAULT_MAX_MB = 200
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_MAX_AGE_DAYS = 180
+THUMBNAIL_SIDE = 160
+SNIPPET_CHARS = 80
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    digest TEXT PRIMARY KEY,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    thumbnail BLOB NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS prompts (
+    hash TEXT PRIMARY KEY,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    image TEXT NOT NULL REFERENCES images (digest),
+    model TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL REFERENCES prompts (hash),
+    output TEXT NOT NULL,
+    latency_ms REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    cost REAL
+);
+CREATE INDEX IF NOT EXISTS captures_ts ON captures (ts);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS captures_fts USING fts5(
+    output, content='captures', content_rowid='id', tokenize='unicode61 remove_diacritics 1'
+);
+CREATE TRIGGER IF NOT EXISTS captures_ai AFTER INSERT ON captures BEGIN
+    INSERT INTO captures_fts (rowid, output) VALUES (new.id, new.output);
+END;
+CREATE TRIGGER IF NOT EXISTS captures_ad AFTER DELETE ON captures BEGIN
+    INSERT INTO captures_fts (captures_fts, rowid, output) VALUES ('delete', old.id, old.output);
+END;
+"""
+
+_COLUMNAS_LISTADO = "c.id, c.ts, c.model, c.mode, c.latency_ms, c.cost, i.width, i.height"
+
+
+def get_db_path():
+    from config_manager import get_config_dir
+    return os.path.join(get_config_dir(), DB_FILENAME)
+
+
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def fts_query(texto):
+    """Convierte lo que escribe el usuario en una consulta FTS5: todas las palabras, por prefijo"""
+    palabras = texto.replace('"', " ").split()
+    return " ".join(f'"{p}"*' for p in palabras)
+
+
+def _png(img, **opciones):
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG", **opciones)
+    return buffer.getvalue()
+
+
+class CaptureHistory:
+    """Historial SQLite de capturas; se puede usar desde varios hilos"""
+
+    def __init__(self, path=None, max_mb=DEFAULT_MAX_MB, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.path = path or get_db_path()
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+        self.fts = True
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(max_mb=config.get('history_max_mb', DEFAULT_MAX_MB),
+                   max_entries=config.get('history_max_entries', DEFAULT_MAX_ENTRIES),
+                   max_age_days=config.get('history_max_age_days', DEFAULT_MAX_AGE_DAYS))
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            # Solo tiene efecto al crear la base; permite devolver al disco el espacio de lo borrado
+            self._conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self._conn.executescript(_SCHEMA)
+            try:
+                self._conn.executescript(_FTS_SCHEMA)
+            except sqlite3.OperationalError:
+                # SQLite compilado sin FTS5: la búsqueda usa LIKE
+                self.fts = False
+        return self._conn
+
+    def add(self, img, model, mode, prompt, output, latency_ms=None, usage=None):
+        """Guarda una captura procesada y aplica los límites; devuelve su id (None si falla)"""
+        from result_cache import image_digest
+        usage = usage or {}
+        digest = image_digest(img)
+        try:
+            with self._lock:
+                conn = self._connection()
+                if conn.execute("SELECT 1 FROM images WHERE digest = ?", (digest,)).fetchone() is None:
+                    miniatura = img.convert("RGB")
+                    miniatura.thumbnail((THUMBNAIL_SIDE, THUMBNAIL_SIDE))
+                    conn.execute("INSERT INTO images VALUES (?, ?, ?, ?, ?)",
+                                 (digest, img.width, img.height, _png(miniatura), _png(img, compress_level=6)))
+                hash_prompt = prompt_hash(prompt)
+                conn.execute("INSERT OR IGNORE INTO prompts VALUES (?, ?)", (hash_prompt, prompt))
+                cursor = conn.execute(
+                    "INSERT INTO captures (ts, image, model, mode, prompt_hash, output, latency_ms, prompt_tokens, "
+                    "completion_tokens, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (time.time(), digest, model, mode, hash_prompt, output, latency_ms, usage.get("prompt_tokens"),
+                     usage.get("completion_tokens"), usage.get("cost")))
+                conn.commit()
+                self._prune(conn)
+                return cursor.lastrowid
+        except sqlite3.Error as e:
+            print(f"Error al guardar en el historial: {e}")
+            return None
+
+    def _prune(self, conn):
+        """Borra por antigüedad, por número de capturas y, si se supera el tamaño, las más antiguas"""
+        conn.execute("DELETE FROM captures WHERE ts < ?", (time.time() - self.max_age,))
+        conn.execute("DELETE FROM captures WHERE id NOT IN (SELECT id FROM captures ORDER BY ts DESC LIMIT ?)",
+                     (self.max_entries,))
+        filas = conn.execute("SELECT id, image, length(output) FROM captures ORDER BY ts").fetchall()
+        tamanos = dict(conn.execute("SELECT digest, length(data) + length(thumbnail) FROM images"))
+        total = sum(tamanos.values()) + sum(f[2] for f in filas)
+        referencias = Counter(f[1] for f in filas)
+        borrar = []
+        for id_captura, digest, tamano in filas:
+            if total <= self.max_bytes:
+                break
+            borrar.append((id_captura,))
+            total -= tamano
+            referencias[digest] -= 1
+            if not referencias[digest]:
+                total -= tamanos.get(digest, 0)
+        conn.executemany("DELETE FROM captures WHERE id = ?", borrar)
+        conn.execute("DELETE FROM images WHERE digest NOT IN (SELECT image FROM captures)")
+        conn.execute("DELETE FROM prompts WHERE hash NOT IN (SELECT prompt_hash FROM captures)")
+        conn.commit()
+        conn.execute("PRAGMA incremental_vacuum")
+
+    def search(self, texto="", limit=200):
+        """Capturas más recientes que contienen todas las palabras (por prefijo) en el texto extraído"""
+        with self._lock:
+            conn = self._connection()
+            if not texto.strip():
+                filas = conn.execute(
+                    f"SELECT {_COLUMNAS_LISTADO}, substr(c.output, 1, {SNIPPET_CHARS}) FROM captures c "
+                    "JOIN images i ON i.digest = c.image ORDER BY c.ts DESC LIMIT ?", (limit,)).fetchall()
+            elif self.fts:
+                consulta = fts_query(texto)
+                if not consulta:
+                    return []
+                filas = conn.execute(
+                    f"SELECT {_COLUMNAS_LISTADO}, snippet(captures_fts, 0, '[', ']', '…', 10) "
+                    "FROM captures_fts JOIN captures c ON c.id = captures_fts.rowid JOIN images i ON i.digest = c.image "
+                    "WHERE captures_fts MATCH ? ORDER BY c.ts DESC LIMIT ?", (consulta, limit)).fetchall()
+            else:
+                palabras = texto.split()
+                filas = conn.execute(
+                    f"SELECT {_COLUMNAS_LISTADO}, substr(c.output, 1, {SNIPPET_CHARS}) FROM captures c "
+                    "JOIN images i ON i.digest = c.image WHERE " + " AND ".join("c.output LIKE ?" for _ in palabras)
+                    + " ORDER BY c.ts DESC LIMIT ?", [f"%{p}%" for p in palabras] + [limit]).fetchall()
+        claves = ("id", "ts", "model", "mode", "latency_ms", "cost", "width", "height", "snippet")
+        return [dict(zip(claves, fila)) for fila in filas]
+
+    def get(self, id_captura):
+        """Datos completos de una captura (sin la imagen) o None"""
+        with self._lock:
+            fila = self._connection().execute(
+                "SELECT c.id, c.ts, c.model, c.mode, p.text, c.output, c.latency_ms, c.cost, c.image "
+                "FROM captures c JOIN prompts p ON p.hash = c.prompt_hash WHERE c.id = ?", (id_captura,)).fetchone()
+        if fila is None:
+            return None
+        return dict(zip(("id", "ts", "model", "mode", "prompt", "output", "latency_ms", "cost", "image"), fila))
+
+    def thumbnail(self, id_captura):
+        """PNG de la miniatura (bytes) o None"""
+        with self._lock:
+            fila = self._connection().execute(
+                "SELECT i.thumbnail FROM captures c JOIN images i ON i.digest = c.image WHERE c.id = ?",
+                (id_captura,)).fetchone()
+        return fila[0] if fila else None
+
+    def image(self, id_captura):
+        """Imagen original (PIL) o None"""
+        from PIL import Image
+        with self._lock:
+            fila = self._connection().execute(
+                "SELECT i.data FROM captures c JOIN images i ON i.digest = c.image WHERE c.id = ?",
+                (id_captura,)).fetchone()
+        if fila is None:
+            return None
+        img = Image.open(io.BytesIO(fila[0]))
+        img.load()
+        return img
+
+    def delete(self, id_captura):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM captures WHERE id = ?", (id_captura,))
+            conn.execute("DELETE FROM images WHERE digest NOT IN (SELECT image FROM captures)")
+            conn.execute("DELETE FROM prompts WHERE hash NOT IN (SELECT prompt_hash FROM captures)")
+            conn.commit()
+
+    def size_bytes(self):
+        with self._lock:
+            conn = self._connection()
+            imagenes = conn.execute("SELECT COALESCE(SUM(length(data) + length(thumbnail)), 0) FROM images").fetchone()[0]
+            textos = conn.execute("SELECT COALESCE(SUM(length(output)), 0), COUNT(*) FROM captures").fetchone()
+        return imagenes + textos[0], textos[1]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Busca en el historial de capturas.")
+    parser.add_argument("texto", nargs="?", default="", help="Palabras a buscar en el texto extraído")
+    parser.add_argument("--limite", type=int, default=50, help="Número máximo de resultados")
+    parser.add_argument("--mostrar", type=int, metavar="ID", help="Muestra el resultado completo de una captura")
+    args = parser.parse_args(argv)
+
+    historial = CaptureHistory()
+    if not os.path.exists(historial.path):
+        print("Todavía no hay capturas en el historial.", file=sys.stderr)
+        return 1
+    try:
+        if args.mostrar is not None:
+            captura = historial.get(args.mostrar)
+            if captura is None:
+                print(f"No existe la captura {args.mostrar}.", file=sys.stderr)
+                return 1
+            print(captura["output"])
+            return 0
+        for e in historial.search(args.texto, args.limite):
+            fecha = time.strftime("%Y-%m-%d %H:%M", time.localtime(e["ts"]))
+            texto = " ".join(e["snippet"].split())
+            print(f"{e['id']:>6}  {fecha}  {e['mode']:<6}{e['model'][:32]:<33}{texto}")
+    finally:
+        historial.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
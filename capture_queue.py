@@ -0,0 +1,227 @@
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from request_engine import EngineBusyError
+from request_scheduler import RequestCancelled
+
+DEFAULT_PREPARE_WORKERS = 2
+BUSY_RETRY_SECONDS = 0.5  # Espera antes de reintentar si el motor está lleno por otras peticiones
+
+# Estados de un trabajo de la cola
+QUEUED = "en cola"
+PREPARING = "preparando"
+WAITING = "esperando turno"
+SENDING = "enviando"
+DONE = "completado"
+FAILED = "error"
+CANCELLED = "cancelado"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class QueueJob:
+    """Un recorte de la cola con su estado; solo se modifica desde el hilo de la interfaz"""
+
+    def __init__(self, job_id, image, mode, prompt, model_id, metrics=None):
+        self.id = job_id
+        self.image = image
+        self.mode = mode
+        self.prompt = prompt
+        self.model_id = model_id
+        self.metrics = dict(metrics or {})
+        self.state = QUEUED
+        self.detail = ""
+        self.payload = None
+        self.output = None
+        self.error = None
+        self.cached = False
+        self.created = time.perf_counter()
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.engine_job = None
+        self.context = {}  # Datos propios de quien usa la cola (p. ej. la clave de caché)
+
+    @property
+    def elapsed(self):
+        """Segundos desde que se añadió a la cola hasta que terminó (o hasta ahora)"""
+        return (self.finished or time.perf_counter()) - self.created
+
+
+def concatenate_tables(tablas):
+    """
+    Une varias tablas (listas de filas) una debajo de otra. Si una tabla empieza
+    con la misma cabecera que la primera, esa fila repetida se omite.
+    """
+    filas, cabecera = [], None
+    for tabla in tablas:
+        if not tabla:
+            continue
+        if cabecera is None:
+            cabecera = tuple(tabla[0])
+        elif tuple(tabla[0]) == cabecera:
+            tabla = tabla[1:]
+        filas.extend(tabla)
+    return filas
+
+
+class CaptureQueue:
+    """
+    Cola de recortes procesada en dos etapas que se solapan: la preparación
+    (preprocesado, codificación y caché) en un pool de hilos propio y las
+    peticiones en el RequestEngine, con como máximo max_in_flight a la vez.
+    Mientras unas capturas esperan respuesta, las siguientes ya se están
+    codificando. prepare(job) rellena job.payload (o job.output si hay caché)
+    y send(job) devuelve la salida del modelo. Los cambios de estado se
+    notifican con on_update(job) a través de deliver (hilo de la interfaz).
+    """
+
+    def __init__(self, engine, prepare, send, deliver, on_update=None, prepare_workers=DEFAULT_PREPARE_WORKERS,
+                 max_in_flight=4):
+        self.engine = engine
+        self.prepare = prepare
+        self.send = send
+        self.deliver = deliver
+        self.on_update = on_update or (lambda job: None)
+        self.max_in_flight = max(1, max_in_flight)
+        self.jobs = []
+        self._ids = itertools.count(1)
+        self._listos = deque()
+        self._activos = 0
+        self._reintento = None
+        self._executor = ThreadPoolExecutor(max_workers=max(1, prepare_workers), thread_name_prefix="cola")
+
+    def add(self, image, mode, prompt, model_id, metrics=None):
+        job = QueueJob(next(self._ids), image, mode, prompt, model_id, metrics)
+        self.jobs.append(job)
+        self.on_update(job)
+        self._executor.submit(self._preparar, job)
+        return job
+
+    def _cambiar(self, job, estado, detalle=""):
+        if job.state in FINISHED:
+            return
+        job.state, job.detail = estado, detalle
+        if estado in FINISHED:
+            job.finished = time.perf_counter()
+            job.payload = None  # La imagen codificada ya no hace falta
+        self.on_update(job)
+
+    def _preparar(self, job):
+        """Se ejecuta en el pool de preparación"""
+        if job.cancel_event.is_set():
+            return
+        self.deliver(lambda: self._cambiar(job, PREPARING))
+        try:
+            self.prepare(job)
+        except Exception as exc:
+            self.deliver(lambda error=str(exc): self._cambiar(job, FAILED, error))
+            return
+        self.deliver(lambda: self._preparado(job))
+
+    def _preparado(self, job):
+        if job.state in FINISHED:
+            return
+        if job.output is not None:
+            job.cached = True
+            self._cambiar(job, DONE, "desde caché")
+            return
+        self._cambiar(job, WAITING)
+        self._listos.append(job)
+        self._bombear()
+
+    def _bombear(self):
+        """Envía al motor los trabajos preparados mientras haya hueco"""
+        while self._listos and self._activos < self.max_in_flight:
+            job = self._listos.popleft()
+            if job.state in FINISHED:
+                continue
+            try:
+                job.engine_job = self.engine.submit(
+                    self.send, job, cancel_event=job.cancel_event,
+                    on_done=lambda output, job=job: self._terminado(job, output),
+                    on_error=lambda exc, job=job: self._fallido(job, exc))
+            except EngineBusyError:
+                # El motor está lleno por otras peticiones: se reintenta al terminar una
+                # de las nuestras o, si no hay ninguna en curso, pasado un momento
+                self._listos.appendleft(job)
+                if not self._activos and self._reintento is None:
+                    self._reintento = threading.Timer(BUSY_RETRY_SECONDS, lambda: self.deliver(self._reintentar))
+                    self._reintento.daemon = True
+                    self._reintento.start()
+                break
+            except RuntimeError as exc:
+                self._cambiar(job, FAILED, str(exc))
+                continue
+            self._activos += 1
+            self._cambiar(job, SENDING)
+
+    def _reintentar(self):
+        self._reintento = None
+        self._bombear()
+
+    def _terminado(self, job, output):
+        if job.state in FINISHED:
+            return  # Cancelado después de terminar pero antes de recibir el aviso
+        self._activos -= 1
+        job.output = output
+        self._cambiar(job, DONE)
+        self._bombear()
+
+    def _fallido(self, job, exc):
+        if job.state in FINISHED:
+            return
+        self._activos -= 1
+        if isinstance(exc, RequestCancelled):
+            self._cambiar(job, CANCELLED)
+        else:
+            job.error = str(exc)
+            self._cambiar(job, FAILED, str(exc))
+        self._bombear()
+
+    def set_detail(self, job, detalle):
+        """Actualiza el texto de progreso de un trabajo en curso (p. ej. un reintento)"""
+        if job.state not in FINISHED:
+            job.detail = detalle
+            self.on_update(job)
+
+    def cancel(self, job):
+        if job.state in FINISHED:
+            return
+        job.cancel_event.set()
+        if job.state == SENDING:
+            # El motor no avisa de los trabajos cancelados: se libera aquí su hueco
+            job.engine_job.cancel()
+            self._activos -= 1
+        self._cambiar(job, CANCELLED)
+        self._bombear()
+
+    def cancel_all(self):
+        for job in list(self.jobs):
+            self.cancel(job)
+
+    def clear_finished(self):
+        """Quita de la lista los trabajos terminados; devuelve los que se quitaron"""
+        quitados = [job for job in self.jobs if job.state in FINISHED]
+        self.jobs = [job for job in self.jobs if job.state not in FINISHED]
+        for job in quitados:
+            job.image = None
+        return quitados
+
+    def counts(self):
+        """Número de trabajos por estado"""
+        conteo = {}
+        for job in self.jobs:
+            conteo[job.state] = conteo.get(job.state, 0) + 1
+        return conteo
+
+    @property
+    def busy(self):
+        return any(job.state not in FINISHED for job in self.jobs)
+
+    def shutdown(self):
+        if self._reintento is not None:
+            self._reintento.cancel()
+        self.cancel_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
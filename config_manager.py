@@ -1,19 +1,88 @@
 import os
 import json
 import base64
-import requests
-from cryptography.fernet import Fernet
-from tkinter import messagebox, simpledialog
+import atexit
+import hashlib
+import threading
+import time
+import openrouter_client
 import tkinter as tk
 
 
 ENCRYPTION_KEY = "_PjqHMjuxoN8xivCT-23aaZn85UdflOY0sXvued8SKE="
+
+DEFAULT_MODEL = "Qwen2.5 VL 72B (Free)"
+
+# Modelos disponibles en OpenRouter (nombre visible -> id del modelo)
+MODEL_MAP = {
+    "Qwen2.5 VL 32B (Free)": "qwen/qwen2.5-vl-32b-instruct",
+    "Qwen2.5 VL 72B (Free)": "qwen/qwen2.5-vl-72b-instruct",
+    "Mistral 3.2 Small 24B (Free)": "mistralai/mistral-small-3.2-24b-instruct",
+    "Gemma 3 12B IT (Free)": "google/gemma-3-12b-it",
+    "Gemma 3 27B IT (Free)": "google/gemma-3-27b-it",
+    "Gemini 2.5 Flash Lite": "google/gemini-2.5-flash-lite",
+    "GPT-4.1 Mini": "openai/gpt-4.1-mini",
+}
+
 # Configuración por defecto
 DEFAULT_CONFIG = {
     "OPENROUTER_API_KEY": "",
-    "selected_model": "Qwen2.5 VL 72B (Free)",
+    "selected_model": DEFAULT_MODEL,
     "output_mode": "Excel",
     "auto_process_enabled": False,
+    "overlay_fps": 60,
+    "daemon_port": 47821,
+    "daemon_keepalive_seconds": 60,
+    "api_key_validation_ttl_hours": 24,
+    "streaming_enabled": True,
+    "max_in_flight_requests": 4,
+    "queue_prepare_workers": 2,
+    "retry_max_attempts": 4,
+    "retry_base_delay": 1.0,
+    "retry_max_delay": 30.0,
+    "rate_limit_per_minute": 20,
+    "rate_limit_burst": 4,
+    "request_deadline_seconds": 180,
+    "model_strategy": "single",
+    "race_models": ["Qwen2.5 VL 72B (Free)", "Mistral 3.2 Small 24B (Free)", "Gemma 3 27B IT (Free)"],
+    "race_width": 2,
+    "fallback_models": ["Qwen2.5 VL 72B (Free)", "Mistral 3.2 Small 24B (Free)", "Gemini 2.5 Flash Lite"],
+    "fallback_timeout_seconds": 60,
+    "adaptive_model_order": True,
+    "telemetry_enabled": True,
+    "telemetry_retention_days": 90,
+    "history_enabled": True,
+    "history_max_mb": 200,
+    "history_max_entries": 5000,
+    "history_max_age_days": 180,
+    "image_preprocess": {
+        "enabled": True,
+        "trim_borders": True,
+        "grayscale": True,
+        "bilevel": False,
+        "deskew": False,
+        "upscale_small_text": True,
+        "min_text_height": 9,
+        "max_upscale": 2.0
+    },
+    "capture_budget_tokens": 0,
+    "capture_budget_usd": 0.0,
+    "model_prices": {},
+    "tiling_enabled": True,
+    "tiling_min_height": 1600,
+    "tiling_band_height": 1000,
+    "tiling_overlap": 40,
+    "cache_enabled": True,
+    "cache_max_mb": 50,
+    "cache_max_age_days": 30,
+    "near_duplicate_mode": "ask",
+    "near_duplicate_threshold": 2,
+    "near_duplicate_max_entries": 50000,
+    "auto_export_path": "",
+    "export_csv_delimiter": ";",
+    "export_numbers": True,
+    "export_decimal_separator": "",  # "," o "."; vacío: 3.141 o 1,234 se guardan como texto
+    "export_last_dir": "",
     "prompt_excel": """Convierte esta imagen a un archivo Excel respetando al máximo la apariencia visual original.
 No reorganices, no reinterpretes ni parafrasees ningún texto.
 Si algo no se puede leer claramente, coloca la palabra "ilegible" en su celda.
@@ -23,7 +92,26 @@ Sé lo más fiel posible al diseño, como si fuera una reconstrucción visual ex
     "prompt_docs": """Extrae todo el texto legible de la imagen y respétalo tal cual aparece, sin parafrasear ni corregir errores.
 Si hay partes ilegibles, indícalo con la palabra "ilegible".
 No incluyas ningún texto adicional fuera del contenido extraído.
-El resultado debe estar listo para copiar y pegar en un documento de texto."""
+El resultado debe estar listo para copiar y pegar en un documento de texto.""",
+    # Codificación de la imagen enviada: "default" aplica a todos los modelos y
+    # cada id de MODEL_MAP puede sobrescribir sus claves (ver image_encoder.py)
+    "image_encoding": {
+        "default": {
+            "max_side": 2048,
+            "max_pixels": 2048 * 2048,
+            "formats": ["png", "webp_lossless", "jpeg", "webp"],
+            "jpeg_quality": 88,
+            "webp_quality": 85,
+            "palette_colors": 64
+        },
+        "qwen/qwen2.5-vl-32b-instruct": {"max_pixels": 1280 * 28 * 28},
+        "qwen/qwen2.5-vl-72b-instruct": {"max_pixels": 1280 * 28 * 28},
+        "mistralai/mistral-small-3.2-24b-instruct": {"max_side": 1540},
+        "google/gemma-3-12b-it": {"max_side": 1792},
+        "google/gemma-3-27b-it": {"max_side": 1792},
+        "google/gemini-2.5-flash-lite": {"max_side": 3072},
+        "openai/gpt-4.1-mini": {"max_side": 2048, "max_pixels": 2048 * 768}
+    }
 }
 
 def get_config_dir():
@@ -41,17 +129,37 @@ def get_config_file():
     """Obtiene la ruta completa del archivo de configuración"""
     return os.path.join(get_config_dir(), 'config.json')
 
+# Instancia de Fernet compartida (se crea una sola vez)
+_fernet = None
+
+# Configuración en memoria (con la API key desencriptada); se escribe a disco
+# de forma diferida para no releer/reescribir el archivo en cada cambio
+SAVE_DELAY = 0.5  # Segundos sin cambios antes de escribir el archivo
+_config = None
+_dirty = False
+_save_timer = None
+_config_lock = threading.RLock()
+_encrypted_key_cache = ("", "")  # (API key, API key encriptada) de la última escritura
+
+def _get_fernet():
+    """Crea el Fernet a partir de ENCRYPTION_KEY la primera vez que se necesita"""
+    global _fernet
+    if _fernet is None:
+        # cryptography solo se carga cuando hay que encriptar/desencriptar
+        from cryptography.fernet import Fernet
+
+        # Convertir la clave de string a bytes y crear un Fernet
+        key_bytes = base64.urlsafe_b64encode(ENCRYPTION_KEY.encode()[:32].ljust(32, b'0'))
+        _fernet = Fernet(key_bytes)
+    return _fernet
+
 def encrypt_api_key(api_key):
     """Encripta la API key usando Fernet"""
     if not api_key:
         return ""
     
-    # Convertir la clave de string a bytes y crear un Fernet
-    key_bytes = base64.urlsafe_b64encode(ENCRYPTION_KEY.encode()[:32].ljust(32, b'0'))
-    fernet = Fernet(key_bytes)
-    
     # Encriptar la API key
-    encrypted = fernet.encrypt(api_key.encode())
+    encrypted = _get_fernet().encrypt(api_key.encode())
     return base64.b64encode(encrypted).decode()
 
 def decrypt_api_key(encrypted_api_key):
@@ -60,20 +168,17 @@ def decrypt_api_key(encrypted_api_key):
         return ""
     
     try:
-        # Convertir la clave de string a bytes y crear un Fernet
-        key_bytes = base64.urlsafe_b64encode(ENCRYPTION_KEY.encode()[:32].ljust(32, b'0'))
-        fernet = Fernet(key_bytes)
-        
         # Desencriptar la API key
         encrypted_bytes = base64.b64decode(encrypted_api_key.encode())
-        decrypted = fernet.decrypt(encrypted_bytes)
+        decrypted = _get_fernet().decrypt(encrypted_bytes)
         return decrypted.decode()
     except Exception as e:
         print(f"Error al desencriptar API key: {e}")
         return ""
 
-def load_config():
-    """Carga la configuración desde el archivo JSON"""
+def _read_config_file():
+    """Lee y desencripta el archivo de configuración (solo la primera vez)"""
+    global _encrypted_key_cache
     config_file = get_config_file()
     
     try:
@@ -83,53 +188,105 @@ def load_config():
                 
             # Desencriptar la API key si existe
             if 'OPENROUTER_API_KEY' in config:
-                config['OPENROUTER_API_KEY'] = decrypt_api_key(config['OPENROUTER_API_KEY'])
+                encrypted = config['OPENROUTER_API_KEY']
+                config['OPENROUTER_API_KEY'] = decrypt_api_key(encrypted)
+                _encrypted_key_cache = (config['OPENROUTER_API_KEY'], encrypted)
                 
-            return config
+            return config, False
         else:
             # Si no existe, crear con valores por defecto
-            save_config(DEFAULT_CONFIG)
-            return DEFAULT_CONFIG.copy()
+            return DEFAULT_CONFIG.copy(), True
             
     except Exception as e:
         print(f"Error al cargar configuración: {e}")
         # En caso de error, devolver configuración por defecto
-        return DEFAULT_CONFIG.copy()
+        return DEFAULT_CONFIG.copy(), False
 
-def save_config(config):
-    """Guarda la configuración en el archivo JSON"""
-    config_file = get_config_file()
-    
-    try:
-        # Crear una copia para no modificar el original
-        config_to_save = config.copy()
-        
-        # Encriptar la API key antes de guardar
+def _get_store():
+    global _config
+    with _config_lock:
+        if _config is None:
+            _config, crear = _read_config_file()
+            if crear:
+                _mark_dirty()
+        return _config
+
+def load_config():
+    """Devuelve una copia de la configuración en memoria (se lee del disco una sola vez)"""
+    with _config_lock:
+        return dict(_get_store())
+
+def _mark_dirty():
+    """Marca la configuración como modificada y programa la escritura diferida"""
+    global _dirty, _save_timer
+    _dirty = True
+    if _save_timer is not None:
+        _save_timer.cancel()
+    _save_timer = threading.Timer(SAVE_DELAY, flush_config)
+    _save_timer.daemon = True
+    _save_timer.start()
+
+def flush_config():
+    """Escribe la configuración a disco si hay cambios (archivo temporal + renombrado atómico)"""
+    global _dirty, _save_timer, _encrypted_key_cache
+    with _config_lock:
+        if not _dirty or _config is None:
+            return
+        if _save_timer is not None:
+            _save_timer.cancel()
+            _save_timer = None
+        config_to_save = dict(_config)
+        _dirty = False
+
+        # Encriptar la API key solo si cambió desde la última escritura
         if 'OPENROUTER_API_KEY' in config_to_save:
-            config_to_save['OPENROUTER_API_KEY'] = encrypt_api_key(config_to_save['OPENROUTER_API_KEY'])
-        
-        with open(config_file, 'w', encoding='utf-8') as f:
-            json.dump(config_to_save, f, indent=2, ensure_ascii=False)
-            
-    except Exception as e:
-        print(f"Error al guardar configuración: {e}")
-        messagebox.showerror("Error", f"No se pudo guardar la configuración: {e}")
+            api_key = config_to_save['OPENROUTER_API_KEY']
+            if api_key != _encrypted_key_cache[0] or not _encrypted_key_cache[1]:
+                _encrypted_key_cache = (api_key, encrypt_api_key(api_key))
+            config_to_save['OPENROUTER_API_KEY'] = _encrypted_key_cache[1]
+
+        config_file = get_config_file()
+        tmp_file = config_file + ".tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(config_to_save, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, config_file)
+        except Exception as e:
+            _dirty = True
+            print(f"Error al guardar configuración: {e}")
+
+def save_config(config):
+    """Reemplaza la configuración en memoria y programa su escritura a disco"""
+    global _config
+    with _config_lock:
+        _config = dict(config)
+        _mark_dirty()
 
 def update_config(key, value):
     """Actualiza un valor específico en la configuración"""
-    config = load_config()
-    config[key] = value
-    save_config(config)
+    update_configs({key: value})
+
+def update_configs(values):
+    """Actualiza varios valores de la configuración con una sola escritura"""
+    with _config_lock:
+        store = _get_store()
+        cambios = {k: v for k, v in values.items() if store.get(k, object()) != v}
+        if cambios:
+            store.update(cambios)
+            _mark_dirty()
 
 def get_api_key():
-    """Obtiene la API key de la configuración"""
-    config = load_config()
-    return config.get('OPENROUTER_API_KEY', '')
+    """Obtiene la API key de la configuración (en memoria, sin tocar el disco)"""
+    with _config_lock:
+        return _get_store().get('OPENROUTER_API_KEY', '')
 
 def set_api_key(api_key):
     """Establece la API key en la configuración"""
     update_config('OPENROUTER_API_KEY', api_key)
 
+# Asegura que los cambios pendientes se escriban al cerrar
+atexit.register(flush_config)
+
 def ask_for_api_key(parent=None):
     """Muestra un diálogo para pedir la API key al usuario"""
     temp_root = None
@@ -230,8 +387,8 @@ def ask_for_api_key(parent=None):
     
     return result[0]
 
-def validate_api_key(api_key):
-    """Valida que la API key sea correcta haciendo una petición al endpoint de uso"""
+def is_api_key_format_valid(api_key):
+    """Comprobación local del formato de la API key (sin red)"""
     if not api_key or not api_key.strip():
         return False
     
@@ -242,25 +399,56 @@ def validate_api_key(api_key):
         return False
     
     # Debe empezar con 'sk-' (formato estándar de OpenRouter)
-    if not api_key.startswith('sk-'):
+    return api_key.startswith('sk-')
+
+def check_api_key(api_key):
+    """
+    Valida la API key haciendo una petición al endpoint de uso.
+    Devuelve True (válida), False (inválida) o None si no se pudo verificar (sin conexión).
+    """
+    if not is_api_key_format_valid(api_key):
         return False
     
+    import requests
+
     # Validación real haciendo una petición al endpoint de uso
     try:
-        response = requests.get(
-            "https://openrouter.ai/api/v1/key",
-            headers={
-                "Authorization": f"Bearer {api_key}"
-            },
-            timeout=10
-        )
+        response = openrouter_client.get_key_info(api_key.strip())
         
-        # Si la respuesta es 200, la API key es válida
-        return response.status_code == 200
+        # Si la respuesta es 200, la API key es válida; 401/403 indican una clave rechazada
+        if response.status_code == 200:
+            return True
+        if response.status_code in (401, 403):
+            return False
+        print(f"Respuesta inesperada al validar API key: {response.status_code}")
+        return None
         
     except requests.exceptions.RequestException as e:
         print(f"Error de conexión al validar API key: {e}")
-        return False
+        return None
     except Exception as e:
         print(f"Error inesperado al validar API key: {e}")
-        return False 
\ No newline at end of file
+        return None
+
+def validate_api_key(api_key):
+    """Valida que la API key sea correcta haciendo una petición al endpoint de uso"""
+    return check_api_key(api_key) is True
+
+def _api_key_fingerprint(api_key):
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+def mark_api_key_validated(api_key):
+    """Guarda en la configuración cuándo se validó la API key (solo su hash, no la clave)"""
+    update_configs({
+        'api_key_validated_at': time.time(),
+        'api_key_validated_hash': _api_key_fingerprint(api_key),
+    })
+
+def is_api_key_validation_fresh(api_key, ttl_hours=None):
+    """Indica si la API key se validó hace menos de api_key_validation_ttl_hours"""
+    config = load_config()
+    if ttl_hours is None:
+        ttl_hours = config.get('api_key_validation_ttl_hours', DEFAULT_CONFIG['api_key_validation_ttl_hours'])
+    if not api_key or config.get('api_key_validated_hash') != _api_key_fingerprint(api_key):
+        return False
+    return time.time() - config.get('api_key_validated_at', 0) < ttl_hours * 3600
@@ -0,0 +1,142 @@
+import math
+
+from image_encoder import target_size
+
+CHARS_PER_TOKEN = 3.5   # Aproximación para texto en español
+DEFAULT_OUTPUT_TOKENS = {"Excel": 600, "Docs": 400}
+MIN_SIDE = 256          # Nunca se reduce la imagen por debajo de este lado (px)
+
+# Cómo cuenta cada proveedor los tokens de imagen (por prefijo del id de OpenRouter)
+IMAGE_TOKEN_RULES = [
+    # Qwen2.5-VL: un token por bloque de 28x28 px (parches de 14 px fusionados 2x2)
+    ("qwen/", {"kind": "patch", "patch": 28, "min_pixels": 4 * 28 * 28, "max_pixels": 16384 * 28 * 28, "extra": 2}),
+    # Mistral Small 3.x: bloques de 28 px, un token de salto por fila y lado máximo de 1540 px
+    ("mistralai/", {"kind": "patch", "patch": 28, "max_side": 1540, "row_break": True}),
+    # Gemma 3: la imagen se reescala a 896x896 y ocupa siempre 256 tokens
+    ("google/gemma", {"kind": "fixed", "tokens": 256}),
+    # Gemini: 258 tokens si cabe en 384x384; si no, 258 por cada tesela de 768x768
+    ("google/gemini", {"kind": "tiles", "small": 384, "tile": 768, "per_tile": 258}),
+    # GPT-4.1 mini: parches de 32 px, como máximo 1536, multiplicados por 1.62
+    ("openai/gpt-4.1-mini", {"kind": "patch", "patch": 32, "max_patches": 1536, "multiplier": 1.62}),
+]
+
+# Precio por millón de tokens (entrada, salida) en USD; config["model_prices"] los sobrescribe
+DEFAULT_PRICES = {
+    "google/gemini-2.5-flash-lite": (0.10, 0.40),
+    "openai/gpt-4.1-mini": (0.40, 1.60),
+}
+
+
+def _rule(model_id):
+    for prefijo, regla in IMAGE_TOKEN_RULES:
+        if model_id.startswith(prefijo):
+            return regla
+    return {"kind": "patch", "patch": 28}
+
+
+def image_tokens(model_id, width, height):
+    """Tokens que ocupará una imagen de width x height px en el modelo"""
+    regla = _rule(model_id)
+    if regla["kind"] == "fixed":
+        return regla["tokens"]
+    if regla["kind"] == "tiles":
+        if width <= regla["small"] and height <= regla["small"]:
+            return regla["per_tile"]
+        return math.ceil(width / regla["tile"]) * math.ceil(height / regla["tile"]) * regla["per_tile"]
+
+    patch = regla["patch"]
+    if regla.get("max_side") and max(width, height) > regla["max_side"]:
+        escala = regla["max_side"] / max(width, height)
+        width, height = width * escala, height * escala
+    pixeles = width * height
+    if regla.get("max_pixels") and pixeles > regla["max_pixels"]:
+        escala = (regla["max_pixels"] / pixeles) ** 0.5
+        width, height = width * escala, height * escala
+    elif regla.get("min_pixels") and pixeles < regla["min_pixels"]:
+        escala = (regla["min_pixels"] / pixeles) ** 0.5
+        width, height = width * escala, height * escala
+    columnas, filas = math.ceil(width / patch), math.ceil(height / patch)
+    if regla.get("max_patches") and columnas * filas > regla["max_patches"]:
+        escala = (regla["max_patches"] / (columnas * filas)) ** 0.5
+        columnas, filas = max(1, math.floor(columnas * escala)), max(1, math.floor(filas * escala))
+    tokens = columnas * filas + (filas if regla.get("row_break") else 0) + regla.get("extra", 0)
+    return math.ceil(tokens * regla.get("multiplier", 1.0))
+
+
+def text_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate(model_id, width, height, prompt, mode, prices=None, output_tokens=None):
+    """
+    Estimación antes de enviar: tokens de imagen (según las dimensiones ya
+    codificadas), tokens del prompt, tokens de salida esperados y coste en USD.
+    """
+    precios = dict(DEFAULT_PRICES, **(prices or {}))
+    precio_entrada, precio_salida = precios.get(model_id, (0.0, 0.0))
+    imagen = image_tokens(model_id, width, height)
+    texto = text_tokens(prompt)
+    salida = output_tokens or DEFAULT_OUTPUT_TOKENS.get(mode, 500)
+    return {
+        "image_tokens": imagen,
+        "prompt_tokens": texto,
+        "input_tokens": imagen + texto,
+        "output_tokens": salida,
+        "cost": ((imagen + texto) * precio_entrada + salida * precio_salida) / 1_000_000,
+        "size": (width, height),
+    }
+
+
+def fit_to_budget(model_id, width, height, prompt_tokens, budget_tokens):
+    """
+    Tamaño (ancho, alto) más grande cuya entrada no supera budget_tokens, o None
+    si la imagen ya cabe o si reducirla no sirve (p. ej. Gemma, coste fijo).
+    """
+    if not budget_tokens or image_tokens(model_id, width, height) + prompt_tokens <= budget_tokens:
+        return None
+    minimo = MIN_SIDE / min(width, height)
+    if minimo >= 1:
+        return None
+    if image_tokens(model_id, max(1, int(width * minimo)), max(1, int(height * minimo))) >= image_tokens(model_id, width, height):
+        return None
+    bajo, alto = minimo, 1.0
+    for _ in range(20):
+        medio = (bajo + alto) / 2
+        if image_tokens(model_id, int(width * medio), int(height * medio)) + prompt_tokens <= budget_tokens:
+            bajo = medio
+        else:
+            alto = medio
+    return max(1, int(width * bajo)), max(1, int(height * bajo))
+
+
+def budget_tokens(max_tokens=0, max_usd=0.0, model_id=None, prices=None, output_tokens=0):
+    """
+    Presupuesto de tokens de entrada por captura: el menor entre max_tokens y
+    lo que permite max_usd con el precio del modelo (0 = sin límite).
+    """
+    limites = [max_tokens] if max_tokens else []
+    precio_entrada, precio_salida = dict(DEFAULT_PRICES, **(prices or {})).get(model_id, (0.0, 0.0))
+    if max_usd and precio_entrada:
+        limites.append(int((max_usd * 1_000_000 - output_tokens * precio_salida) / precio_entrada))
+    return max(1, min(limites)) if limites else 0
+
+
+def budget_settings(settings, model_id, size, prompt, budget_tokens):
+    """
+    Ajusta max_pixels de la configuración de codificación para respetar el
+    presupuesto de tokens. Devuelve (settings, tamaño reducido o None).
+    """
+    ancho, alto = target_size(size[0], size[1], settings)
+    reducido = fit_to_budget(model_id, ancho, alto, text_tokens(prompt), budget_tokens)
+    if reducido is None:
+        return settings, None
+    return dict(settings, max_pixels=reducido[0] * reducido[1]), reducido
+
+
+def describe_estimate(est, budget_size=None):
+    """Texto corto para la ventana de confirmación"""
+    coste = "gratis" if est["cost"] == 0 else f"≈ ${est['cost']:.5f}"
+    texto = f"≈ {est['image_tokens']} tokens de imagen + {est['prompt_tokens']} de prompt · {coste}"
+    if budget_size:
+        texto += f"\nSe reducirá a {budget_size[0]}x{budget_size[1]} px para no superar el presupuesto"
+    return texto
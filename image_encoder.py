@@ -0,0 +1,144 @@
+import base64
+import io
+import time
+
+from PIL import Image, features
+
+# Configuración de codificación por defecto; config["image_encoding"]["default"] y
+# config["image_encoding"][<id de MODEL_MAP>] sobrescriben estas claves
+DEFAULT_ENCODING = {
+    "max_side": 2048,          # Lado máximo útil para el modelo (px)
+    "max_pixels": 2048 * 2048, # Área máxima útil para el modelo (px²)
+    "formats": ["png", "webp_lossless", "jpeg", "webp"],
+    "jpeg_quality": 88,
+    "webp_quality": 85,
+    "palette_colors": 64,      # Colores para cuantizar capturas tipo hoja de cálculo
+    "palette_max_colors": 256, # Si la imagen tiene más colores, no se cuantiza
+}
+
+MIME_TYPES = {
+    "png": "image/png",
+    "webp_lossless": "image/webp",
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+}
+
+
+def get_encoding_settings(encoding_config, model_id):
+    """Combina la configuración por defecto con la específica del modelo"""
+    encoding_config = encoding_config or {}
+    settings = dict(DEFAULT_ENCODING)
+    settings.update(encoding_config.get("default", {}))
+    settings.update(encoding_config.get(model_id, {}))
+    return settings
+
+
+def _tamano_objetivo(width, height, max_side, max_pixels):
+    """Calcula el tamaño reducido que respeta max_side y max_pixels (nunca amplía)"""
+    scale = 1.0
+    if max_side and max(width, height) > max_side:
+        scale = min(scale, max_side / max(width, height))
+    if max_pixels and width * height > max_pixels:
+        scale = min(scale, (max_pixels / (width * height)) ** 0.5)
+    if scale >= 1.0:
+        return width, height
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def target_size(width, height, settings):
+    """Tamaño final que tendrá una imagen de width x height px con esta configuración"""
+    return _tamano_objetivo(width, height, settings["max_side"], settings["max_pixels"])
+
+
+def _es_captura_de_pocos_colores(img, max_colors):
+    """Indica si la imagen tiene pocos colores (tablas, texto sobre fondo plano)"""
+    muestra = img.copy()
+    muestra.thumbnail((256, 256))
+    return muestra.getcolors(maxcolors=max_colors) is not None
+
+
+def _guardar(img, fmt, settings):
+    buffer = io.BytesIO()
+    if fmt == "png":
+        img.save(buffer, format="PNG")
+    elif fmt == "webp_lossless":
+        img.save(buffer, format="WEBP", lossless=True, method=4)
+    elif fmt == "webp":
+        img.convert("RGB").save(buffer, format="WEBP", quality=settings["webp_quality"], method=4)
+    elif fmt == "jpeg":
+        # subsampling=0 (4:4:4) evita que los bordes del texto se emborronen
+        img.convert("RGB").save(buffer, format="JPEG", quality=settings["jpeg_quality"],
+                                subsampling=0, optimize=True)
+    else:
+        raise ValueError(f"Formato de imagen no soportado: {fmt}")
+    return buffer.getvalue()
+
+
+def encode_image(img, settings=None):
+    """
+    Codifica la imagen eligiendo el formato más pequeño entre los permitidos.
+
+    Devuelve un diccionario con base64, mime, formato, dimensiones finales,
+    bytes del PNG original, bytes codificados y el tiempo de codificación.
+    """
+    settings = settings or dict(DEFAULT_ENCODING)
+    inicio = time.perf_counter()
+    original_size = img.size
+    if img.mode not in ("RGB", "RGBA", "L"):
+        img = img.convert("RGB")
+
+    original_png = _guardar(img, "png", settings)
+    # Se detecta antes de reducir: el reescalado suaviza bordes y añade colores
+    pocos_colores = _es_captura_de_pocos_colores(img, settings["palette_max_colors"])
+
+    width, height = _tamano_objetivo(img.width, img.height, settings["max_side"], settings["max_pixels"])
+    if (width, height) != img.size:
+        img = img.resize((width, height), Image.LANCZOS)
+
+    formats = [f for f in settings["formats"] if f in MIME_TYPES]
+    if not features.check("webp"):
+        formats = [f for f in formats if not f.startswith("webp")]
+
+    candidatos = []
+    if (width, height) == original_size and "png" in formats:
+        candidatos.append(("png", original_png))
+        formats = [f for f in formats if f != "png"]
+
+    # Las capturas de hojas de cálculo suelen tener pocos colores: una paleta
+    # mantiene el texto nítido y reduce mucho el PNG, así que no se prueba
+    # ningún formato con pérdida.
+    if pocos_colores:
+        paleta = img.convert("RGB").quantize(colors=settings["palette_colors"])
+        candidatos.append(("png", _guardar(paleta, "png", settings)))
+        formats = [f for f in formats if f in ("png", "webp_lossless")]
+
+    for fmt in formats:
+        try:
+            candidatos.append((fmt, _guardar(img, fmt, settings)))
+        except (OSError, ValueError) as e:
+            print(f"No se pudo codificar en {fmt}: {e}")
+
+    if not candidatos:
+        candidatos.append(("png", original_png))
+
+    fmt, data = min(candidatos, key=lambda c: len(c[1]))
+    return {
+        "base64": base64.b64encode(data).decode("utf-8"),
+        "mime": MIME_TYPES[fmt],
+        "format": fmt,
+        "size": (width, height),
+        "original_size": original_size,
+        "original_bytes": len(original_png),
+        "encoded_bytes": len(data),
+        "encode_ms": (time.perf_counter() - inicio) * 1000,
+    }
+
+
+def describe_encoding(info):
+    """Resumen legible de la codificación para mostrar al usuario"""
+    original = info["original_bytes"]
+    ahorro = 100 * (1 - info["encoded_bytes"] / original) if original else 0
+    width, height = info["size"]
+    return (f"Imagen: {info['format'].upper()} {width}x{height}, "
+            f"{info['encoded_bytes'] / 1024:.0f} KB "
+            f"(ahorro {ahorro:.0f}% frente a PNG de {original / 1024:.0f} KB)")
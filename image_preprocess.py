@@ -0,0 +1,278 @@
+import io
+import time
+
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+from cost_estimator import image_tokens
+from image_encoder import target_size
+
+# Configuración por defecto; config["image_preprocess"] sobrescribe estas claves
+DEFAULT_PREPROCESS = {
+    "enabled": True,
+    "trim_borders": True,
+    "trim_tolerance": 16,          # Diferencia máxima con el color del borde (0-255)
+    "trim_margin": 6,              # Margen que se deja alrededor del contenido (px)
+    "grayscale": True,
+    "grayscale_max_color": 0.01,   # Fracción máxima de píxeles con color para pasar a grises
+    "bilevel": False,              # Opcional: con varios tonos de texto se perdería información
+    "bilevel_max_midtones": 0.04,  # Fracción máxima de grises intermedios para pasar a blanco y negro
+    "bilevel_max_other_ink": 0.02, # Fracción máxima de tinta en otro tono (texto gris) para pasar a blanco y negro
+    "deskew": False,               # Los recortes de pantalla casi nunca están torcidos
+    "deskew_max_degrees": 5.0,
+    "upscale_small_text": True,
+    "min_text_height": 9,          # Altura del texto (px) por debajo de la cual se amplía
+    "max_upscale": 2.0,
+    "measure_bytes": True,         # Mide los bytes tras cada paso (PNG rápido)
+}
+
+ANALYSIS_SIDE = 600  # Lado máximo de la copia reducida para detectar color, inclinación y líneas
+
+
+def get_preprocess_settings(preprocess_config):
+    settings = dict(DEFAULT_PREPROCESS)
+    settings.update(preprocess_config or {})
+    return settings
+
+
+def _muestra(img):
+    muestra = img.copy()
+    muestra.thumbnail((ANALYSIS_SIDE, ANALYSIS_SIDE))
+    return muestra
+
+
+def _color_fondo(img):
+    """Color más frecuente en las cuatro esquinas"""
+    w, h = img.size
+    esquinas = [img.getpixel(p) for p in ((0, 0), (w - 1, 0), (0, h - 1), (w - 1, h - 1))]
+    return max(esquinas, key=esquinas.count)
+
+
+def _tinta(gris):
+    """Máscara con el texto en blanco (255) sobre negro, sea cual sea el fondo"""
+    fondo = _color_fondo(gris)
+    return ImageChops.difference(gris, Image.new("L", gris.size, fondo)).point(lambda p: 255 if p > 64 else 0)
+
+
+def _perfil_filas(mascara):
+    """Media de cada fila (0-255) usando un reescalado a una columna"""
+    return list(mascara.resize((1, mascara.height), Image.BOX).tobytes())
+
+
+def trim_borders(img, tolerance, margin):
+    """Quita los márgenes de color uniforme; devuelve la misma imagen si no hay nada que quitar"""
+    fondo = Image.new(img.mode, img.size, _color_fondo(img))
+    diferencia = ImageChops.difference(img, fondo)
+    if diferencia.mode != "L":
+        diferencia = diferencia.convert("L")
+    caja = diferencia.point(lambda p: 255 if p > tolerance else 0).getbbox()
+    if caja is None:
+        return img
+    izquierda, arriba, derecha, abajo = caja
+    caja = (max(0, izquierda - margin), max(0, arriba - margin),
+            min(img.width, derecha + margin), min(img.height, abajo + margin))
+    if caja == (0, 0, img.width, img.height):
+        return img
+    return img.crop(caja)
+
+
+def color_ratio(img):
+    """Fracción de píxeles con color apreciable (saturación y brillo medios)"""
+    hsv = _muestra(img).convert("RGB").convert("HSV")
+    _, saturacion, brillo = hsv.split()
+    con_color = ImageChops.multiply(saturacion.point(lambda p: 255 if p > 60 else 0),
+                                    brillo.point(lambda p: 255 if p > 60 else 0))
+    histograma = con_color.histogram()
+    return histograma[255] / max(1, sum(histograma))
+
+
+def midtone_ratio(gris):
+    """Fracción de píxeles grises intermedios (antialiasing, fotos, degradados)"""
+    histograma = _muestra(gris).histogram()
+    return sum(histograma[48:208]) / max(1, sum(histograma))
+
+
+def otsu_threshold(histograma):
+    """Umbral que mejor separa los dos grupos del histograma (método de Otsu)"""
+    total = sum(histograma)
+    suma_total = sum(i * n for i, n in enumerate(histograma))
+    suma_fondo = peso_fondo = 0
+    mejor, umbral = -1.0, 127
+    for i, n in enumerate(histograma):
+        peso_fondo += n
+        if not peso_fondo or peso_fondo == total:
+            continue
+        suma_fondo += i * n
+        media_fondo = suma_fondo / peso_fondo
+        media_resto = (suma_total - suma_fondo) / (total - peso_fondo)
+        varianza = peso_fondo * (total - peso_fondo) * (media_fondo - media_resto) ** 2
+        if varianza > mejor:
+            mejor, umbral = varianza, i
+    return umbral
+
+
+def bilevel_threshold(gris, max_other_ink):
+    """
+    Umbral de Otsu para pasar a blanco y negro, o None si el texto tiene varios
+    tonos de tinta (p. ej. negro y gris) que el umbral juntaría o borraría. Un
+    píxel de tinta cuenta como de otro tono si ningún vecino se acerca a la
+    tinta más oscura: los bordes con antialiasing siempre tocan el trazo.
+    """
+    if _color_fondo(gris) < 128:
+        gris = ImageOps.invert(gris)  # Texto claro sobre fondo oscuro
+    fondo = _color_fondo(gris)
+    histograma = gris.histogram()
+    limite_tinta = max(0, fondo - 64)
+    total_tinta = sum(histograma[:limite_tinta])
+    if not total_tinta:
+        return None
+    acumulado, oscura = 0, 0
+    for oscura, n in enumerate(histograma[:limite_tinta]):
+        acumulado += n
+        if acumulado >= total_tinta * 0.05:
+            break
+    tinta = gris.point(lambda p: 255 if p < limite_tinta else 0)
+    lejos = gris.filter(ImageFilter.MinFilter(3)).point(lambda p: 255 if p > oscura + 64 else 0)
+    otra_tinta = ImageChops.multiply(tinta, lejos).histogram()[255]
+    if otra_tinta > total_tinta * max_other_ink:
+        return None
+    return otsu_threshold(histograma)
+
+
+def detect_skew(img, max_degrees):
+    """Ángulo (grados) que endereza las líneas de texto, buscando el perfil de filas más marcado"""
+    mascara = _tinta(_muestra(img).convert("L"))
+
+    def nitidez(angulo):
+        perfil = _perfil_filas(mascara.rotate(angulo, resample=Image.BILINEAR, fillcolor=0))
+        return sum((a - b) ** 2 for a, b in zip(perfil, perfil[1:]))
+
+    mejor = max((a / 2 for a in range(int(-max_degrees * 2), int(max_degrees * 2) + 1)), key=nitidez)
+    fino = max((mejor + d / 10 for d in range(-4, 5)), key=nitidez)
+    return fino
+
+
+def text_line_height(gris):
+    """Altura mediana de las líneas de texto en px (None si no se distinguen líneas)"""
+    mascara = _tinta(gris)
+    datos, ancho = mascara.tobytes(), mascara.width
+    filas = [datos.count(0, i, i + ancho) < ancho for i in range(0, len(datos), ancho)]
+    alturas, actual = [], 0
+    for con_tinta in filas + [False]:
+        if con_tinta:
+            actual += 1
+        elif actual:
+            # Las líneas de la cuadrícula ocupan 1-2 px y no cuentan como texto
+            if actual >= 3:
+                alturas.append(actual)
+            actual = 0
+    if not alturas:
+        return None
+    return sorted(alturas)[len(alturas) // 2]
+
+
+def _bytes_png(img):
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG", compress_level=1)
+    return buffer.tell()
+
+
+def preprocess_image(img, settings=None, model_id=None, encoding_settings=None):
+    """
+    Aplica los pasos activos (recorte de bordes, enderezado, grises, ampliación
+    de texto pequeño y blanco y negro) y devuelve (imagen, pasos). Cada paso
+    aplicado es un diccionario con su nombre, ms, tamaño, bytes (PNG rápido,
+    solo para comparar) y tokens de imagen estimados para el modelo.
+    """
+    settings = settings or dict(DEFAULT_PREPROCESS)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    def medir(nombre, imagen, ms):
+        ancho, alto = target_size(imagen.width, imagen.height, encoding_settings) if encoding_settings else imagen.size
+        return {
+            "step": nombre,
+            "ms": ms,
+            "size": imagen.size,
+            "bytes": _bytes_png(imagen) if settings["measure_bytes"] else None,
+            "tokens": image_tokens(model_id, ancho, alto) if model_id else None,
+        }
+
+    pasos = [medir("original", img, 0.0)]
+
+    def paso(nombre, funcion):
+        nonlocal img
+        inicio = time.perf_counter()
+        resultado = funcion(img)
+        ms = (time.perf_counter() - inicio) * 1000
+        if resultado is not img:
+            img = resultado
+            pasos.append(medir(nombre, img, ms))
+
+    if settings["trim_borders"]:
+        paso("recorte de bordes", lambda im: trim_borders(im, settings["trim_tolerance"], settings["trim_margin"]))
+
+    if settings["deskew"]:
+        def enderezar(im):
+            angulo = detect_skew(im, settings["deskew_max_degrees"])
+            if abs(angulo) < 0.3:
+                return im
+            print(f"Imagen inclinada {angulo:.1f}°, se endereza")
+            return im.rotate(angulo, resample=Image.BICUBIC, fillcolor=_color_fondo(im))
+        paso("enderezado", enderezar)
+
+    umbral = None
+    if settings["grayscale"]:
+        def a_grises(im):
+            nonlocal umbral
+            if im.mode != "L" and color_ratio(im) > settings["grayscale_max_color"]:
+                return im
+            gris = im if im.mode == "L" else ImageOps.grayscale(im)
+            if settings["bilevel"] and midtone_ratio(gris) <= settings["bilevel_max_midtones"]:
+                umbral = bilevel_threshold(gris, settings["bilevel_max_other_ink"])
+            return gris
+        paso("escala de grises", a_grises)
+
+    if settings["upscale_small_text"]:
+        def ampliar(im):
+            altura = text_line_height(im if im.mode == "L" else ImageOps.grayscale(im))
+            if not altura or altura >= settings["min_text_height"]:
+                return im
+            escala = min(settings["max_upscale"], settings["min_text_height"] / altura)
+            if encoding_settings:
+                # No tiene sentido ampliar más de lo que el codificador va a reducir después
+                maximo = target_size(int(im.width * escala), int(im.height * escala), encoding_settings)
+                escala = min(escala, maximo[0] / im.width)
+            if escala < 1.1:
+                return im
+            return im.resize((int(im.width * escala), int(im.height * escala)), Image.LANCZOS)
+        paso("ampliación de texto", ampliar)
+
+    if umbral is not None:
+        paso("blanco y negro", lambda im: im.point(lambda p: 255 if p > umbral else 0))
+
+    return img, pasos
+
+
+def describe_preprocess(pasos):
+    """Resumen de una línea con los pasos aplicados y el ahorro total"""
+    if len(pasos) < 2:
+        return ""
+    original, final = pasos[0], pasos[-1]
+    partes = [", ".join(p["step"] for p in pasos[1:])]
+    if original["bytes"] and final["bytes"] is not None:
+        partes.append(f"{100 * (final['bytes'] / original['bytes'] - 1):+.0f}% bytes")
+    if original["tokens"] is not None and final["tokens"] is not None:
+        partes.append(f"{final['tokens'] - original['tokens']:+d} tokens")
+    partes.append(f"{sum(p['ms'] for p in pasos):.0f} ms")
+    return "Preprocesado: " + " · ".join(partes)
+
+
+def print_report(pasos):
+    """Muestra en consola el tiempo y el ahorro de cada paso"""
+    for anterior, actual in zip(pasos, pasos[1:]):
+        linea = f"  {actual['step']}: {actual['ms']:.1f} ms, {actual['size'][0]}x{actual['size'][1]}"
+        if actual["bytes"] is not None:
+            linea += f", {actual['bytes'] / 1024:.0f} KB ({(actual['bytes'] - anterior['bytes']) / 1024:+.0f} KB)"
+        if actual["tokens"] is not None:
+            linea += f", {actual['tokens']} tokens ({actual['tokens'] - anterior['tokens']:+d})"
+        print(linea)
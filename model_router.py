@@ -0,0 +1,200 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from prompts import build_payload, strip_code_fences
+from table_parser import parse_table
+from request_scheduler import RequestCancelled
+
+STATS_FILENAME = "model_stats.json"
+MAX_LATENCY_SAMPLES = 200  # Latencias guardadas por modelo (las más recientes)
+MIN_SAMPLES = 3            # Resultados necesarios para reordenar un modelo según sus datos
+DEFAULT_RACE_WIDTH = 2
+DEFAULT_FALLBACK_TIMEOUT = 60.0
+
+
+def get_stats_path():
+    from config_manager import get_config_dir
+    return os.path.join(get_config_dir(), STATS_FILENAME)
+
+
+def is_valid_output(output, mode):
+    """
+    Una respuesta es válida si tiene contenido y, en Excel, si se puede leer
+    como tabla. Una sola columna vale si tiene más de una fila; una sola celda
+    suelta suele ser una frase del modelo y no una tabla.
+    """
+    if mode != "Excel":
+        return bool(strip_code_fences(output or ""))
+    tabla = parse_table(output)
+    return tabla.n_rows > 0 and (tabla.format != "tsv" or tabla.n_cols > 1 or tabla.n_rows > 1)
+
+
+class ModelStats:
+    """Victorias, errores y latencias por modelo, guardados en un JSON pequeño"""
+
+    def __init__(self, path=None):
+        self.path = path or get_stats_path()
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+
+    def _model(self, model_id):
+        return self.data.setdefault(model_id, {"races": 0, "wins": 0, "ok": 0, "errors": 0, "latencies": []})
+
+    def record(self, model_id, ok, latency=None):
+        with self._lock:
+            entrada = self._model(model_id)
+            entrada["ok" if ok else "errors"] += 1
+            if ok and latency is not None:
+                entrada["latencies"] = (entrada["latencies"] + [round(latency, 3)])[-MAX_LATENCY_SAMPLES:]
+
+    def record_race(self, participants, winner):
+        with self._lock:
+            for model_id in participants:
+                self._model(model_id)["races"] += 1
+            if winner:
+                self._model(winner)["wins"] += 1
+
+    def win_rate(self, model_id):
+        entrada = self.data.get(model_id)
+        if not entrada or not entrada["races"]:
+            return None
+        return entrada["wins"] / entrada["races"]
+
+    def success_rate(self, model_id):
+        entrada = self.data.get(model_id)
+        if not entrada or entrada["ok"] + entrada["errors"] < MIN_SAMPLES:
+            return None
+        return entrada["ok"] / (entrada["ok"] + entrada["errors"])
+
+    def latency_percentile(self, model_id, p):
+        latencias = sorted(self.data.get(model_id, {}).get("latencies", []))
+        if not latencias:
+            return None
+        return latencias[min(len(latencias) - 1, int(len(latencias) * p / 100))]
+
+    def order(self, models):
+        """
+        Ordena los modelos por latencia p50 dividida por la tasa de éxito. Los
+        modelos con pocos datos conservan su posición relativa detrás, y los que
+        nunca han respondido bien van al final.
+        """
+        def puntuacion(model_id):
+            exito = self.success_rate(model_id)
+            p50 = self.latency_percentile(model_id, 50)
+            if exito is None:
+                return (1, 0)
+            if p50 is None:
+                return (2, 0)
+            return (0, p50 / max(exito, 0.05))
+        return sorted(models, key=puntuacion)
+
+    def save(self):
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.data, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Error al guardar las estadísticas de modelos: {e}")
+
+
+class ModelRouter:
+    """
+    Envía la misma imagen a varios modelos: en carrera (gana la primera
+    respuesta válida y se cancelan las demás) o en cadena (se prueba el
+    siguiente modelo si el anterior falla o tarda demasiado).
+    send(model_id, payload, deadline, cancel_event) devuelve el texto de la
+    respuesta y debe dejar de recibirla (cerrando la conexión) cuando se
+    activa cancel_event; si no, los perdedores de la carrera siguen generando
+    hasta el final. Aun así, cada modelo que ya recibió la imagen cobra la
+    entrada y lo generado hasta el cierre.
+    """
+
+    def __init__(self, send, stats):
+        self.send = send
+        self.stats = stats
+
+    def _attempt(self, model_id, payload, mode, deadline, cancel_event):
+        inicio = time.perf_counter()
+        output = self.send(model_id, payload, deadline, cancel_event)
+        latencia = time.perf_counter() - inicio
+        if not is_valid_output(output, mode):
+            raise ValueError("respuesta vacía o sin formato de tabla")
+        return output, latencia
+
+    def race(self, models, prompt, encoded_image, mode, deadline, cancel_event, on_update=None):
+        """Devuelve (modelo ganador, salida, latencia) o lanza el último error si todos fallan"""
+        resultados = queue.Queue()
+        eventos = {model_id: threading.Event() for model_id in models}
+
+        def competir(model_id):
+            try:
+                payload = build_payload(model_id, prompt, encoded_image)
+                resultados.put((model_id, self._attempt(model_id, payload, mode, deadline, eventos[model_id]), None))
+            except Exception as exc:
+                resultados.put((model_id, None, exc))
+
+        for model_id in models:
+            threading.Thread(target=competir, args=(model_id,), name=f"race-{model_id}", daemon=True).start()
+
+        ganador, error = None, None
+        try:
+            for _ in models:
+                while True:
+                    try:
+                        model_id, resultado, exc = resultados.get(timeout=0.2)
+                        break
+                    except queue.Empty:
+                        if cancel_event.is_set():
+                            raise RequestCancelled("Solicitud cancelada")
+                if exc is None:
+                    ganador = model_id
+                    self.stats.record(model_id, True, resultado[1])
+                    return model_id, resultado[0], resultado[1]
+                if not isinstance(exc, RequestCancelled):
+                    error = exc
+                    self.stats.record(model_id, False)
+                    if on_update:
+                        on_update(f"{model_id} falló: {exc}")
+            raise error or RuntimeError("Ningún modelo respondió")
+        finally:
+            for evento in eventos.values():
+                evento.set()
+            if not cancel_event.is_set():
+                self.stats.record_race(models, ganador)
+            self.stats.save()
+
+    def fallback(self, models, prompt, encoded_image, mode, deadline, cancel_event,
+                 timeout=DEFAULT_FALLBACK_TIMEOUT, on_update=None):
+        """Prueba los modelos en orden; devuelve (modelo, salida, latencia)"""
+        error = None
+        try:
+            for i, model_id in enumerate(models):
+                if cancel_event.is_set():
+                    raise RequestCancelled("Solicitud cancelada")
+                if on_update and i:
+                    on_update(f"Probando {model_id} ({i + 1}/{len(models)})…")
+                limite = min(deadline, time.monotonic() + timeout)
+                try:
+                    output, latencia = self._attempt(model_id, build_payload(model_id, prompt, encoded_image),
+                                                     mode, limite, cancel_event)
+                except RequestCancelled:
+                    raise
+                except Exception as exc:
+                    error = exc
+                    self.stats.record(model_id, False)
+                    print(f"[{model_id}] Falló en la cadena de modelos: {exc}")
+                    continue
+                self.stats.record(model_id, True, latencia)
+                return model_id, output, latencia
+            raise error or RuntimeError("Ningún modelo respondió")
+        finally:
+            self.stats.save()
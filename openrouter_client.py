@@ -0,0 +1,167 @@
+import io
+import json
+import os
+import threading
+import time
+
+# OPENROUTER_BASE_URL permite apuntar a un servidor compatible (p. ej. el simulado de benchmark_suite.py)
+OPENROUTER_BASE_URL = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/")
+CHAT_COMPLETIONS_URL = f"{OPENROUTER_BASE_URL}/chat/completions"
+KEY_URL = f"{OPENROUTER_BASE_URL}/key"
+
+# Timeouts explícitos (conexión, lectura) en segundos
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 120
+KEY_TIMEOUT = (CONNECT_TIMEOUT, 10)
+CHAT_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+# Conexiones simultáneas que se mantienen abiertas hacia openrouter.ai
+POOL_SIZE = 8
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Devuelve la sesión HTTP compartida (pool con keep-alive) creándola si hace falta"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # requests se importa en la primera petición para no retrasar el arranque
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount("https://", adapter)
+                session.headers.update({"Connection": "keep-alive"})
+                _session = session
+    return _session
+
+
+def close_session():
+    """Cierra la sesión compartida y sus conexiones"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def set_base_url(url):
+    """Cambia el servidor al que se envían las peticiones y cierra las conexiones abiertas"""
+    global OPENROUTER_BASE_URL, CHAT_COMPLETIONS_URL, KEY_URL
+    OPENROUTER_BASE_URL = url.rstrip("/")
+    CHAT_COMPLETIONS_URL = f"{OPENROUTER_BASE_URL}/chat/completions"
+    KEY_URL = f"{OPENROUTER_BASE_URL}/key"
+    close_session()
+
+
+def _auth_headers(api_key):
+    return {"Authorization": f"Bearer {api_key}"}
+
+
+def prewarm():
+    """Abre una conexión TLS con openrouter.ai para que las siguientes peticiones la reutilicen"""
+    import requests
+
+    try:
+        get_session().head(OPENROUTER_BASE_URL, timeout=KEY_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        print(f"No se pudo precalentar la conexión: {e}")
+
+
+def get_key_info(api_key):
+    """Consulta el endpoint /key de OpenRouter y devuelve la respuesta HTTP"""
+    return get_session().get(KEY_URL, headers=_auth_headers(api_key), timeout=KEY_TIMEOUT)
+
+
+def _chat_timeout(timeout):
+    """Timeout (conexión, lectura) sin superar los segundos que quedan del plazo"""
+    if timeout is None:
+        return CHAT_TIMEOUT
+    return (min(CONNECT_TIMEOUT, timeout), max(0.1, min(READ_TIMEOUT, timeout)))
+
+
+class _TimedBody(io.BytesIO):
+    """Cuerpo de la petición que anota cuándo se terminó de enviar (última lectura)"""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.sent_at = None
+
+    def read(self, size=-1):
+        bloque = super().read(size)
+        if not bloque and self.sent_at is None:
+            self.sent_at = time.perf_counter()
+        return bloque
+
+
+def _post_chat(api_key, payload, timeout, stream, timings):
+    """
+    POST a chat/completions. Si se pasa timings (dict), se rellena con
+    request_bytes, upload_s (hasta enviar el cuerpo) y ttfb_s (hasta recibir las cabeceras).
+    """
+    if timings is None:
+        return get_session().post(CHAT_COMPLETIONS_URL, headers=_auth_headers(api_key),
+                                  json=payload, timeout=_chat_timeout(timeout), stream=stream)
+    cuerpo = _TimedBody(json.dumps(payload).encode("utf-8"))
+    headers = dict(_auth_headers(api_key), **{"Content-Type": "application/json"})
+    inicio = time.perf_counter()
+    response = get_session().post(CHAT_COMPLETIONS_URL, headers=headers, data=cuerpo,
+                                  timeout=_chat_timeout(timeout), stream=stream)
+    timings["request_bytes"] = len(cuerpo.getbuffer())
+    if cuerpo.sent_at is not None:
+        timings["upload_s"] = cuerpo.sent_at - inicio
+    timings["ttfb_s"] = response.elapsed.total_seconds()
+    return response
+
+
+def post_chat_completion(api_key, payload, timeout=None, timings=None):
+    """Envía una petición de chat completion y devuelve la respuesta HTTP"""
+    return _post_chat(api_key, payload, timeout, False, timings)
+
+
+def open_chat_stream(api_key, payload, timeout=None, timings=None):
+    """Abre una petición de chat completion con stream=True y devuelve la respuesta sin leerla"""
+    return _post_chat(api_key, dict(payload, stream=True), timeout, True, timings)
+
+
+def iter_chat_stream(response, cancel_event=None, usage=None):
+    """
+    Produce los fragmentos de texto de una respuesta SSE a medida que llegan y
+    la cierra al terminar. Se detiene si cancel_event se activa. Si se pasa
+    usage (dict), se actualiza con el uso que OpenRouter envía en el último evento.
+    """
+    with response:
+        response.raise_for_status()
+        response.encoding = "utf-8"
+        for line in response.iter_lines(decode_unicode=True):
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            # Las líneas vacías separan eventos y las que empiezan con ':' son comentarios
+            # (OpenRouter envía ": OPENROUTER PROCESSING" como keep-alive)
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                return
+            chunk = json.loads(data)
+            if "error" in chunk:
+                raise RuntimeError(chunk["error"].get("message", chunk["error"]))
+            if usage is not None and chunk.get("usage"):
+                usage.update(chunk["usage"])
+            choices = chunk.get("choices") or []
+            if choices:
+                content = choices[0].get("delta", {}).get("content")
+                if content:
+                    yield content
+
+
+def stream_chat_completion(api_key, payload, cancel_event=None):
+    """
+    Envía una petición de chat completion con stream=True (SSE) y produce los
+    fragmentos de texto a medida que llegan. Se detiene si cancel_event se activa.
+    """
+    return iter_chat_stream(open_chat_stream(api_key, payload), cancel_event)
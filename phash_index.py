@@ -0,0 +1,188 @@
+import hashlib
+import os
+import struct
+import threading
+
+from PIL import Image, ImageChops
+
+from config_manager import get_config_dir
+
+# Registro binario: dHash (64 bits), contexto (64 bits) y clave de caché (32 bytes)
+RECORD = struct.Struct("<QQ32s")
+# Con 8 bandas de 8 bits, dos hashes a distancia < 8 comparten al menos una banda
+# exacta, así que basta con revisar los candidatos de esas cubetas
+BANDS = 8
+BAND_BITS = 64 // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+MAX_THRESHOLD = BANDS - 1
+
+DEFAULT_THRESHOLD = 2
+DEFAULT_MAX_ENTRIES = 50000
+# El dHash solo preselecciona candidatos: en tablas con la misma estructura
+# coincide aunque cambien los números, así que cada candidato se confirma
+# comparando una huella en escala de grises (lado mayor FINGERPRINT_SIDE)
+# en la que ningún píxel puede diferir más de PIXEL_TOLERANCE
+FINGERPRINT_SIDE = 128
+PIXEL_TOLERANCE = 24
+
+
+def get_index_file():
+    """Obtiene la ruta del índice de hashes perceptuales junto a la configuración"""
+    return os.path.join(get_config_dir(), 'phash_index.bin')
+
+
+def get_fingerprint_dir():
+    """Directorio con las huellas de las capturas del índice"""
+    path = os.path.join(get_config_dir(), 'phash_fingerprints')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def dhash(img, hash_size=8):
+    """Hash de diferencias (dHash) de 64 bits sobre una versión reducida en escala de grises"""
+    gris = img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixeles = gris.tobytes()
+    ancho = hash_size + 1
+    valor = 0
+    for fila in range(hash_size):
+        base = fila * ancho
+        for col in range(hash_size):
+            valor = (valor << 1) | (pixeles[base + col] > pixeles[base + col + 1])
+    return valor
+
+
+def fingerprint(img):
+    """Versión reducida en escala de grises con la que se confirma que dos capturas son casi idénticas"""
+    gris = img.convert("L")
+    gris.thumbnail((FINGERPRINT_SIDE, FINGERPRINT_SIDE), Image.BOX)
+    return gris
+
+
+def same_fingerprint(a, b, tolerance=PIXEL_TOLERANCE):
+    """True si las huellas tienen el mismo tamaño y ningún píxel difiere más de tolerance"""
+    return a.size == b.size and ImageChops.difference(a, b).getextrema()[1] <= tolerance
+
+
+def context_id(model_id, mode, prompt, size):
+    """
+    Identificador de 64 bits de modelo + modo + prompt + tamaño de la captura;
+    solo se comparan capturas del mismo contexto
+    """
+    digest = hashlib.sha256(f"{model_id}\0{mode}\0{prompt}\0{size[0]}x{size[1]}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+def _bandas(valor):
+    return [(i, (valor >> (i * BAND_BITS)) & BAND_MASK) for i in range(BANDS)]
+
+
+class PerceptualIndex:
+    """
+    Índice persistente de dHash para encontrar capturas casi idénticas. Las
+    huellas se guardan aparte (un PNG pequeño por captura) y solo se leen para
+    confirmar los candidatos.
+    """
+
+    def __init__(self, path=None, max_entries=DEFAULT_MAX_ENTRIES, fingerprint_dir=None):
+        self.path = path or get_index_file()
+        self.fingerprint_dir = fingerprint_dir or get_fingerprint_dir()
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = []  # (hash, contexto, clave de caché en hex)
+        self._buckets = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Ignora un registro final incompleto (p. ej. tras un cierre inesperado)
+        data = data[:len(data) - len(data) % RECORD.size]
+        for valor, contexto, clave in RECORD.iter_unpack(data):
+            self._add_memory(valor, contexto, clave.hex())
+
+    def _add_memory(self, valor, contexto, clave):
+        idx = len(self._entries)
+        self._entries.append((valor, contexto, clave))
+        for banda in _bandas(valor):
+            self._buckets.setdefault(banda, []).append(idx)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _fingerprint_path(self, cache_key):
+        return os.path.join(self.fingerprint_dir, f"{cache_key}.png")
+
+    def add(self, valor, contexto, cache_key, huella):
+        """Añade una captura y su huella al índice y la persiste al final del archivo"""
+        with self._lock:
+            try:
+                huella.save(self._fingerprint_path(cache_key), format="PNG")
+            except OSError as e:
+                print(f"Error al guardar la huella de la captura: {e}")
+                return
+            self._add_memory(valor, contexto, cache_key)
+            try:
+                if len(self._entries) > self.max_entries:
+                    self._compact()
+                else:
+                    with open(self.path, 'ab') as f:
+                        f.write(RECORD.pack(valor, contexto, bytes.fromhex(cache_key)))
+            except OSError as e:
+                print(f"Error al guardar el índice de capturas: {e}")
+
+    def _compact(self):
+        """Descarta las entradas más antiguas y reescribe el archivo"""
+        entries = self._entries[-(self.max_entries // 2 or 1):]
+        conservadas = {clave for _, _, clave in entries}
+        for _, _, clave in self._entries:
+            if clave not in conservadas:
+                try:
+                    os.remove(self._fingerprint_path(clave))
+                except OSError:
+                    pass
+        self._entries = []
+        self._buckets = {}
+        for entry in entries:
+            self._add_memory(*entry)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            for valor, contexto, clave in self._entries:
+                f.write(RECORD.pack(valor, contexto, bytes.fromhex(clave)))
+        os.replace(tmp_path, self.path)
+
+    def _confirm(self, cache_key, huella):
+        try:
+            with Image.open(self._fingerprint_path(cache_key)) as guardada:
+                return same_fingerprint(huella, guardada)
+        except (OSError, ValueError):
+            return False  # Entrada sin huella (p. ej. de una versión anterior)
+
+    def find(self, valor, contexto, huella, threshold=DEFAULT_THRESHOLD):
+        """
+        Devuelve (clave de caché, distancia) de la captura más parecida del mismo
+        contexto con distancia de Hamming <= threshold y cuya huella coincide con
+        huella, o None si no hay ninguna.
+        """
+        threshold = min(threshold, MAX_THRESHOLD)
+        candidatos = []
+        with self._lock:
+            vistos = set()
+            for banda in _bandas(valor):
+                for idx in self._buckets.get(banda, ()):
+                    if idx in vistos:
+                        continue
+                    vistos.add(idx)
+                    otro, otro_contexto, clave = self._entries[idx]
+                    if otro_contexto != contexto:
+                        continue
+                    distancia = (valor ^ otro).bit_count()
+                    if distancia <= threshold:
+                        candidatos.append((distancia, clave))
+            # Los más parecidos primero; una misma captura puede estar repetida
+            for distancia, clave in sorted(set(candidatos)):
+                if self._confirm(clave, huella):
+                    return clave, distancia
+        return None
@@ -0,0 +1,79 @@
+import re
+
+EXCEL_FORMAT_PROMPT = """
+Responde únicamente en formato TSV (tab-separated values), donde cada fila representa una fila de la tabla y cada columna está separada por un tabulador. No incluyas ningún texto adicional fuera de la tabla. Ejemplo:
+Cantidad\tPrecio S/.\tParcial S/.
+4.0000\t9.93\t39.72
+2.0000\t8.94\t17.88
+
+Si alguna columna o fila no cuadra con lo que percibes en la imagen, puedes dejar celdas vacías; no es obligatorio llenar todas las celdas.
+"""
+
+DOCS_FORMAT_PROMPT = """
+Extrae todo el texto legible de la imagen y respétalo tal cual aparece, sin parafrasear ni corregir errores. Si hay partes ilegibles, indícalo con la palabra "ilegible". No incluyas ningún texto adicional fuera del contenido extraído. El resultado debe estar listo para copiar y pegar en un documento de texto.
+"""
+
+
+DIMENSIONS_NOTE = "\n\nInstrucción adicional: La tabla debe tener exactamente {cols} columnas y {rows} filas."
+_DIMENSIONS_RE = re.compile(re.escape(DIMENSIONS_NOTE).replace(r"\{cols\}", r"(\d+)").replace(r"\{rows\}", r"\d+") + "$")
+
+
+def build_prompt(mode, user_prompt, cols=None, rows=None):
+    """Construye el prompt final para el modo indicado (con dimensiones manuales en Excel)"""
+    if mode == "Docs":
+        return user_prompt.strip() + "\n\n" + DOCS_FORMAT_PROMPT
+
+    prompt = user_prompt.strip() + "\n\n" + EXCEL_FORMAT_PROMPT
+    if cols and rows:
+        prompt += DIMENSIONS_NOTE.format(cols=cols, rows=rows)
+    return prompt
+
+
+BAND_NOTE = """
+Esta imagen es una franja horizontal de una tabla más larga. Transcribe solo las filas visibles en la franja, sin añadir encabezados ni filas que no aparezcan en ella.
+"""
+
+
+def build_band_prompt(prompt):
+    """
+    Prompt para una franja a partir del prompt Excel completo de la captura:
+    se conserva el número de columnas y se quita el de filas, que no se
+    cumple en una franja. Devuelve (prompt, columnas o None).
+    """
+    dimensiones = _DIMENSIONS_RE.search(prompt)
+    cols = int(dimensiones.group(1)) if dimensiones else None
+    if dimensiones:
+        prompt = prompt[:dimensiones.start()]
+    prompt += "\n" + BAND_NOTE
+    if cols:
+        prompt += f"\nInstrucción adicional: La tabla debe tener exactamente {cols} columnas."
+    return prompt, cols
+
+
+def build_payload(model_id, prompt, encoded_image):
+    """Construye el cuerpo de la petición de chat con el prompt y la imagen codificada"""
+    return {
+        "model": model_id,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": f"data:{encoded_image['mime']};base64,{encoded_image['base64']}"}
+                ]
+            }
+        ],
+        # Pide a OpenRouter los tokens y el coste en el campo usage de la respuesta
+        "usage": {"include": True},
+    }
+
+
+def strip_code_fences(output):
+    """Elimina delimitadores tipo ```excel``` si aparecen"""
+    output = output.strip()
+    if output.startswith("```"):
+        primera_linea, _, resto = output.partition("\n")
+        output = resto.strip() if resto else primera_linea[3:].strip()
+    if output.endswith("```"):
+        output = output[:-3].strip()
+    return output
@@ -1,28 +1,39 @@
-import pyscreeze
-from PIL import Image, ImageTk, ImageEnhance
+import time
+from startup_profiler import StartupProfiler
+# Se crea antes del resto de imports para medir su coste con --profile-startup
+profiler = StartupProfiler()
+
 import tkinter as tk
 from tkinter import ttk, Toplevel, Button, messagebox, Canvas, Text, Frame, Label, Entry, StringVar
-import base64
-import io
-import requests
 import threading
-import json
 import os
-from config_manager import load_config, update_config, get_api_key, set_api_key, ask_for_api_key, validate_api_key
+import sys
+from config_manager import load_config, update_config, update_configs, flush_config, get_api_key, set_api_key, ask_for_api_key, validate_api_key, check_api_key, is_api_key_format_valid, is_api_key_validation_fresh, mark_api_key_validated, DEFAULT_CONFIG, DEFAULT_MODEL, MODEL_MAP
+from prompts import build_prompt, build_band_prompt, build_payload, strip_code_fences
+import openrouter_client
+from image_encoder import encode_image, get_encoding_settings, describe_encoding, target_size
+from image_preprocess import preprocess_image, get_preprocess_settings, describe_preprocess, print_report
+from cost_estimator import estimate, budget_tokens, budget_settings, describe_estimate, DEFAULT_OUTPUT_TOKENS
+from result_cache import ResultCache, make_key
+from request_engine import RequestEngine, EngineBusyError, DEFAULT_MAX_IN_FLIGHT
+from tiling import split_into_bands, merge_tables, check_columns, DEFAULT_MIN_HEIGHT, DEFAULT_BAND_HEIGHT, DEFAULT_OVERLAP
+from result_grid import VirtualGrid, table_to_tsv
+from table_parser import parse_table, parse_rows
+from table_export import export_table, export_format, capture_sheet_title, DEFAULT_CSV_DELIMITER
+from phash_index import PerceptualIndex, dhash, fingerprint, context_id, DEFAULT_THRESHOLD, DEFAULT_MAX_ENTRIES
+from screen_capture import Monitor, MemoryTracker, monitor_at, capture_monitor
+from snip_daemon import SnipServer, DEFAULT_HOST, DEFAULT_PORT
+from request_scheduler import RequestScheduler, RequestCancelled, describe_retries
+from model_router import ModelRouter, ModelStats, DEFAULT_RACE_WIDTH, DEFAULT_FALLBACK_TIMEOUT
+from telemetry import TelemetryStore, usage_fields, DEFAULT_RETENTION_DAYS
+from capture_history import CaptureHistory
+from capture_queue import CaptureQueue, concatenate_tables, FINISHED, DONE, FAILED, DEFAULT_PREPARE_WORKERS
 
-DEFAULT_MODEL = "Qwen2.5 VL 72B (Free)"
 # Número de capturas antes de actualizar automáticamente el uso de API
 CAPTURAS_ANTES_ACTUALIZAR = 5
-
-MODEL_MAP = {
-    "Qwen2.5 VL 32B (Free)": "qwen/qwen2.5-vl-32b-instruct",
-    "Qwen2.5 VL 72B (Free)": "qwen/qwen2.5-vl-72b-instruct",
-    "Mistral 3.2 Small 24B (Free)": "mistralai/mistral-small-3.2-24b-instruct",
-    "Gemma 3 12B IT (Free)": "google/gemma-3-12b-it",
-    "Gemma 3 27B IT (Free)": "google/gemma-3-27b-it",
-    "Gemini 2.5 Flash Lite": "google/gemini-2.5-flash-lite",
-    "GPT-4.1 Mini": "openai/gpt-4.1-mini",
-}
+# Patrón punteado de los rectángulos que oscurecen la pantalla fuera de la selección
+# (gray25 ≈ 25% de píxeles negros, parecido al brillo 0.8 que se usaba antes)
+OVERLAY_STIPPLE = "gray25"
 
 def crear_tooltip_label(label, text):
     tooltip = None
@@ -63,31 +74,37 @@ class RecorteApp:
 
         # Cargar configuración
         self.config = load_config()
+        profiler.mark("load_config")
+
+        # Motor asyncio que ejecuta todas las peticiones a OpenRouter fuera del hilo de Tk
+        self.engine = RequestEngine(
+            max_in_flight=self.config.get('max_in_flight_requests', DEFAULT_MAX_IN_FLIGHT),
+            deliver=lambda f: master.after(0, f)).start()
+        master.protocol("WM_DELETE_WINDOW", self.cerrar)
+        # Reintentos con espera exponencial y límite de peticiones por modelo
+        self.scheduler = RequestScheduler.from_config(self.config)
+        profiler.mark("request_engine")
+        self.cerrada = False
+
+        # Ventana de recorte (se crea al primer recorte y luego se reutiliza oculta)
+        self.snip_window = None
+        self.screenshot_tk = None
+        self.recorte_activo = False
+        self.drag_frame_id = None
+        # Modo residente (--daemon): servidor local y disparo remoto pendiente de respuesta
+        self.modo_residente = False
+        self.snip_server = None
+        self.snip_pendiente = None
+
+        # Abrir la conexión con OpenRouter en cuanto la ventana esté dibujada
+        master.after_idle(lambda: self.engine.submit(openrouter_client.prewarm))
         
-        # Verificar y obtener API key
+        # La interfaz se abre con la API key guardada y se valida en segundo plano;
+        # solo se bloquea si no hay ninguna clave con formato válido
         self.api_key = get_api_key()
-        while not self.api_key or not validate_api_key(self.api_key):
-            self.api_key = ask_for_api_key(master)
-            if not self.api_key:
-                # Si el usuario cancela el diálogo, preguntar si quiere salir
-                if messagebox.askyesno("Salir", "¿Deseas salir de la aplicación? Se requiere una API key válida para continuar."):
-                    master.destroy()
-                    return
-                else:
-                    continue  # Volver a pedir la API key
-            elif not validate_api_key(self.api_key):
-                # API key inválida, mostrar error y volver a pedir
-                messagebox.showerror("Error", 
-                    "API key inválida. La clave debe:\n"
-                    "- Tener al menos 20 caracteres\n"
-                    "- Empezar con 'sk-'\n"
-                    "- Ser una clave válida de OpenRouter\n\n"
-                    "Por favor intenta de nuevo.")
-                continue
-            else:
-                # API key válida, guardarla
-                set_api_key(self.api_key)
-                break
+        if not is_api_key_format_valid(self.api_key) and not self._pedir_api_key_valida():
+            return
+        profiler.mark("api_key")
 
         # Cargar prompts desde configuración
         self.prompt_excel = self.config.get('prompt_excel', """Convierte esta imagen a un archivo Excel respetando al máximo la apariencia visual original.
@@ -108,6 +125,19 @@ El resultado debe estar listo para copiar y pegar en un documento de texto.""")
         self.api_limit = None
         self.is_free_tier = True
         self.capturas_realizadas = 0  # Contador de capturas para auto-actualizar
+        self.phash_index = None  # Índice de capturas casi idénticas (se carga al primer uso)
+        self.model_stats = None  # Estadísticas de carrera / cadena de modelos (se cargan al primer uso)
+        self.ultima_captura_ms = None  # Tiempo de la última captura de pantalla (para la telemetría)
+        # Cola de recortes (se crea al primer uso) y su panel
+        self.cola = None
+        self.panel_cola = None
+        self.cola_tree = None
+        self.recortando_en_cola = False
+        self.telemetry = None
+        if self.config.get('telemetry_enabled', True):
+            self.telemetry = TelemetryStore(retention_days=self.config.get('telemetry_retention_days', DEFAULT_RETENTION_DAYS))
+            master.after_idle(lambda: self.engine.submit(self.telemetry.rollup))
+        self.history = CaptureHistory.from_config(self.config) if self.config.get('history_enabled', True) else None
 
         main_frame = Frame(master, padx=30, pady=20, bg="#f7f7f7")  # aumenta separación con bordes
         main_frame.pack(fill="both", expand=True)
@@ -191,11 +221,18 @@ El resultado debe estar listo para copiar y pegar en un documento de texto.""")
         crear_tooltip_label(restore_button, "Restaura toda la configuración a los valores por defecto.")
 
         self.snip_button = Button(main_frame, text="Recortar y Procesar", command=self.crear_ventana_recorte, bg="#4CAF50", fg="white", font=("Helvetica", 10, "bold"), relief="raised", borderwidth=2, cursor="hand2")
-        self.snip_button.grid(row=5, column=0, columnspan=4, sticky="ew", ipady=5)
+        self.snip_button.grid(row=5, column=0, columnspan=3, sticky="ew", ipady=5)
         self.snip_button.bind("<Enter>", lambda e: self.snip_button.config(cursor="hand2"))
         self.snip_button.bind("<Leave>", lambda e: self.snip_button.config(cursor="arrow"))
         crear_tooltip_label(self.snip_button, "Haz clic para seleccionar el área de la pantalla a procesar.")
 
+        # Modo cola: varios recortes seguidos procesados en segundo plano
+        queue_button = Button(main_frame, text="Varios", command=self.iniciar_recortes_en_cola, bg="#388E3C", fg="white", font=("Helvetica", 10, "bold"), relief="raised", borderwidth=2, cursor="hand2")
+        queue_button.grid(row=5, column=3, sticky="ew", ipady=5, padx=(5, 0))
+        queue_button.bind("<Enter>", lambda e: queue_button.config(cursor="hand2"))
+        queue_button.bind("<Leave>", lambda e: queue_button.config(cursor="arrow"))
+        crear_tooltip_label(queue_button, "Recorta varias áreas seguidas (Esc para terminar).\nCada recorte se procesa en segundo plano mientras haces el siguiente.")
+
         self.auto_var = tk.BooleanVar(value=self.config.get('auto_process_enabled', False))  # Cargar desde configuración
         auto_check = tk.Checkbutton(main_frame, text="Procesamiento automático post captura", variable=self.auto_var, command=self.actualizar_auto_config, bg="#f7f7f7", font=("Helvetica", 10), cursor="hand2")
         auto_check.grid(row=6, column=0, columnspan=4, sticky="w", pady=(10, 0))
@@ -207,15 +244,95 @@ El resultado debe estar listo para copiar y pegar en un documento de texto.""")
         self.crear_barra_uso_api(main_frame, row=7)
         
         # Botón para cambiar API key (discreto) - al final
-        api_key_button = Button(main_frame, text="Cambiar API Key", command=self.cambiar_api_key, bg="#f7f7f7", fg="#666666", font=("Helvetica", 8), relief="flat", borderwidth=0, cursor="hand2")
-        api_key_button.grid(row=8, column=0, columnspan=4, sticky="ew", pady=(5, 2))
-        api_key_button.bind("<Enter>", lambda e: api_key_button.config(cursor="hand2", fg="#333333"))
-        api_key_button.bind("<Leave>", lambda e: api_key_button.config(cursor="arrow", fg="#666666"))
-        crear_tooltip_label(api_key_button, "Cambia tu API key de OpenRouter")
+        self.api_key_button = Button(main_frame, text="Cambiar API Key", command=self.cambiar_api_key, bg="#f7f7f7", fg="#666666", font=("Helvetica", 8), relief="flat", borderwidth=0, cursor="hand2")
+        self.api_key_button.grid(row=8, column=0, columnspan=2, sticky="ew", pady=(5, 2))
+        self.api_key_button.bind("<Enter>", lambda e: self.api_key_button.config(cursor="hand2", fg="#333333"))
+        self.api_key_button.bind("<Leave>", lambda e: self.api_key_button.config(cursor="arrow", fg="#666666"))
+        crear_tooltip_label(self.api_key_button, "Cambia tu API key de OpenRouter")
+
+        # Botón de estadísticas por modelo (discreto), junto al de la API key
+        stats_button = Button(main_frame, text="Estadísticas", command=self.abrir_estadisticas, bg="#f7f7f7", fg="#666666", font=("Helvetica", 8), relief="flat", borderwidth=0, cursor="hand2")
+        stats_button.grid(row=8, column=2, sticky="ew", pady=(5, 2))
+        stats_button.bind("<Enter>", lambda e: stats_button.config(cursor="hand2", fg="#333333"))
+        stats_button.bind("<Leave>", lambda e: stats_button.config(cursor="arrow", fg="#666666"))
+        crear_tooltip_label(stats_button, "Latencia p50/p95, tokens y coste por modelo")
+
+        # Historial de capturas (discreto), junto al de estadísticas
+        history_button = Button(main_frame, text="Historial", command=self.abrir_historial, bg="#f7f7f7", fg="#666666", font=("Helvetica", 8), relief="flat", borderwidth=0, cursor="hand2")
+        history_button.grid(row=8, column=3, sticky="ew", pady=(5, 2))
+        history_button.bind("<Enter>", lambda e: history_button.config(cursor="hand2", fg="#333333"))
+        history_button.bind("<Leave>", lambda e: history_button.config(cursor="arrow", fg="#666666"))
+        crear_tooltip_label(history_button, "Busca, reabre o reprocesa capturas anteriores")
         
+        profiler.mark("build_ui")
+
+        # Validar la API key sin bloquear el arranque
+        self.verificar_api_key()
+
         # Cargar datos de uso inicial
         self.actualizar_uso_api()
 
+    def _pedir_api_key_valida(self):
+        """
+        Pide una API key hasta que sea válida. Devuelve False si el usuario
+        decide salir de la aplicación (la ventana ya queda cerrada).
+        """
+        while True:
+            api_key = ask_for_api_key(self.master)
+            if not api_key:
+                # Si el usuario cancela el diálogo, preguntar si quiere salir
+                if messagebox.askyesno("Salir", "¿Deseas salir de la aplicación? Se requiere una API key válida para continuar."):
+                    self.cerrar()
+                    return False
+                continue  # Volver a pedir la API key
+            if not validate_api_key(api_key):
+                # API key inválida, mostrar error y volver a pedir
+                messagebox.showerror("Error", 
+                    "API key inválida. La clave debe:\n"
+                    "- Tener al menos 20 caracteres\n"
+                    "- Empezar con 'sk-'\n"
+                    "- Ser una clave válida de OpenRouter\n\n"
+                    "Por favor intenta de nuevo.")
+                continue
+            # API key válida, guardarla
+            self.api_key = api_key
+            set_api_key(api_key)
+            mark_api_key_validated(api_key)
+            return True
+
+    def _mostrar_estado_api_key(self, estado):
+        textos = {
+            "verificando": "Cambiar API Key (verificando...)",
+            "valida": "Cambiar API Key (✓ válida)",
+            "invalida": "Cambiar API Key (✗ inválida)",
+            "sin_verificar": "Cambiar API Key (sin conexión, no verificada)",
+        }
+        self.api_key_button.config(text=textos.get(estado, "Cambiar API Key"))
+
+    def verificar_api_key(self):
+        """Valida la API key en el motor de peticiones salvo que se haya validado hace poco"""
+        if is_api_key_validation_fresh(self.api_key):
+            self._mostrar_estado_api_key("valida")
+            return
+        self._mostrar_estado_api_key("verificando")
+        api_key = self.api_key
+        self.engine.submit(check_api_key, api_key, on_done=lambda resultado: self._api_key_verificada(api_key, resultado))
+
+    def _api_key_verificada(self, api_key, resultado):
+        if api_key != self.api_key:
+            return  # La clave cambió mientras se verificaba
+        if resultado is True:
+            mark_api_key_validated(api_key)
+            self._mostrar_estado_api_key("valida")
+        elif resultado is None:
+            self._mostrar_estado_api_key("sin_verificar")
+        else:
+            self._mostrar_estado_api_key("invalida")
+            messagebox.showerror("Error", "La API key guardada ya no es válida. Por favor ingresa una nueva.")
+            if self._pedir_api_key_valida():
+                self._mostrar_estado_api_key("valida")
+                self.actualizar_uso_api()
+
     def crear_barra_uso_api(self, parent, row=7):
         """Crea la barra de uso de API en la interfaz"""
         # Frame para la barra de uso
@@ -256,7 +373,9 @@ El resultado debe estar listo para copiar y pegar en un documento de texto.""")
                 break
             elif validate_api_key(new_api_key):
                 set_api_key(new_api_key)
+                mark_api_key_validated(new_api_key)
                 self.api_key = new_api_key
+                self._mostrar_estado_api_key("valida")
                 messagebox.showinfo("Éxito", "API key actualizada correctamente.")
                 # Actualizar uso de API con la nueva clave
                 self.actualizar_uso_api()
@@ -272,14 +391,10 @@ El resultado debe estar listo para copiar y pegar en un documento de texto.""")
 
     def obtener_uso_api(self):
         """Obtiene la información de uso de la API de OpenRouter"""
+        import requests
+
         try:
-            response = requests.get(
-                "https://openrouter.ai/api/v1/key",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}"
-                },
-                timeout=10
-            )
+            response = openrouter_client.get_key_info(self.api_key)
             
             if response.status_code == 200:
                 data = response.json()
@@ -300,16 +415,18 @@ El resultado debe estar listo para copiar y pegar en un documento de texto.""")
             return False
 
     def actualizar_uso_api(self):
-        """Actualiza la información de uso de API en un hilo separado"""
-        def _actualizar():
-            if self.obtener_uso_api():
-                # Actualizar UI en el hilo principal
-                self.master.after(0, self.actualizar_ui_uso)
+        """Actualiza la información de uso de API desde el motor de peticiones"""
+        # El resultado se entrega en el hilo principal para actualizar la UI
+        def _mostrar(ok):
+            if ok:
+                self.actualizar_ui_uso()
             else:
-                self.master.after(0, self.mostrar_error_uso)
-        
-        # Ejecutar en hilo separado para no bloquear la UI
-        threading.Thread(target=_actualizar, daemon=True).start()
+                self.mostrar_error_uso()
+
+        try:
+            self.engine.submit(self.obtener_uso_api, on_done=_mostrar)
+        except EngineBusyError:
+            pass  # Se actualizará en la próxima captura
 
     def actualizar_ui_uso(self):
         """Actualiza la interfaz con la información de uso de API"""
@@ -451,12 +568,8 @@ El resultado debe estar listo para copiar y pegar en un documento de texto.""")
                               "- Configuración de procesamiento automático\n\n"
                               "La API key se mantendrá."):
             
-            # Obtener la configuración por defecto del config_manager
-            from config_manager import DEFAULT_CONFIG
-            
-            # Restaurar TODA la configuración por defecto
-            for key, value in DEFAULT_CONFIG.items():
-                update_config(key, value)
+            # Restaurar TODA la configuración por defecto (la API key se mantiene)
+            update_configs({k: v for k, v in DEFAULT_CONFIG.items() if k != 'OPENROUTER_API_KEY'})
             
             # Actualizar variables locales
             self.prompt_excel = DEFAULT_CONFIG['prompt_excel']
@@ -476,27 +589,22 @@ El resultado debe estar listo para copiar y pegar en un documento de texto.""")
         self.master.withdraw()
         self.master.after(300, self.iniciar_captura)
 
-    def iniciar_captura(self):
-        try:
-            self.original_screenshot = pyscreeze.screenshot()
-        except Exception as e:
-            messagebox.showerror("Error", f"No se pudo capturar la pantalla: {e}")
-            self.master.deiconify()
-            return
-
-        enhancer = ImageEnhance.Brightness(self.original_screenshot)
-        darkened = enhancer.enhance(0.8)
-        self.darkened_screenshot_tk = ImageTk.PhotoImage(darkened)
-
+    def _crear_overlay(self):
+        """Crea una sola vez la ventana de recorte (oculta) con su lienzo y rectángulos"""
         self.snip_window = Toplevel(self.master)
-        self.snip_window.attributes("-fullscreen", True)
+        self.snip_window.withdraw()
+        self.snip_window.overrideredirect(True)
         self.snip_window.attributes("-topmost", True)
 
         self.canvas = Canvas(self.snip_window, cursor="cross", highlightthickness=0)
         self.canvas.pack(fill="both", expand=True)
-        self.canvas.create_image(0, 0, image=self.darkened_screenshot_tk, anchor="nw")
-
-        self.selection_image_id = self.canvas.create_image(0, 0, anchor="nw")
+        self.screenshot_item_id = self.canvas.create_image(0, 0, anchor="nw")
+        # El oscurecimiento fuera de la selección son cuatro rectángulos
+        # punteados que solo cambian de coordenadas
+        self.dim_rect_ids = [
+            self.canvas.create_rectangle(0, 0, 0, 0, fill="black", outline="", stipple=OVERLAY_STIPPLE)
+            for _ in range(4)
+        ]
         self.selection_rect_id = self.canvas.create_rectangle(0, 0, 0, 0, outline="red", width=2)
 
         self.canvas.bind("<ButtonPress-1>", self.on_button_press)
@@ -504,22 +612,107 @@ El resultado debe estar listo para copiar y pegar en un documento de texto.""")
         self.canvas.bind("<ButtonRelease-1>", self.on_button_release)
         self.snip_window.bind("<Escape>", self.cancelar_recorte)  # <-- corregido nombre del método
 
+    def iniciar_captura(self):
+        # El módulo de PIL para Tk se carga en el primer recorte
+        from PIL import ImageTk
+
+        # Solo se captura el monitor bajo el cursor, no todo el escritorio virtual
+        self.memoria_recorte = MemoryTracker()
+        self.memoria_recorte.sample("inicio")
+        pantalla = Monitor(0, 0, self.master.winfo_screenwidth(), self.master.winfo_screenheight())
+        monitor = monitor_at(*self.master.winfo_pointerxy(), default=pantalla)
+        inicio = time.perf_counter()
+        try:
+            self.original_screenshot = capture_monitor(monitor)
+            self.ultima_captura_ms = (time.perf_counter() - inicio) * 1000
+        except Exception as e:
+            self._responder_snip_remoto(f"error {e}")
+            messagebox.showerror("Error", f"No se pudo capturar la pantalla: {e}")
+            self.master.deiconify()
+            return
+        self.memoria_recorte.sample("captura")
+
+        if self.snip_window is None or not self.snip_window.winfo_exists():
+            self._crear_overlay()
+
+        # En modo residente se reutiliza el PhotoImage si el monitor es del mismo tamaño
+        ancho, alto = self.original_screenshot.size
+        if (self.modo_residente and self.screenshot_tk is not None
+                and (self.screenshot_tk.width(), self.screenshot_tk.height()) == (ancho, alto)):
+            self.screenshot_tk.paste(self.original_screenshot)
+        else:
+            self.screenshot_tk = ImageTk.PhotoImage(self.original_screenshot)
+        self.canvas.itemconfig(self.screenshot_item_id, image=self.screenshot_tk)
+        self.memoria_recorte.sample("overlay")
+
+        # Al principio toda la pantalla está oscurecida (un solo rectángulo)
+        self.canvas.coords(self.dim_rect_ids[0], 0, 0, ancho, alto)
+        for rect_id in self.dim_rect_ids[1:]:
+            self.canvas.coords(rect_id, 0, 0, 0, 0)
+        self.canvas.coords(self.selection_rect_id, 0, 0, 0, 0)
+
+        # Los eventos de movimiento se agrupan y se dibuja como mucho un fotograma por refresco
+        self.overlay_interval_ms = max(1, int(1000 / self.config.get('overlay_fps', 60)))
+        self.drag_pos = None
+        self.drag_frame_id = None
+        self.drag_frame_times = []
+        self.drag_events = 0
+
+        self.snip_window.geometry(f"{monitor.width}x{monitor.height}+{monitor.x}+{monitor.y}")
+        self.snip_window.deiconify()
+        self.snip_window.lift()
+        self.snip_window.focus_force()
+        self.snip_window.update_idletasks()
+        self.recorte_activo = True
+        self._responder_snip_remoto("ready")
+
     def on_button_press(self, event):
         self.start_x = self.canvas.canvasx(event.x)
         self.start_y = self.canvas.canvasy(event.y)
         self.canvas.coords(self.selection_rect_id, self.start_x, self.start_y, self.start_x, self.start_y)
 
     def on_mouse_drag(self, event):
-        x1, y1 = min(self.start_x, self.canvas.canvasx(event.x)), min(self.start_y, self.canvas.canvasy(event.y))
-        x2, y2 = max(self.start_x, self.canvas.canvasx(event.x)), max(self.start_y, self.canvas.canvasy(event.y))
+        # Solo se guarda la última posición; el dibujo se hace en _dibujar_seleccion
+        self.drag_pos = (self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        self.drag_events += 1
+        if self.drag_frame_id is None:
+            self.drag_frame_id = self.canvas.after(self.overlay_interval_ms, self._dibujar_seleccion)
+
+    def _dibujar_seleccion(self):
+        """Actualiza el rectángulo de selección y los cuatro rectángulos oscurecidos"""
+        self.drag_frame_id = None
+        if self.drag_pos is None or not self.canvas.winfo_exists():
+            return
+        inicio = time.perf_counter()
+        x, y = self.drag_pos
+        x1, y1 = min(self.start_x, x), min(self.start_y, y)
+        x2, y2 = max(self.start_x, x), max(self.start_y, y)
         if x1 == x2 or y1 == y2:
             return
+        ancho, alto = self.original_screenshot.size
+        arriba, abajo, izquierda, derecha = self.dim_rect_ids
+        self.canvas.coords(arriba, 0, 0, ancho, y1)
+        self.canvas.coords(abajo, 0, y2, ancho, alto)
+        self.canvas.coords(izquierda, 0, y1, x1, y2)
+        self.canvas.coords(derecha, x2, y1, ancho, y2)
         self.canvas.coords(self.selection_rect_id, x1, y1, x2, y2)
-        crop = self.original_screenshot.crop((int(x1), int(y1), int(x2), int(y2)))
-        self.revealed_image_tk = ImageTk.PhotoImage(crop)
-        self.canvas.itemconfig(self.selection_image_id, image=self.revealed_image_tk)
-        self.canvas.coords(self.selection_image_id, x1, y1)
-        self.canvas.lift(self.selection_rect_id)
+        self.drag_frame_times.append(time.perf_counter() - inicio)
+
+    def _informar_tiempos_arrastre(self):
+        """Muestra en consola el coste por fotograma del último arrastre"""
+        tiempos = sorted(self.drag_frame_times)
+        if not tiempos:
+            return
+        p95 = tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))]
+        self.ultimo_arrastre = {
+            "events": self.drag_events,
+            "frames": len(tiempos),
+            "avg_ms": 1000 * sum(tiempos) / len(tiempos),
+            "p95_ms": 1000 * p95,
+            "max_ms": 1000 * tiempos[-1],
+        }
+        print("Arrastre: {events} eventos, {frames} fotogramas, "
+              "media {avg_ms:.2f} ms, p95 {p95_ms:.2f} ms, máx {max_ms:.2f} ms".format(**self.ultimo_arrastre))
 
     def on_button_release(self, event):
         if not self.canvas or not self.canvas.winfo_exists():
@@ -532,11 +725,20 @@ El resultado debe estar listo para copiar y pegar en un documento de texto.""")
             print(f"Error al obtener coordenadas: {e}")
             return
 
-        self.snip_window.destroy()
-        self.master.deiconify()
+        if self.drag_frame_id is not None:
+            self.canvas.after_cancel(self.drag_frame_id)
+            self.drag_frame_id = None
+        self._informar_tiempos_arrastre()
         region = (int(x1), int(y1), int(x2), int(y2))
         screenshot = self.original_screenshot.crop(region)
-        self.revealed_image_tk = ImageTk.PhotoImage(screenshot)
+        self.memoria_recorte.sample("recorte")
+        self._ocultar_overlay()
+        if self.recortando_en_cola:
+            self._encolar_recorte(screenshot)
+            return
+        self.master.deiconify()
+        if self._usar_resultado_similar(screenshot):
+            return
         if self.auto_process_post_capture:
             if self.mode_var.get() == "Excel":
                 self.procesar_imagen_excel(screenshot)
@@ -545,18 +747,314 @@ El resultado debe estar listo para copiar y pegar en un documento de texto.""")
         else:
             self.confirmar_procesamiento_imagen(screenshot)
 
-    def cancelar_recorte(self, event=None):
-        if hasattr(self, 'snip_window') and self.snip_window:
-            self.snip_window.destroy()
+    def _ocultar_overlay(self):
+        """Oculta la ventana de recorte (se reutiliza) y suelta la captura"""
+        if self.drag_frame_id is not None:
+            self.canvas.after_cancel(self.drag_frame_id)
+            self.drag_frame_id = None
+        self.recorte_activo = False
+        self.snip_window.withdraw()
+        self._liberar_captura()
+
+    def _liberar_captura(self):
+        """Suelta la captura completa y su PhotoImage en cuanto ya no se necesitan"""
+        # En modo residente el PhotoImage se conserva para pegar en él el siguiente recorte
+        if not self.modo_residente:
+            self.canvas.itemconfig(self.screenshot_item_id, image="")
+            self.screenshot_tk = None
+        if getattr(self, 'original_screenshot', None) is not None:
+            self.original_screenshot.close()
+            self.original_screenshot = None
+        memoria = getattr(self, 'memoria_recorte', None)
+        if memoria is not None:
+            informe = memoria.report()
+            if informe:
+                print(informe)
+            self.memoria_recorte = None
+
+    def cancelar_recorte(self, event=None, avisar=True):
+        if not self.recorte_activo:
+            return
+        self._ocultar_overlay()
+        if self.recortando_en_cola:
+            # En modo cola Esc no cancela nada: termina la serie de recortes
+            self.recortando_en_cola = False
+            self.master.deiconify()
+            self.abrir_panel_cola()
+            return
+        if self.modo_residente and not avisar:
+            self.master.iconify()
+            return
         self.master.deiconify()
         messagebox.showinfo("Cancelado", "El recorte ha sido cancelado.")
 
+    # --- Modo residente (--daemon) ------------------------------------------
+
+    def iniciar_modo_residente(self):
+        """Escucha comandos en un socket local y mantiene calientes las conexiones"""
+        self.modo_residente = True
+        puerto = self.config.get('daemon_port', DEFAULT_PORT)
+        try:
+            self.snip_server = SnipServer(
+                {"snip": self._snip_remoto, "cancel": self._cancelar_remoto, "ping": lambda responder, _: responder("pong")},
+                deliver=lambda f: self.master.after(0, f), port=puerto).start()
+        except OSError as e:
+            messagebox.showerror("Error", f"No se pudo abrir el puerto {puerto} del modo residente: {e}")
+            return
+        print(f"Modo residente escuchando en {DEFAULT_HOST}:{puerto}")
+        # La ventana de recorte se crea ya, oculta, para no construirla en cada disparo
+        if self.snip_window is None:
+            self._crear_overlay()
+        self.master.iconify()
+        self._mantener_conexion()
+
+    def _mantener_conexion(self):
+        """Reabre periódicamente la conexión con OpenRouter para que no caduque el keep-alive"""
+        if not self.modo_residente:
+            return
+        try:
+            self.engine.submit(openrouter_client.prewarm)
+        except (EngineBusyError, RuntimeError):
+            pass
+        self.master.after(int(self.config.get('daemon_keepalive_seconds', 60) * 1000), self._mantener_conexion)
+
+    def _snip_remoto(self, responder, recibido):
+        if self.recorte_activo or self.snip_pendiente:
+            responder("busy")
+            return
+        self.snip_pendiente = (responder, recibido)
+        if self.master.state() == "normal":
+            # La ventana principal está visible: hay que esperar a que desaparezca
+            self.crear_ventana_recorte()
+        else:
+            self.iniciar_captura()
+
+    def _responder_snip_remoto(self, estado):
+        """Responde al disparo remoto pendiente con el tiempo hasta que el recorte es interactivo"""
+        if not self.snip_pendiente:
+            return
+        responder, recibido = self.snip_pendiente
+        self.snip_pendiente = None
+        responder(f"{estado} {(time.perf_counter() - recibido) * 1000:.1f}")
+
+    def _cancelar_remoto(self, responder, recibido):
+        activo = self.recorte_activo
+        self.cancelar_recorte(avisar=False)
+        responder("cancelled" if activo else "idle")
+
+    # --- Cola de recortes -----------------------------------------------------
+
+    def iniciar_recortes_en_cola(self):
+        """
+        Modo cola: cada recorte se añade a la cola y se abre el siguiente sin
+        esperar al resultado. Esc termina la serie y muestra el panel de la cola.
+        """
+        if self.recorte_activo:
+            return
+        self.abrir_panel_cola()
+        self.panel_cola.withdraw()
+        self.recortando_en_cola = True
+        self.crear_ventana_recorte()
+
+    def _obtener_cola(self):
+        if self.cola is None:
+            self.cola = CaptureQueue(
+                self.engine, self._preparar_trabajo_cola, self._enviar_trabajo_cola,
+                deliver=lambda f: self.master.after(0, f), on_update=self._actualizar_panel_cola,
+                prepare_workers=self.config.get('queue_prepare_workers', DEFAULT_PREPARE_WORKERS),
+                max_in_flight=self.config.get('max_in_flight_requests', DEFAULT_MAX_IN_FLIGHT))
+        return self.cola
+
+    def _encolar_recorte(self, imagen):
+        # Un clic sin arrastrar no añade nada
+        if imagen.width >= 5 and imagen.height >= 5:
+            modo = self.mode_var.get()
+            self._obtener_cola().add(imagen, modo, self._construir_prompt(modo, avisar=False),
+                                     MODEL_MAP[self.provider_var.get()], {"capture_ms": self._tomar_tiempo_captura()})
+        # El siguiente recorte se captura cuando la ventana de recorte ya está oculta
+        self.master.after(150, self.iniciar_captura)
+
+    def _preparar_trabajo_cola(self, job):
+        """Caché, preprocesado y codificación de un recorte; se ejecuta en el pool de la cola"""
+        clave = make_key(job.image, job.model_id, job.mode, job.prompt)
+        job.context["cache_key"] = clave
+        if self.config.get('cache_enabled', True):
+            salida = ResultCache.from_config(self.config).get(clave)
+            if salida is not None:
+                if job.mode == "Excel":
+                    self._exportar_automatico(salida)
+                job.output = salida
+                return
+        imagen, _, preprocess_ms = self._preprocesar(job.image, job.model_id)
+        codificada = self._imagen_a_base64(imagen, job.model_id, job.mode, job.prompt)
+        job.payload = build_payload(job.model_id, job.prompt, codificada)
+        job.metrics.update(preprocess_ms=preprocess_ms, encode_ms=codificada["encode_ms"],
+                           image_bytes=codificada["encoded_bytes"],
+                           **self._metricas_estimacion(job.model_id, job.mode, job.prompt, codificada["size"]))
+
+    def _enviar_trabajo_cola(self, job):
+        """Envía un recorte ya codificado y guarda el resultado; se ejecuta en el motor de peticiones"""
+        inicio, timings, info = time.perf_counter(), {}, None
+        maximo = self.scheduler.max_retries
+
+        def avisar(intento, espera, motivo):
+            texto = f"reintento {intento}/{maximo} en {espera:.1f} s ({motivo})"
+            self.master.after(0, lambda: self.cola.set_detail(job, texto))
+
+        try:
+            response, info = self._enviar_peticion(job.payload, job.cancel_event, on_retry=avisar, timings=timings)
+            result = response.json()
+        except RequestCancelled:
+            raise
+        except Exception as exc:
+            self._registrar_telemetria(job.model_id, job.mode, job.metrics, inicio, timings, info, error=exc, origen="cola")
+            raise
+        self._registrar_telemetria(job.model_id, job.mode, job.metrics, inicio, timings, info, result.get("usage"),
+                                   origen="cola")
+        output = result['choices'][0]['message']['content']
+        if job.mode == "Docs":
+            output = strip_code_fences(output)
+        self._registrar_captura()
+        clave = job.context["cache_key"]
+        ResultCache.from_config(self.config).put(clave, output, model=job.model_id, mode=job.mode)
+        self._obtener_indice_similares().add(dhash(job.image), context_id(job.model_id, job.mode, job.prompt, job.image.size),
+                                             clave, fingerprint(job.image))
+        if job.mode == "Excel":
+            self._exportar_automatico(output)
+        self._guardar_en_historial(job.image, job.model_id, job.mode, job.prompt, output, job.elapsed * 1000,
+                                   usage_fields(result.get("usage")))
+        return output
+
+    def abrir_panel_cola(self):
+        """Panel no modal con el estado de cada recorte de la cola; al cerrarlo solo se oculta"""
+        if self.panel_cola is not None and self.panel_cola.winfo_exists():
+            self.panel_cola.deiconify()
+            self.panel_cola.lift()
+            return
+        cola = self._obtener_cola()
+        window = Toplevel(self.master)
+        window.title("Cola de recortes")
+        window.geometry("820x380")
+        window.protocol("WM_DELETE_WINDOW", window.withdraw)
+        self.panel_cola = window
+
+        cabecera = Frame(window)
+        cabecera.pack(fill="x", padx=10, pady=(10, 0))
+        self.cola_progreso = ttk.Progressbar(cabecera, mode="determinate", length=300, maximum=100)
+        self.cola_progreso.pack(side="left")
+        self.cola_resumen = Label(cabecera, text="", font=("Helvetica", 8), fg="#666")
+        self.cola_resumen.pack(side="left", padx=10)
+
+        columnas = ("#", "Modo", "Modelo", "Tamaño", "Estado", "Tiempo", "Detalle")
+        self.cola_tree = ttk.Treeview(window, columns=columnas, show="headings", selectmode="extended")
+        anchos = {"#": 40, "Modo": 50, "Modelo": 200, "Tamaño": 80, "Estado": 100, "Tiempo": 60, "Detalle": 260}
+        for col in columnas:
+            self.cola_tree.heading(col, text=col)
+            self.cola_tree.column(col, width=anchos[col], anchor="e" if col in ("#", "Tiempo") else "w")
+        self.cola_tree.pack(fill="both", expand=True, padx=10, pady=10)
+        self.cola_tree.tag_configure(FAILED, foreground="#c62828")
+        self.cola_tree.bind("<Double-1>", lambda e: self._ver_resultado_cola())
+
+        botones = Frame(window)
+        botones.pack(pady=(0, 10))
+        for texto, comando in (("Añadir recortes", self.iniciar_recortes_en_cola), ("Ver resultado", self._ver_resultado_cola),
+                               ("Unir tablas", self._unir_tablas_cola), ("Cancelar", self._cancelar_seleccion_cola),
+                               ("Limpiar terminados", self._limpiar_cola), ("Cerrar", window.withdraw)):
+            Button(botones, text=texto, command=comando, cursor="hand2").pack(side="left", padx=4)
+
+        for job in cola.jobs:
+            self._actualizar_panel_cola(job)
+        self._refrescar_tiempos_cola()
+
+    def _valores_trabajo_cola(self, job):
+        detalle = job.detail
+        if job.state == DONE and not detalle:
+            detalle = (f"{parse_table(job.output).n_rows} filas" if job.mode == "Excel"
+                       else f"{len(job.output)} caracteres")
+        return (job.id, job.mode, job.model_id, f"{job.image.width}x{job.image.height}", job.state,
+                f"{job.elapsed:.1f} s", " ".join(detalle.split()))
+
+    def _actualizar_panel_cola(self, job):
+        if self.cola_tree is None or not self.cola_tree.winfo_exists():
+            return
+        iid = str(job.id)
+        if self.cola_tree.exists(iid):
+            self.cola_tree.item(iid, values=self._valores_trabajo_cola(job), tags=(job.state,))
+        else:
+            self.cola_tree.insert("", "end", iid=iid, values=self._valores_trabajo_cola(job), tags=(job.state,))
+        self._actualizar_resumen_cola()
+
+    def _refrescar_tiempos_cola(self):
+        """Actualiza cada medio segundo el tiempo de los trabajos en curso"""
+        if self.panel_cola is None or not self.panel_cola.winfo_exists():
+            return
+        for job in self.cola.jobs:
+            if job.state not in FINISHED and self.cola_tree.exists(str(job.id)):
+                self.cola_tree.set(str(job.id), "Tiempo", f"{job.elapsed:.1f} s")
+        self.panel_cola.after(500, self._refrescar_tiempos_cola)
+
+    def _trabajos_seleccionados_cola(self):
+        ids = {int(iid) for iid in self.cola_tree.selection()}
+        return [job for job in self.cola.jobs if job.id in ids]
+
+    def _ver_resultado_cola(self):
+        terminados = [job for job in self._trabajos_seleccionados_cola() if job.state == DONE]
+        if not terminados:
+            messagebox.showinfo("Cola de recortes", "Selecciona un recorte completado.", parent=self.panel_cola)
+            return
+        job = terminados[0]
+        self._procesar_imagen(job.image, job.mode, job.prompt, modelo_id=job.model_id, salida_guardada=job.output,
+                              origen="la cola")
+
+    def _cancelar_seleccion_cola(self):
+        for job in self._trabajos_seleccionados_cola():
+            self.cola.cancel(job)
+
+    def _limpiar_cola(self):
+        for job in self.cola.clear_finished():
+            self.cola_tree.delete(str(job.id))
+        self._actualizar_resumen_cola()
+
+    def _actualizar_resumen_cola(self):
+        """Barra de progreso y recuento de trabajos terminados"""
+        conteo = self.cola.counts()
+        total = sum(conteo.values())
+        terminados = sum(conteo.get(estado, 0) for estado in FINISHED)
+        self.cola_progreso["value"] = 100 * terminados / total if total else 0
+        resumen = f"{terminados}/{total} terminados"
+        if conteo.get(FAILED):
+            resumen += f" · {conteo[FAILED]} con error"
+        self.cola_resumen.config(text=resumen)
+
+    def _unir_tablas_cola(self):
+        """Une en una sola tabla los resultados Excel completados (los seleccionados o todos), en orden"""
+        trabajos = self._trabajos_seleccionados_cola() or self.cola.jobs
+        trabajos = [job for job in trabajos if job.state == DONE and job.mode == "Excel"]
+        if not trabajos:
+            messagebox.showinfo("Cola de recortes", "No hay tablas completadas para unir.", parent=self.panel_cola)
+            return
+        filas = concatenate_tables([parse_table(job.output).rows() for job in trabajos])
+        window = Toplevel(self.master)
+        window.title(f"Tablas unidas ({len(trabajos)} recortes, {len(filas)} filas)")
+        window.geometry("700x450")
+        grid = VirtualGrid(window)
+        grid.pack(fill="both", expand=True, padx=10, pady=10)
+        grid.set_rows(filas)
+        botones = Frame(window)
+        botones.pack(pady=(0, 10))
+        Button(botones, text="Copiar celdas", command=lambda: self.copiar_al_portapapeles(grid.to_tsv()),
+               cursor="hand2").pack(side="left", padx=4)
+        guardar = Button(botones, text="Guardar como…", cursor="hand2")
+        guardar.config(command=lambda: self.guardar_tabla_como(grid, window, guardar))
+        guardar.pack(side="left", padx=4)
+
     def confirmar_procesamiento_imagen(self, imagen):
+        from PIL import ImageTk
         # Obtén tamaño de la imagen
         img_width, img_height = imagen.size
         # Calcula tamaño mínimo de ventana (imagen + espacio para botones)
         min_width = max(400, img_width + 50)
-        min_height = img_height + 110  
+        min_height = img_height + 150
         win = Toplevel(self.master)
         win.title("Confirmar procesamiento")
         win.geometry(f"{min_width}x{min_height}")
@@ -565,13 +1063,21 @@ El resultado debe estar listo para copiar y pegar en un documento de texto.""")
         img_tk = ImageTk.PhotoImage(imagen)
         lbl = Label(win, image=img_tk)
         lbl.image = img_tk
-        lbl.pack(padx=20, pady=20, expand=True)
+        lbl.pack(padx=20, pady=(20, 6), expand=True)
+        # Estimación de tokens y coste antes de enviar
+        modo = self.mode_var.get()
+        modelo_id = MODEL_MAP[self.provider_var.get()]
+        # Se estima sobre la imagen ya preprocesada, que es la que se enviará; al procesar se reutiliza
+        preprocesado = self._preprocesar(imagen, modelo_id, ampliar=not self._usar_franjas(modo, imagen.height))
+        estimacion, _, reducido = self._estimar_captura(preprocesado[0].size, modelo_id, modo,
+                                                        self._construir_prompt(modo, avisar=False))
+        Label(win, text=describe_estimate(estimacion, reducido), font=("Helvetica", 8), fg="#666", justify="center").pack()
         btn_frame = Frame(win)
         btn_frame.pack(pady=(10, 10))
         if self.mode_var.get() == "Excel":
-            btn = Button(btn_frame, text="Procesar", command=lambda: (win.destroy(), self.procesar_imagen_excel(imagen)), bg="#4CAF50", fg="white", font=("Helvetica", 10, "bold"), relief="raised", borderwidth=2, cursor="hand2")
+            btn = Button(btn_frame, text="Procesar", command=lambda: (win.destroy(), self.procesar_imagen_excel(imagen, preprocesado=preprocesado)), bg="#4CAF50", fg="white", font=("Helvetica", 10, "bold"), relief="raised", borderwidth=2, cursor="hand2")
         else:
-            btn = Button(btn_frame, text="Procesar", command=lambda: (win.destroy(), self.procesar_imagen_docs(imagen)), bg="#4CAF50", fg="white", font=("Helvetica", 10, "bold"), relief="raised", borderwidth=2, cursor="hand2")
+            btn = Button(btn_frame, text="Procesar", command=lambda: (win.destroy(), self.procesar_imagen_docs(imagen, preprocesado=preprocesado)), bg="#4CAF50", fg="white", font=("Helvetica", 10, "bold"), relief="raised", borderwidth=2, cursor="hand2")
         btn.grid(row=0, column=0, padx=(0, 10))
         btn_cancel = Button(btn_frame, text="Cancelar", command=win.destroy, bg="#F44336", fg="white", font=("Helvetica", 10, "bold"), relief="raised", borderwidth=2, cursor="hand2")
         btn_cancel.grid(row=0, column=1)
@@ -579,197 +1085,736 @@ El resultado debe estar listo para copiar y pegar en un documento de texto.""")
         win.grab_set()
         self.master.wait_window(win)
 
-    def procesar_imagen_excel(self, imagen):
-        # Construir el prompt final
-        prompt_usuario = self.prompt_excel.strip()
-        prompt_formato = """
-Responde únicamente en formato TSV (tab-separated values), donde cada fila representa una fila de la tabla y cada columna está separada por un tabulador. No incluyas ningún texto adicional fuera de la tabla. Ejemplo:
-Cantidad\tPrecio S/.\tParcial S/.
-4.0000\t9.93\t39.72
-2.0000\t8.94\t17.88
-
-Si alguna columna o fila no cuadra con lo que percibes en la imagen, puedes dejar celdas vacías; no es obligatorio llenar todas las celdas.
-"""
-        prompt = prompt_usuario + "\n\n" + prompt_formato
+    def _construir_prompt(self, modo, avisar=True):
+        """Construye el prompt final para el modo indicado (con dimensiones manuales en Excel)"""
+        if modo == "Docs":
+            return build_prompt("Docs", self.prompt_docs)
 
+        cols = rows = None
         if self.dimension_var.get() == "Manual":
-            cols = self.cols_entry.get()
-            rows = self.rows_entry.get()
-            if cols.isdigit() and rows.isdigit():
-                prompt += f"\n\nInstrucción adicional: La tabla debe tener exactamente {cols} columnas y {rows} filas."
-            else:
+            if self.cols_entry.get().isdigit() and self.rows_entry.get().isdigit():
+                cols, rows = self.cols_entry.get(), self.rows_entry.get()
+            elif avisar:
                 messagebox.showwarning("Datos inválidos", "Las dimensiones deben ser números. Se usará modo automático.")
-
-        modelo_id = MODEL_MAP[self.provider_var.get()]
-        base64_img = self._imagen_a_base64(imagen)
-
-        payload = {
-            "model": modelo_id,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": f"data:image/png;base64,{base64_img}"}
-                    ]
-                }
-            ]
-        }
+        return build_prompt("Excel", self.prompt_excel, cols, rows)
+
+    def procesar_imagen_excel(self, imagen, usar_cache=True, preprocesado=None):
+        self._procesar_imagen(imagen, "Excel", self._construir_prompt("Excel"), usar_cache, preprocesado=preprocesado)
+
+    def procesar_imagen_docs(self, imagen, usar_cache=True, preprocesado=None):
+        self._procesar_imagen(imagen, "Docs", self._construir_prompt("Docs"), usar_cache, preprocesado=preprocesado)
+
+    def _procesar_imagen(self, imagen, modo, prompt, usar_cache=True, clave_similar=None, modelo_id=None,
+                         salida_guardada=None, origen=None, preprocesado=None):
+        """
+        Busca el resultado en caché o envía la imagen al modelo y abre la ventana de resultado.
+        clave_similar es la clave de caché de una captura casi idéntica a reutilizar.
+        modelo_id sustituye al modelo seleccionado y salida_guardada muestra un
+        resultado ya obtenido (historial, cola) sin hacer ninguna petición.
+        preprocesado es el resultado de _preprocesar ya calculado (diálogo de confirmación).
+        """
+        modelo_id = modelo_id or MODEL_MAP[self.provider_var.get()]
+        cache = ResultCache.from_config(self.config)
+        cache_key = make_key(imagen, modelo_id, modo, prompt)
+        salida_cache = None
+        if salida_guardada is not None:
+            salida_cache = salida_guardada
+        elif clave_similar:
+            salida_cache = cache.get(clave_similar)
+        elif usar_cache and self.config.get('cache_enabled', True):
+            salida_cache = cache.get(cache_key)
 
         # Ventana de resultado con Frame para organizar widgets
         self.result_win = Toplevel(self.master)
-        self.result_win.title("Resultado (TSV, listo para copiar y pegar en Excel)")
+        if modo == "Excel":
+            self.result_win.title("Resultado (TSV, listo para copiar y pegar en Excel)")
+        else:
+            self.result_win.title("Resultado (Texto extraído, listo para copiar)")
         self.result_win.geometry("600x400")
         frame = Frame(self.result_win)
         frame.pack(fill="both", expand=True)
 
-        self.result_text = Text(frame, wrap="none", font=("Consolas", 11))
+        self.result_text = Text(frame, wrap="none" if modo == "Excel" else "word", font=("Consolas", 11))
         self.result_text.insert("1.0", "Cargando, por favor espera...")
         self.result_text.config(state="disabled")
         self.result_text.pack(fill="both", expand=True, padx=10, pady=10)
 
-        self.copy_btn = Button(frame, text="Copiar celdas", state="disabled", command=lambda: self.copiar_al_portapapeles(self.result_text.get("1.0", "end-1c")), cursor="hand2")
+        texto_copia = "Copiar celdas" if modo == "Excel" else "Copiar texto"
+        self.copy_btn = Button(frame, text=texto_copia, state="disabled", command=lambda: self.copiar_al_portapapeles(self.result_text.get("1.0", "end-1c")), cursor="hand2")
         self.copy_btn.pack(pady=8)
+        # Se muestra al tener la tabla, debajo del botón de copia
+        self.save_btn = Button(frame, text="Guardar como…", state="disabled", cursor="hand2") if modo == "Excel" else None
 
         self.result_win.transient(self.master)
         self.result_win.grab_set()
 
-        threading.Thread(target=self._peticion_api_thread, args=(payload,), daemon=True).start()
+        if salida_cache is not None:
+            if origen is None:
+                origen = "una captura casi idéntica" if clave_similar else "caché"
+            Label(frame, text=f"⚡ Resultado desde {origen} (sin petición a la API)", font=("Helvetica", 8), fg="#2e7d32").pack(pady=(0, 4))
+            Button(frame, text="Reprocesar sin caché", font=("Helvetica", 8), cursor="hand2",
+                   command=lambda: (self.result_win.destroy(), self._procesar_imagen(imagen, modo, prompt, usar_cache=False,
+                                                                                     modelo_id=modelo_id))).pack(pady=(0, 4))
+            if modo == "Excel":
+                self._mostrar_tabla_tsv_en_widget(salida_cache)
+                if salida_guardada is None:
+                    self._exportar_automatico(salida_cache)
+            else:
+                self._mostrar_texto_en_widget(salida_cache)
+            return
 
-    def _peticion_api_thread(self, payload):
-        import json
+        hash_imagen, huella = dhash(imagen), fingerprint(imagen)
+        contexto = context_id(modelo_id, modo, prompt, imagen.size)
+
+        imagen_original = imagen
+        inicio = time.perf_counter()
+
+        def guardar_resultado(output, modelo=None, usage=None):
+            cache.put(cache_key, output, model=modelo_id, mode=modo)
+            self._obtener_indice_similares().add(hash_imagen, contexto, cache_key, huella)
+            if modo == "Excel":
+                self._exportar_automatico(output)
+            self._guardar_en_historial(imagen_original, modelo or modelo_id, modo, prompt, output,
+                                       (time.perf_counter() - inicio) * 1000, usage)
+
+        # La caché y el índice de similares usan la captura sin preprocesar. Las
+        # franjas se deciden con la altura original y, si se divide, no se amplía
+        # el texto (duplicaría el número de franjas)
+        por_franjas = self._usar_franjas(modo, imagen.height)
+        imagen, resumen_preprocesado, preprocess_ms = preprocesado or self._preprocesar(imagen, modelo_id,
+                                                                                        ampliar=not por_franjas)
+        if resumen_preprocesado:
+            Label(frame, text=resumen_preprocesado, font=("Helvetica", 8), fg="#666").pack(pady=(0, 4))
+
+        if por_franjas:
+            self._procesar_por_franjas(imagen, modelo_id, prompt, frame, guardar_resultado)
+            return
+
+        imagen_codificada = self._imagen_a_base64(imagen, modelo_id, modo, prompt)
+        payload = build_payload(modelo_id, prompt, imagen_codificada)
+        metricas = {"capture_ms": self._tomar_tiempo_captura(), "preprocess_ms": preprocess_ms,
+                    "encode_ms": imagen_codificada["encode_ms"],
+                    "image_bytes": imagen_codificada["encoded_bytes"],
+                    **self._metricas_estimacion(modelo_id, modo, prompt, imagen_codificada["size"])}
+
+        Label(frame, text=describe_encoding(imagen_codificada), font=("Helvetica", 8), fg="#666").pack(pady=(0, 4))
+
+        estrategia = self.config.get('model_strategy', 'single')
+        modelos = self._modelos_estrategia(modelo_id, estrategia)
+        if len(modelos) > 1:
+            self._procesar_multimodelo(estrategia, modelos, prompt, imagen_codificada, modo, frame, guardar_resultado, metricas)
+            return
+
+        self._iniciar_peticion(payload, modo, frame, guardar_resultado, metricas)
+
+    def _usar_franjas(self, modo, altura):
+        """True si una captura Excel de esta altura (sin preprocesar) se divide en franjas"""
+        return (modo == "Excel" and self.config.get('tiling_enabled', True)
+                and altura >= self.config.get('tiling_min_height', DEFAULT_MIN_HEIGHT))
+
+    def _preprocesar(self, imagen, modelo_id, ampliar=True):
+        """
+        Recorta bordes uniformes y simplifica la captura antes de codificarla.
+        Con ampliar=False no se amplía el texto pequeño (capturas que se dividen en franjas).
+        Devuelve (imagen, resumen para la interfaz, ms totales o None si está desactivado).
+        """
+        settings = get_preprocess_settings(self.config.get('image_preprocess'))
+        if not settings["enabled"]:
+            return imagen, "", None
+        if not ampliar:
+            settings["upscale_small_text"] = False
+        encoding_config = self.config.get('image_encoding', DEFAULT_CONFIG['image_encoding'])
+        imagen, pasos = preprocess_image(imagen, settings, modelo_id, get_encoding_settings(encoding_config, modelo_id))
+        print_report(pasos)
+        return imagen, describe_preprocess(pasos), sum(p["ms"] for p in pasos)
+
+    def _tokens_salida_esperados(self, modelo_id, modo):
+        """Mediana de los tokens de salida registrados, o el valor por defecto del modo"""
+        medianos = self.telemetry.median_completion_tokens(modelo_id, modo) if self.telemetry is not None else None
+        return medianos or DEFAULT_OUTPUT_TOKENS.get(modo, 500)
+
+    def _estimar_captura(self, size, modelo_id, modo, prompt):
+        """
+        Estima tokens y coste de una captura de tamaño size. Si hay presupuesto
+        por captura, reduce max_pixels para no superarlo.
+        Devuelve (estimación, ajustes de codificación, tamaño reducido o None).
+        """
+        encoding_config = self.config.get('image_encoding', DEFAULT_CONFIG['image_encoding'])
+        settings = get_encoding_settings(encoding_config, modelo_id)
+        precios = self.config.get('model_prices')
+        salida = self._tokens_salida_esperados(modelo_id, modo)
+        presupuesto = budget_tokens(self.config.get('capture_budget_tokens', 0), self.config.get('capture_budget_usd', 0.0),
+                                    modelo_id, precios, salida)
+        settings, reducido = budget_settings(settings, modelo_id, size, prompt, presupuesto)
+        ancho, alto = reducido or target_size(size[0], size[1], settings)
+        return estimate(modelo_id, ancho, alto, prompt, modo, precios, salida), settings, reducido
+
+    def _metricas_estimacion(self, modelo_id, modo, prompt, size):
+        """Estimación para la imagen ya codificada, que se compara después con el usage real"""
+        estimacion = estimate(modelo_id, size[0], size[1], prompt, modo, self.config.get('model_prices'),
+                              self._tokens_salida_esperados(modelo_id, modo))
+        return {"estimated_prompt_tokens": estimacion["input_tokens"], "estimated_cost": estimacion["cost"]}
+
+    def _tomar_tiempo_captura(self):
+        """Devuelve el tiempo de la última captura una sola vez (los reprocesos no lo repiten)"""
+        tiempo, self.ultima_captura_ms = self.ultima_captura_ms, None
+        return tiempo
+
+    def _registrar_telemetria(self, modelo_id, modo, metricas, inicio, timings=None, info=None,
+                              usage=None, error=None, origen="captura", ttfb=None):
+        """Guarda en la telemetría local una petición terminada (bien o con error)"""
+        if self.telemetry is None:
+            return
+        timings = timings or {}
+        datos = dict(metricas or {}, **usage_fields(usage))
+        datos.update(
+            total_ms=(time.perf_counter() - inicio) * 1000,
+            request_bytes=timings.get("request_bytes"),
+            upload_ms=timings["upload_s"] * 1000 if "upload_s" in timings else None,
+            ttfb_ms=ttfb * 1000 if ttfb is not None else (timings["ttfb_s"] * 1000 if "ttfb_s" in timings else None),
+            retries=info["retries"] if info else None,
+            wait_ms=info["wait_seconds"] * 1000 if info else None,
+        )
+        self.telemetry.record(modelo_id, modo, source=origen, status="error" if error else "ok",
+                              error=str(error)[:300] if error else None, **datos)
+
+    def _modelos_estrategia(self, modelo_id, estrategia):
+        """
+        Modelos para la estrategia "race" o "fallback" (el seleccionado primero).
+        Con adaptive_model_order el resto se ordena según las estadísticas guardadas.
+        """
+        if estrategia not in ("race", "fallback"):
+            return [modelo_id]
+        nombres = self.config.get('race_models' if estrategia == "race" else 'fallback_models', [])
+        otros = [MODEL_MAP.get(nombre, nombre) for nombre in nombres]
+        otros = [m for i, m in enumerate(otros) if m != modelo_id and m not in otros[:i]]
+        if self.config.get('adaptive_model_order', True):
+            otros = self._obtener_estadisticas_modelos().order(otros)
+        modelos = [modelo_id] + otros
+        if estrategia == "race":
+            modelos = modelos[:max(1, self.config.get('race_width', DEFAULT_RACE_WIDTH))]
+        return modelos
+
+    def _obtener_estadisticas_modelos(self):
+        if self.model_stats is None:
+            self.model_stats = ModelStats()
+        return self.model_stats
+
+    def _procesar_multimodelo(self, estrategia, modelos, prompt, imagen_codificada, modo, frame, guardar_resultado, metricas):
+        """Envía la captura a varios modelos en carrera o en cadena y muestra el primero válido"""
+        cancel_event = threading.Event()
+
+        def enviar_a_modelo(modelo_id, payload, deadline, cancel_modelo):
+            # En streaming, al cancelar un perdedor se cierra su conexión y el modelo deja de generar
+            inicio, timings, usage, info = time.perf_counter(), {}, {}, None
+            metricas_modelo = dict(metricas, **self._metricas_estimacion(modelo_id, modo, prompt, imagen_codificada["size"]))
+            try:
+                response, info = self._enviar_peticion(payload, cancel_modelo, stream=True, deadline=deadline, timings=timings)
+                output = "".join(openrouter_client.iter_chat_stream(response, cancel_modelo, usage))
+                if cancel_modelo.is_set():
+                    raise RequestCancelled("Solicitud cancelada")
+            except RequestCancelled:
+                raise
+            except Exception as exc:
+                self._registrar_telemetria(modelo_id, modo, metricas_modelo, inicio, timings, info, usage, error=exc,
+                                           origen=estrategia)
+                raise
+            self._registrar_telemetria(modelo_id, modo, metricas_modelo, inicio, timings, info, usage, origen=estrategia)
+            return output
+
+        router = ModelRouter(enviar_a_modelo, self._obtener_estadisticas_modelos())
+        inicio = time.perf_counter()
+        separador = " vs " if estrategia == "race" else " → "
+        Label(frame, text=("Carrera: " if estrategia == "race" else "Cadena: ") + separador.join(modelos),
+              font=("Helvetica", 8), fg="#666").pack(pady=(0, 4))
+        self.lbl_estado = Label(frame, text="", font=("Helvetica", 8), fg="#666")
+        self.lbl_estado.pack(pady=(0, 4))
+        cancel_btn = Button(frame, text="Cancelar", bg="#F44336", fg="white", cursor="hand2",
+                            command=lambda: (job.cancel(), cancel_btn.pack_forget(), self.lbl_estado.config(text="Solicitud cancelada")))
+        cancel_btn.pack(pady=(0, 4))
+
+        def avisar(texto):
+            self.master.after(0, lambda: self._mostrar_estado_stream(texto, cancel_event))
+
+        if estrategia == "race":
+            args = (router.race, modelos, prompt, imagen_codificada, modo, self.scheduler.new_deadline(), cancel_event, avisar)
+        else:
+            args = (lambda *a: router.fallback(*a, timeout=self.config.get('fallback_timeout_seconds', DEFAULT_FALLBACK_TIMEOUT), on_update=avisar),
+                    modelos, prompt, imagen_codificada, modo, self.scheduler.new_deadline(), cancel_event)
+
+        def terminado(resultado):
+            ganador, output, latencia = resultado
+            cancel_btn.pack_forget()
+            print("\n--- RESPUESTA ---\n", output, "\n--- FIN ---")
+            output = output if modo == "Excel" else strip_code_fences(output)
+            self._registrar_captura()
+            guardar_resultado(output, modelo=ganador)
+            if modo == "Excel":
+                self._mostrar_tabla_tsv_en_widget(output)
+            else:
+                self._mostrar_texto_en_widget(output)
+            self.lbl_estado.config(text=f"Respuesta de {ganador} en {latencia:.2f} s (total {time.perf_counter() - inicio:.2f} s)")
+
+        def fallido(exc):
+            if isinstance(exc, RequestCancelled):
+                return
+            cancel_btn.pack_forget()
+            if modo == "Excel":
+                self._mostrar_tabla_tsv_en_widget(f"Error: {exc}")
+            else:
+                self._mostrar_texto_en_widget(f"Error: {exc}")
+
+        try:
+            job = self.engine.submit(*args, cancel_event=cancel_event, on_done=terminado, on_error=fallido)
+        except EngineBusyError as e:
+            self.result_win.destroy()
+            messagebox.showwarning("Ocupado", str(e))
+            return
+        self.result_win.protocol("WM_DELETE_WINDOW", lambda: (job.cancel(), self.result_win.destroy()))
+
+    def _procesar_por_franjas(self, imagen, modelo_id, prompt, frame, guardar_resultado):
+        """
+        Divide una captura muy alta en franjas solapadas cortadas en huecos entre
+        filas, las envía en paralelo y une las tablas quitando filas repetidas.
+        El prompt de cada franja sale del prompt de la captura (el de la cola o
+        el historial, no el que muestra ahora la interfaz).
+        """
+        franjas = split_into_bands(imagen, self.config.get('tiling_band_height', DEFAULT_BAND_HEIGHT),
+                                   self.config.get('tiling_overlap', DEFAULT_OVERLAP))
+        prompt_franja, cols = build_band_prompt(prompt)
+        cancel_event = threading.Event()
+        tablas = [None] * len(franjas)
+        estado = {"pendientes": len(franjas), "error": False}
+        jobs = []
+        inicio = time.perf_counter()
+        # Todas las franjas comparten el plazo máximo de la captura
+        deadline = self.scheduler.new_deadline()
+        capture_ms = self._tomar_tiempo_captura()
+        reintentos = {"retries": 0, "wait_seconds": 0.0}
+
+        Label(frame, text=f"Captura de {imagen.height}px dividida en {len(franjas)} franjas", font=("Helvetica", 8), fg="#666").pack(pady=(0, 4))
+        self.lbl_estado = Label(frame, text=f"Franjas: 0/{len(franjas)} completadas", font=("Helvetica", 8), fg="#666")
+        self.lbl_estado.pack(pady=(0, 4))
+
+        def cancelar():
+            for job in jobs:
+                job.cancel()
+
+        cancel_btn = Button(frame, text="Cancelar", command=lambda: (cancelar(), cancel_btn.pack_forget(), self.lbl_estado.config(text="Solicitud cancelada")), bg="#F44336", fg="white", cursor="hand2")
+        cancel_btn.pack(pady=(0, 4))
+        self.result_win.protocol("WM_DELETE_WINDOW", lambda: (cancelar(), self.result_win.destroy()))
+
+        def terminada(i, resultado):
+            output, info = resultado
+            reintentos["retries"] += info["retries"]
+            reintentos["wait_seconds"] += info["wait_seconds"]
+            tablas[i] = parse_rows(output)[0]
+            estado["pendientes"] -= 1
+            self.lbl_estado.config(text=f"Franjas: {len(franjas) - estado['pendientes']}/{len(franjas)} completadas")
+            if estado["pendientes"]:
+                return
+            cancel_btn.pack_forget()
+            tabla = merge_tables(tablas)
+            avisos = check_columns(tablas, cols)
+            output = table_to_tsv(tabla)
+            self._registrar_captura()
+            guardar_resultado(output)
+            self._mostrar_tabla_tsv_en_widget(output)
+            texto = f"Completado en {time.perf_counter() - inicio:.2f} s ({len(franjas)} franjas en paralelo)"
+            if describe_retries(reintentos):
+                texto += f" · {describe_retries(reintentos)}"
+            if avisos:
+                texto += "\n⚠ " + "; ".join(avisos)
+            self.lbl_estado.config(text=texto, fg="#e65100" if avisos else "#666")
+
+        def fallida(exc):
+            if estado["error"] or isinstance(exc, RequestCancelled):
+                return
+            estado["error"] = True
+            cancelar()
+            cancel_btn.pack_forget()
+            self._mostrar_tabla_tsv_en_widget(f"Error: {exc}")
+
+        try:
+            for i, (_, _, franja) in enumerate(franjas):
+                jobs.append(self.engine.submit(
+                    self._peticion_franja, franja, modelo_id, prompt_franja, cancel_event, deadline,
+                    self._avisar_reintento(cancel_event, f"Franja {i + 1}: "), capture_ms if i == 0 else None,
+                    cancel_event=cancel_event,
+                    on_done=lambda output, i=i: terminada(i, output), on_error=fallida))
+        except EngineBusyError as e:
+            fallida(e)
+
+    def _peticion_franja(self, franja, modelo_id, prompt, cancel_event, deadline, on_retry, capture_ms=None):
+        """Codifica y envía una franja; se ejecuta en el motor de peticiones"""
+        codificada = self._imagen_a_base64(franja, modelo_id)
+        payload = build_payload(modelo_id, prompt, codificada)
+        if cancel_event.is_set():
+            return "", {"retries": 0, "wait_seconds": 0.0}
+        metricas = {"capture_ms": capture_ms, "encode_ms": codificada["encode_ms"], "image_bytes": codificada["encoded_bytes"],
+                    **self._metricas_estimacion(modelo_id, "Excel", prompt, codificada["size"])}
+        inicio, timings, info = time.perf_counter(), {}, None
         try:
-            response = requests.post(
-                url="https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}"
-                },
-                json=payload
-            )
-            response.raise_for_status()
+            response, info = self._enviar_peticion(payload, cancel_event, deadline=deadline, on_retry=on_retry, timings=timings)
             result = response.json()
+        except RequestCancelled:
+            raise
+        except Exception as exc:
+            self._registrar_telemetria(modelo_id, "Excel", metricas, inicio, timings, info, error=exc, origen="franja")
+            raise
+        self._registrar_telemetria(modelo_id, "Excel", metricas, inicio, timings, info, result.get("usage"), origen="franja")
+        return strip_code_fences(result['choices'][0]['message']['content']), info
+
+    def _enviar_peticion(self, payload, cancel_event=None, stream=False, deadline=None, on_retry=None, timings=None):
+        """Envía el payload a través del planificador (reintentos y límite por modelo)"""
+        if stream:
+            enviar = lambda timeout: openrouter_client.open_chat_stream(self.api_key, payload, timeout, timings)
+        else:
+            enviar = lambda timeout: openrouter_client.post_chat_completion(self.api_key, payload, timeout, timings)
+        return self.scheduler.call(payload["model"], enviar, deadline=deadline,
+                                   cancel_event=cancel_event, on_retry=on_retry)
+
+    def _avisar_reintento(self, cancel_event, prefijo=""):
+        """Callback para el planificador que muestra cada reintento en la ventana de resultado"""
+        maximo = self.scheduler.max_retries
+
+        def avisar(intento, espera, motivo):
+            texto = f"{prefijo}reintento {intento}/{maximo} en {espera:.1f} s ({motivo})"
+            self.master.after(0, lambda: self._mostrar_estado_stream(texto[0].upper() + texto[1:], cancel_event))
+        return avisar
+
+    def _obtener_indice_similares(self):
+        """Carga el índice de hashes perceptuales la primera vez que se necesita"""
+        if self.phash_index is None:
+            self.phash_index = PerceptualIndex(max_entries=self.config.get('near_duplicate_max_entries', DEFAULT_MAX_ENTRIES))
+        return self.phash_index
+
+    def _usar_resultado_similar(self, imagen):
+        """
+        Busca una captura anterior casi idéntica (dHash) y, según near_duplicate_mode
+        ("ask", "auto" u "off"), ofrece o usa directamente su resultado guardado.
+        Devuelve True si se reutilizó un resultado.
+        """
+        modo_similares = self.config.get('near_duplicate_mode', 'ask')
+        if modo_similares == 'off' or not self.config.get('cache_enabled', True):
+            return False
+        modo = self.mode_var.get()
+        modelo_id = MODEL_MAP[self.provider_var.get()]
+        prompt = self._construir_prompt(modo, avisar=False)
+        coincidencia = self._obtener_indice_similares().find(
+            dhash(imagen), context_id(modelo_id, modo, prompt, imagen.size), fingerprint(imagen),
+            self.config.get('near_duplicate_threshold', DEFAULT_THRESHOLD))
+        if coincidencia is None:
+            return False
+        clave, distancia = coincidencia
+        if ResultCache.from_config(self.config).get(clave) is None:
+            return False
+        if modo_similares == 'ask' and not messagebox.askyesno(
+                "Captura similar",
+                f"Esta captura es casi idéntica a una anterior (diferencia {distancia}/64).\n"
+                "¿Usar el resultado guardado sin hacer una nueva petición?"):
+            return False
+        self._procesar_imagen(imagen, modo, prompt, clave_similar=clave)
+        return True
+
+    def _peticion_api_thread(self, payload, cancel_event, guardar_resultado=None, metricas=None):
+        inicio, timings, info = time.perf_counter(), {}, None
+        try:
+            response, info = self._enviar_peticion(payload, cancel_event, on_retry=self._avisar_reintento(cancel_event),
+                                                   timings=timings)
+            result = response.json()
+            self._registrar_telemetria(payload["model"], "Excel", metricas, inicio, timings, info, result.get("usage"))
             output = result['choices'][0]['message']['content']
             print("\n--- RESPUESTA ---\n", output, "\n--- FIN ---")
-            
-            # Incrementar contador de capturas y verificar si necesita actualizar uso
-            self.capturas_realizadas += 1
-            if self.capturas_realizadas >= CAPTURAS_ANTES_ACTUALIZAR:
-                self.capturas_realizadas = 0  # Reiniciar contador
-                self.actualizar_uso_api()  # Actualizar uso automáticamente
-            
-            self.master.after(0, lambda: self._mostrar_tabla_tsv_en_widget(output))
+            self._registrar_captura()
+            if guardar_resultado:
+                guardar_resultado(output, usage=usage_fields(result.get("usage")))
+            self.master.after(0, lambda: (self._mostrar_tabla_tsv_en_widget(output),
+                                          self._mostrar_estado_stream(describe_retries(info), cancel_event)))
+        except RequestCancelled:
+            pass
         except Exception as exc:
+            self._registrar_telemetria(payload["model"], "Excel", metricas, inicio, timings, info, error=exc)
             error_msg = f"Error: {exc}"
             self.master.after(0, lambda: self._mostrar_tabla_tsv_en_widget(error_msg))
 
-    def _mostrar_tabla_tsv_en_widget(self, output):
-        import json
-        # Si la respuesta parece ser JSON, convertir a matriz
+    def _registrar_captura(self):
+        """Incrementa el contador de capturas y actualiza el uso de API cada CAPTURAS_ANTES_ACTUALIZAR"""
+        self.capturas_realizadas += 1
+        if self.capturas_realizadas >= CAPTURAS_ANTES_ACTUALIZAR:
+            self.capturas_realizadas = 0  # Reiniciar contador
+            self.actualizar_uso_api()  # Actualizar uso automáticamente
+
+    def _iniciar_peticion(self, payload, modo, frame, guardar_resultado=None, metricas=None):
+        """
+        Lanza la petición a la API en un hilo, en streaming o no según la configuración.
+        guardar_resultado recibe la salida final si la petición termina bien.
+        """
+        cancel_event = threading.Event()
+
+        self.lbl_estado = Label(frame, text="", font=("Helvetica", 8), fg="#666")
+        self.lbl_estado.pack(pady=(0, 4))
+
+        if self.config.get('streaming_enabled', True):
+            self.cancel_btn = Button(frame, text="Cancelar", command=lambda: self._cancelar_peticion(job), bg="#F44336", fg="white", cursor="hand2")
+            self.cancel_btn.pack(pady=(0, 4))
+            self.stream_grid = None
+            target, args = self._peticion_api_stream_thread, (payload, modo, cancel_event, guardar_resultado, metricas)
+        else:
+            target = self._peticion_api_thread if modo == "Excel" else self._peticion_api_thread_docs
+            args = (payload, cancel_event, guardar_resultado, metricas)
+
+        try:
+            job = self.engine.submit(target, *args, cancel_event=cancel_event)
+        except EngineBusyError as e:
+            self.result_win.destroy()
+            messagebox.showwarning("Ocupado", str(e))
+            return
+        self.result_win.protocol("WM_DELETE_WINDOW", lambda: (job.cancel(), self.result_win.destroy()))
+
+    def _cancelar_peticion(self, job):
+        """Aborta la petición en curso y conserva lo recibido hasta el momento"""
+        job.cancel()
+        self.cancel_btn.pack_forget()
+        self.lbl_estado.config(text="Solicitud cancelada")
+        if self.stream_grid is not None:
+            self._habilitar_copia_tabla(self.stream_grid)
+
+    def _peticion_api_stream_thread(self, payload, modo, cancel_event, guardar_resultado=None, metricas=None):
+        """Recibe la respuesta en streaming y la muestra fila a fila (Excel) o por fragmentos (Docs)"""
+        inicio = time.perf_counter()
+        timings, usage, info = {}, {}, None
+        primer_fragmento = None
+        primera = None
+        partes = []
+        pendiente = ""
+        es_json = None
         try:
-            data = json.loads(output)
-            max_row = max(item["row"] for item in data)
-            max_col = max(item["column"] for item in data)
-            table = [["" for _ in range(max_col)] for _ in range(max_row)]
-            for item in data:
-                table[item["row"]-1][item["column"]-1] = item["text"]
-        except Exception:
-            # Si ya es TSV, convertir a matriz
-            lines = output.strip().splitlines()
-            table = [line.split('\t') for line in lines if line.strip()]
-
-        # --- SOLUCIÓN VISUAL ---
-        # Asegura que todas las filas tengan el mismo número de columnas
-        max_cols = max(len(row) for row in table) if table else 0
-        for row in table:
-            if len(row) < max_cols:
-                row.extend([""] * (max_cols - len(row)))
+            # Los reintentos solo son posibles antes de recibir el primer fragmento
+            response, info = self._enviar_peticion(payload, cancel_event, stream=True,
+                                                   on_retry=self._avisar_reintento(cancel_event), timings=timings)
+            for fragmento in openrouter_client.iter_chat_stream(response, cancel_event, usage):
+                if primer_fragmento is None:
+                    primer_fragmento = time.perf_counter() - inicio
+                partes.append(fragmento)
+                if modo == "Docs":
+                    if primera is None:
+                        primera = time.perf_counter() - inicio
+                        self.master.after(0, lambda t=primera: self._mostrar_estado_stream(f"Primer texto en {t:.2f} s", cancel_event))
+                    self.master.after(0, lambda f=fragmento: self._agregar_texto_stream(f, cancel_event))
+                    continue
+
+                if es_json is None and "".join(partes).strip():
+                    # Las respuestas JSON no se pueden mostrar por filas; se procesan al final
+                    es_json = "".join(partes).lstrip()[0] in "[{"
+                if es_json:
+                    continue
+                pendiente += fragmento
+                *lineas, pendiente = pendiente.split("\n")
+                lineas = [l for l in lineas if l.strip() and not l.strip().startswith("```")]
+                if lineas:
+                    if primera is None:
+                        primera = time.perf_counter() - inicio
+                        print(f"Primera fila en {primera:.2f} s")
+                        self.master.after(0, lambda t=primera: self._mostrar_estado_stream(f"Primera fila en {t:.2f} s", cancel_event))
+                    self.master.after(0, lambda l=lineas: self._agregar_filas_stream(l, cancel_event))
+
+            if cancel_event.is_set():
+                return
+            if not es_json and pendiente.strip() and not pendiente.strip().startswith("```"):
+                self.master.after(0, lambda l=[pendiente]: self._agregar_filas_stream(l, cancel_event))
+
+            output = "".join(partes)
+            print("\n--- RESPUESTA ---\n", output, "\n--- FIN ---")
+            # En streaming el primer byte útil es el primer fragmento, no las cabeceras
+            self._registrar_telemetria(payload["model"], modo, metricas, inicio, timings, info, usage, ttfb=primer_fragmento)
+            self._registrar_captura()
+            if guardar_resultado:
+                guardar_resultado(output if modo == "Excel" else strip_code_fences(output), usage=usage_fields(usage))
+            total = time.perf_counter() - inicio
+            self.master.after(0, lambda: self._finalizar_stream(modo, output, es_json, total, primera, cancel_event, info))
+        except Exception as exc:
+            if cancel_event.is_set():
+                return
+            self._registrar_telemetria(payload["model"], modo, metricas, inicio, timings, info, usage, error=exc,
+                                       ttfb=primer_fragmento)
+            error_msg = f"Error: {exc}"
+            self.master.after(0, lambda: self._mostrar_error_stream(modo, error_msg, cancel_event))
 
-        # Borra el widget Text si existe
-        self.result_text.pack_forget()
+    def _mostrar_error_stream(self, modo, error_msg, cancel_event):
+        """Muestra un error del streaming conservando las filas que ya se recibieron"""
+        if cancel_event.is_set():
+            return
+        self.cancel_btn.pack_forget()
+        if self.stream_grid is not None:
+            self.lbl_estado.config(text=error_msg, fg="red")
+            self._habilitar_copia_tabla(self.stream_grid)
+        elif modo == "Excel":
+            self._mostrar_tabla_tsv_en_widget(error_msg)
+        else:
+            self._mostrar_texto_en_widget(error_msg)
 
-        tree_frame = Frame(self.result_win)
-        tree_frame.pack(fill="both", expand=True, padx=10, pady=10)
-        cols = [f"Col{i+1}" for i in range(max_cols)]
-        tree = ttk.Treeview(tree_frame, columns=cols, show="headings")
-        for i, col in enumerate(cols):
-            tree.heading(col, text=f"Columna {i+1}")
-            tree.column(col, width=120, anchor="center")
-        for row in table:
-            tree.insert("", "end", values=row)
-        tree.pack(fill="both", expand=True)
+    def _mostrar_estado_stream(self, texto, cancel_event):
+        if cancel_event.is_set():
+            return
+        self.lbl_estado.config(text=texto)
 
-        tsv = "\n".join(["\t".join(row) for row in table])
+    def _agregar_filas_stream(self, lineas, cancel_event):
+        """Añade a la tabla las filas TSV completas recibidas en streaming"""
+        if cancel_event.is_set():
+            return
+        if self.stream_grid is None:
+            self.stream_grid = self._crear_tabla_resultado()
+        self.stream_grid.append_rows([linea.split('\t') for linea in lineas])
+
+    def _agregar_texto_stream(self, fragmento, cancel_event):
+        """Añade al widget de texto un fragmento recibido en streaming"""
+        if cancel_event.is_set():
+            return
+        self.result_text.config(state="normal")
+        if not getattr(self.result_text, "stream_iniciado", False):
+            self.result_text.delete("1.0", "end")
+            self.result_text.stream_iniciado = True
+        self.result_text.insert("end", fragmento)
+        self.result_text.see("end")
+
+    def _finalizar_stream(self, modo, output, es_json, total, primera, cancel_event, info=None):
+        if cancel_event.is_set():
+            return
+        self.cancel_btn.pack_forget()
+        estado = f"Completado en {total:.2f} s"
+        if primera is not None:
+            estado += f" (primera {'fila' if modo == 'Excel' else 'respuesta'} en {primera:.2f} s)"
+        if describe_retries(info):
+            estado += f" · {describe_retries(info)}"
+        self.lbl_estado.config(text=estado)
+        if modo == "Docs":
+            self._mostrar_texto_en_widget(strip_code_fences(output))
+        elif es_json or self.stream_grid is None:
+            self._mostrar_tabla_tsv_en_widget(output)
+        else:
+            # Las filas se mostraron línea a línea; al terminar se sustituyen por
+            # el análisis completo (frases del modelo, celdas entrecomilladas)
+            self.stream_grid.set_rows(parse_table(output).rows())
+            self._habilitar_copia_tabla(self.stream_grid)
 
-        self.copy_btn.config(state="normal", command=lambda: self.copiar_al_portapapeles(tsv))
+    def _crear_tabla_resultado(self):
+        """Sustituye el texto de carga por una tabla virtualizada"""
+        # Borra el widget Text si existe
+        self.result_text.pack_forget()
+        grid = VirtualGrid(self.result_win)
+        grid.pack(fill="both", expand=True, padx=10, pady=10)
+        return grid
+
+    def _habilitar_copia_tabla(self, grid):
+        """Activa el botón de copia; el TSV se genera al copiar, no antes"""
+        self.copy_btn.config(state="normal", command=lambda: self.copiar_al_portapapeles(grid.to_tsv()))
         self.copy_btn.pack_forget()
         self.copy_btn.pack(pady=(2, 2))
         self.copy_btn.bind("<Enter>", lambda e: self.copy_btn.config(cursor="hand2"))
         self.copy_btn.bind("<Leave>", lambda e: self.copy_btn.config(cursor="arrow"))
+        if self.save_btn is not None:
+            self.save_btn.config(state="normal", command=lambda: self.guardar_tabla_como(grid))
+            self.save_btn.pack_forget()
+            self.save_btn.pack(pady=(0, 4))
+
+    def guardar_tabla_como(self, grid, ventana=None, boton=None):
+        """Exporta la tabla mostrada a .xlsx, .csv o .tsv fila a fila, sin pasar por el portapapeles"""
+        from tkinter import filedialog
+        ventana = ventana or self.result_win
+        boton = boton or self.save_btn
+        ruta = filedialog.asksaveasfilename(
+            parent=ventana, title="Guardar tabla", defaultextension=".xlsx",
+            initialdir=self.config.get('export_last_dir') or None,
+            filetypes=[("Libro de Excel", "*.xlsx"), ("CSV", "*.csv"), ("Texto separado por tabulaciones", "*.tsv")])
+        if not ruta:
+            return
+        try:
+            formato = export_format(ruta)
+        except ValueError as e:
+            messagebox.showerror("Guardar tabla", str(e), parent=ventana)
+            return
+        anadir = False
+        if formato == "xlsx" and os.path.exists(ruta):
+            anadir = messagebox.askyesnocancel(
+                "Guardar tabla", f"{os.path.basename(ruta)} ya existe.\n\n"
+                "Sí: añadir la tabla como hoja nueva\nNo: reemplazar el libro", parent=ventana)
+            if anadir is None:
+                return
+        update_config('export_last_dir', os.path.dirname(ruta))
+        # Copia de la lista de filas (no de las celdas) para que el streaming no la cambie mientras se escribe
+        filas = list(grid.iter_rows())
+        boton.config(state="disabled", text="Guardando…")
+
+        def exportar():
+            try:
+                escritas = export_table(ruta, filas, append=anadir, sheet_name=capture_sheet_title(),
+                                        csv_delimiter=self.config.get('export_csv_delimiter', DEFAULT_CSV_DELIMITER),
+                                        numbers=self.config.get('export_numbers', True),
+                                        decimal=self.config.get('export_decimal_separator') or None)
+                print(f"Tabla guardada en {ruta} ({escritas} filas)")
+                error = None
+            except (OSError, ValueError) as e:
+                error = str(e)
+            self.master.after(0, lambda: terminar(error))
+
+        def terminar(error):
+            if boton.winfo_exists():
+                boton.config(state="normal", text="Guardar como…")
+            if error:
+                messagebox.showerror("Guardar tabla", f"No se pudo guardar la tabla:\n{error}",
+                                     parent=ventana if ventana.winfo_exists() else self.master)
+
+        threading.Thread(target=exportar, daemon=True).start()
+
+    def _exportar_automatico(self, output):
+        """
+        Con auto_export_path configurado, guarda cada tabla obtenida: una hoja nueva
+        por captura en .xlsx o filas añadidas al final en CSV/TSV.
+        """
+        ruta = self.config.get('auto_export_path')
+        if not ruta:
+            return
+        try:
+            escritas = export_table(ruta, parse_table(output).rows(), append=True, sheet_name=capture_sheet_title(),
+                                    csv_delimiter=self.config.get('export_csv_delimiter', DEFAULT_CSV_DELIMITER),
+                                    numbers=self.config.get('export_numbers', True),
+                                    decimal=self.config.get('export_decimal_separator') or None)
+            print(f"Tabla añadida a {ruta} ({escritas} filas)")
+        except (OSError, ValueError) as e:
+            print(f"Error en el guardado automático en {ruta}: {e}")
+
+    def _guardar_en_historial(self, imagen, modelo_id, modo, prompt, output, latency_ms, usage=None):
+        """Añade la captura al historial en segundo plano (comprimir la imagen no debe retrasar el resultado)"""
+        if self.history is None:
+            return
+        threading.Thread(target=self.history.add, args=(imagen, modelo_id, modo, prompt, output, latency_ms, usage),
+                         daemon=True).start()
 
-    def procesar_imagen_docs(self, imagen):
-        # Prompt para extracción de texto (sin formato Excel)
-        prompt_usuario = self.prompt_docs.strip()
-        prompt_formato = """
-Extrae todo el texto legible de la imagen y respétalo tal cual aparece, sin parafrasear ni corregir errores. Si hay partes ilegibles, indícalo con la palabra "ilegible". No incluyas ningún texto adicional fuera del contenido extraído. El resultado debe estar listo para copiar y pegar en un documento de texto.
-"""
-        prompt = prompt_usuario + "\n\n" + prompt_formato
-
-        modelo_id = MODEL_MAP[self.provider_var.get()]
-        base64_img = self._imagen_a_base64(imagen)
-
-        payload = {
-            "model": modelo_id,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": f"data:image/png;base64,{base64_img}"}
-                    ]
-                }
-            ]
-        }
-
-        self.result_win = Toplevel(self.master)
-        self.result_win.title("Resultado (Texto extraído, listo para copiar)")
-        self.result_win.geometry("600x400")
-        frame = Frame(self.result_win)
-        frame.pack(fill="both", expand=True)
-
-        self.result_text = Text(frame, wrap="word", font=("Consolas", 11))
-        self.result_text.insert("1.0", "Cargando, por favor espera...")
-        self.result_text.config(state="disabled")
-        self.result_text.pack(fill="both", expand=True, padx=10, pady=10)
-
-        self.copy_btn = Button(frame, text="Copiar texto", state="disabled", command=lambda: self.copiar_al_portapapeles(self.result_text.get("1.0", "end-1c")), cursor="hand2")
-        self.copy_btn.pack(pady=8)
-
-        self.result_win.transient(self.master)
-        self.result_win.grab_set()
-
-        threading.Thread(target=self._peticion_api_thread_docs, args=(payload,), daemon=True).start()
+    def _mostrar_tabla_tsv_en_widget(self, output):
+        # La tabla virtualizada solo dibuja las filas visibles
+        grid = self._crear_tabla_resultado()
+        grid.set_rows(parse_table(output).rows())
+        self._habilitar_copia_tabla(grid)
 
-    def _peticion_api_thread_docs(self, payload):
+    def _peticion_api_thread_docs(self, payload, cancel_event, guardar_resultado=None, metricas=None):
+        inicio, timings, info = time.perf_counter(), {}, None
         try:
-            response = requests.post(
-                url="https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}"
-                },
-                json=payload
-            )
-            response.raise_for_status()
+            response, info = self._enviar_peticion(payload, cancel_event, on_retry=self._avisar_reintento(cancel_event),
+                                                   timings=timings)
             result = response.json()
-            output = result['choices'][0]['message']['content']
-            # Elimina delimitadores tipo ```excel``` si aparecen
-            output = output.strip()
-            if output.startswith("```excel"):
-                output = output[len("```excel"):].strip()
-            if output.endswith("```"):
-                output = output[:-3].strip()
-            self.master.after(0, lambda: self._mostrar_texto_en_widget(output))
+            self._registrar_telemetria(payload["model"], "Docs", metricas, inicio, timings, info, result.get("usage"))
+            output = strip_code_fences(result['choices'][0]['message']['content'])
+            if guardar_resultado:
+                guardar_resultado(output, usage=usage_fields(result.get("usage")))
+            self.master.after(0, lambda: (self._mostrar_texto_en_widget(output),
+                                          self._mostrar_estado_stream(describe_retries(info), cancel_event)))
+        except RequestCancelled:
+            pass
         except Exception as exc:
-            self.master.after(0, lambda: self._mostrar_texto_en_widget(f"Error: {exc}"))
+            self._registrar_telemetria(payload["model"], "Docs", metricas, inicio, timings, info, error=exc)
+            error_msg = f"Error: {exc}"
+            self.master.after(0, lambda: self._mostrar_texto_en_widget(error_msg))
 
     def _mostrar_texto_en_widget(self, output):
         self.result_text.config(state="normal")
@@ -783,6 +1828,7 @@ Extrae todo el texto legible de la imagen y respétalo tal cual aparece, sin par
         self.copy_btn.bind("<Leave>", lambda e: self.copy_btn.config(cursor="arrow"))
 
     def mostrar_imagen_capturada(self, image):
+        from PIL import ImageTk
         window = Toplevel(self.master)
         window.title("Imagen Capturada")
         window.image = ImageTk.PhotoImage(image)
@@ -792,10 +1838,22 @@ Extrae todo el texto legible de la imagen y respétalo tal cual aparece, sin par
         window.grab_set()
         self.master.wait_window(window)
 
-    def _imagen_a_base64(self, img):
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        return base64.b64encode(buffer.getvalue()).decode("utf-8")
+    def _imagen_a_base64(self, img, modelo_id=None, modo=None, prompt=None):
+        """
+        Codifica la imagen con el formato y tamaño más adecuados para el modelo.
+        Con modo y prompt se aplica además el presupuesto de tokens por captura.
+        """
+        if prompt is not None:
+            estimacion, settings, reducido = self._estimar_captura(img.size, modelo_id, modo, prompt)
+            if reducido:
+                print(f"Presupuesto por captura: imagen reducida a {reducido[0]}x{reducido[1]} px "
+                      f"(≈ {estimacion['input_tokens']} tokens de entrada)")
+        else:
+            encoding_config = self.config.get('image_encoding', DEFAULT_CONFIG['image_encoding'])
+            settings = get_encoding_settings(encoding_config, modelo_id)
+        info = encode_image(img, settings)
+        print(describe_encoding(info))
+        return info
 
     def copiar_al_portapapeles(self, texto):
         self.master.clipboard_clear()
@@ -827,12 +1885,182 @@ Extrae todo el texto legible de la imagen y respétalo tal cual aparece, sin par
     def _validate_numeric(self, value):
         return value.isdigit() or value == ""
 
+    def abrir_estadisticas(self):
+        """Ventana con la telemetría de los últimos 30 días por modelo y modo"""
+        if self.telemetry is None:
+            messagebox.showinfo("Estadísticas", "La telemetría está desactivada (telemetry_enabled).")
+            return
+        resumen = self.telemetry.summary(days=30)
+        if not resumen:
+            messagebox.showinfo("Estadísticas", "Todavía no hay peticiones registradas.")
+            return
+        estadisticas = self._obtener_estadisticas_modelos()
+
+        window = Toplevel(self.master)
+        window.title("Estadísticas por modelo (últimos 30 días, ms)")
+        window.geometry("970x300")
+        columnas = ("Modelo", "Modo", "N", "Errores", "TTFB p50", "TTFB p95", "Total p50", "Total p95",
+                    "Tokens in", "Tokens out", "Coste", "Error est.", "Victorias")
+        tree = ttk.Treeview(window, columns=columnas, show="headings")
+        for col in columnas:
+            tree.heading(col, text=col)
+            tree.column(col, width=220 if col == "Modelo" else 70, anchor="w" if col == "Modelo" else "e")
+
+        def fmt(valor, decimales=0):
+            return "-" if valor is None else f"{valor:.{decimales}f}"
+
+        # Primero los modelos más rápidos, para elegir con datos y no por el orden del menú
+        for e in sorted(resumen, key=lambda e: (e["mode"], e["total_p50"] is None, e["total_p50"] or 0)):
+            victorias = estadisticas.win_rate(e["model"])
+            tree.insert("", "end", values=(
+                e["model"], e["mode"], e["requests"], e["errors"], fmt(e["ttfb_p50"]), fmt(e["ttfb_p95"]),
+                fmt(e["total_p50"]), fmt(e["total_p95"]), fmt(e["prompt_tokens_avg"]), fmt(e["completion_tokens_avg"]),
+                fmt(e["cost_total"], 4), "-" if e["estimate_error_pct"] is None else f"{e['estimate_error_pct']:+.0f}%",
+                "-" if victorias is None else f"{victorias:.0%}"))
+        tree.pack(fill="both", expand=True, padx=10, pady=10)
+        Button(window, text="Cerrar", command=window.destroy, cursor="hand2").pack(pady=(0, 10))
+        window.transient(self.master)
+
+    def abrir_historial(self):
+        """Ventana no modal para buscar capturas anteriores, reabrirlas o reprocesarlas con otro modelo"""
+        if self.history is None:
+            messagebox.showinfo("Historial", "El historial está desactivado (history_enabled).")
+            return
+        import io
+        from PIL import Image, ImageTk
+
+        window = Toplevel(self.master)
+        window.title("Historial de capturas")
+        window.geometry("960x460")
+        barra = Frame(window)
+        barra.pack(fill="x", padx=10, pady=(10, 0))
+        Label(barra, text="Buscar:").pack(side="left")
+        busqueda = StringVar()
+        Entry(barra, textvariable=busqueda, width=40).pack(side="left", padx=(4, 10))
+        lbl_total = Label(barra, text="", font=("Helvetica", 8), fg="#666")
+        lbl_total.pack(side="right")
+
+        cuerpo = Frame(window)
+        cuerpo.pack(fill="both", expand=True, padx=10, pady=10)
+        columnas = ("Fecha", "Modo", "Modelo", "Latencia", "Coste", "Tamaño", "Texto")
+        tree = ttk.Treeview(cuerpo, columns=columnas, show="headings", selectmode="browse")
+        anchos = {"Fecha": 120, "Modo": 50, "Modelo": 200, "Latencia": 60, "Coste": 60, "Tamaño": 70, "Texto": 300}
+        for col in columnas:
+            tree.heading(col, text=col)
+            tree.column(col, width=anchos[col], anchor="e" if col in ("Latencia", "Coste") else "w")
+        tree.pack(side="left", fill="both", expand=True)
+        miniatura = Label(cuerpo)
+        miniatura.pack(side="right", padx=(10, 0), anchor="n")
+
+        botones = Frame(window)
+        botones.pack(pady=(0, 10))
+        modelo_var = StringVar(value=self.provider_var.get())
+
+        def seleccionada():
+            seleccion = tree.selection()
+            return int(seleccion[0]) if seleccion else None
+
+        def actualizar():
+            window.after_id = None
+            tree.delete(*tree.get_children())
+            for e in self.history.search(busqueda.get()):
+                tree.insert("", "end", iid=str(e["id"]), values=(
+                    time.strftime("%Y-%m-%d %H:%M", time.localtime(e["ts"])), e["mode"], e["model"],
+                    "-" if e["latency_ms"] is None else f"{e['latency_ms'] / 1000:.1f} s",
+                    "-" if e["cost"] is None else f"{e['cost']:.4f}", f"{e['width']}x{e['height']}",
+                    " ".join(e["snippet"].split())))
+            tamano, total = self.history.size_bytes()
+            lbl_total.config(text=f"{total} capturas · {tamano / 1024 / 1024:.1f} MB")
+            miniatura.config(image="")
+
+        def programar_busqueda(*_):
+            # Se busca al dejar de escribir, no en cada tecla
+            if window.after_id:
+                window.after_cancel(window.after_id)
+            window.after_id = window.after(250, actualizar)
+
+        def mostrar_miniatura(event=None):
+            id_captura = seleccionada()
+            datos = self.history.thumbnail(id_captura) if id_captura is not None else None
+            if datos:
+                miniatura.image = ImageTk.PhotoImage(Image.open(io.BytesIO(datos)))
+                miniatura.config(image=miniatura.image)
+
+        def abrir(modelo_id=None):
+            id_captura = seleccionada()
+            if id_captura is None:
+                return
+            captura = self.history.get(id_captura)
+            imagen = self.history.image(id_captura)
+            if modelo_id is None:
+                # Se muestra el resultado guardado sin hacer ninguna petición
+                self._procesar_imagen(imagen, captura["mode"], captura["prompt"], modelo_id=captura["model"],
+                                      salida_guardada=captura["output"], origen="el historial")
+            else:
+                self._procesar_imagen(imagen, captura["mode"], captura["prompt"], modelo_id=modelo_id)
+
+        def borrar():
+            id_captura = seleccionada()
+            if id_captura is not None and messagebox.askyesno("Historial", "¿Borrar esta captura del historial?", parent=window):
+                self.history.delete(id_captura)
+                actualizar()
+
+        Button(botones, text="Abrir", command=abrir, cursor="hand2").pack(side="left", padx=4)
+        Button(botones, text="Reprocesar con:", cursor="hand2",
+               command=lambda: abrir(MODEL_MAP.get(modelo_var.get(), modelo_var.get()))).pack(side="left", padx=(12, 2))
+        ttk.Combobox(botones, textvariable=modelo_var, values=list(MODEL_MAP.keys()), state="readonly",
+                     width=30).pack(side="left", padx=(0, 12))
+        Button(botones, text="Borrar", command=borrar, cursor="hand2").pack(side="left", padx=4)
+        Button(botones, text="Cerrar", command=window.destroy, cursor="hand2").pack(side="left", padx=4)
+
+        window.after_id = None
+        busqueda.trace_add("write", programar_busqueda)
+        tree.bind("<<TreeviewSelect>>", mostrar_miniatura)
+        tree.bind("<Double-1>", lambda e: abrir())
+        actualizar()
+
+    def cerrar(self):
+        """Cancela las peticiones pendientes, cierra conexiones y destruye la ventana"""
+        self.cerrada = True
+        self.modo_residente = False
+        if self.snip_server is not None:
+            self.snip_server.shutdown()
+        # La cola cancela sus trabajos en el motor, así que se cierra antes que él
+        if getattr(self, 'cola', None) is not None:
+            self.cola.shutdown()
+        self.engine.shutdown()
+        if getattr(self, 'telemetry', None) is not None:
+            self.telemetry.close()
+        if getattr(self, 'history', None) is not None:
+            self.history.close()
+        openrouter_client.close_session()
+        flush_config()
+        self.master.destroy()
+
+def _informar_perfil_arranque():
+    """Muestra y guarda el perfil de arranque (--profile-startup)"""
+    profiler.mark("first_idle")
+    profiler.print_report()
+    from config_manager import get_config_dir
+    ruta = os.path.join(get_config_dir(), 'startup_profile.jsonl')
+    profiler.save_report(ruta)
+    print(f"Perfil guardado en {ruta}", file=sys.stderr)
+
 def main():
     try:
+        perfilar = "--profile-startup" in sys.argv
+        residente = "--daemon" in sys.argv
+        profiler.mark("imports")
+        profiler.snapshot_modules()
         root = tk.Tk()
+        profiler.mark("tk_init")
         # Cambia el icono de la ventana principal
         root.iconbitmap(r"e:\Codigo\python\experimentos\icono.ico")
         app = RecorteApp(root)
+        if residente and not app.cerrada:
+            app.iniciar_modo_residente()
+        if perfilar:
+            root.after_idle(_informar_perfil_arranque)
         root.mainloop()
     except Exception as e:
         import traceback
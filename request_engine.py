@@ -0,0 +1,173 @@
+import asyncio
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_QUEUE_SIZE = 32
+
+
+class EngineBusyError(RuntimeError):
+    """La cola de trabajos está llena"""
+
+
+class Job:
+    """Trabajo enviado al motor; se puede cancelar desde cualquier hilo"""
+
+    def __init__(self, job_id, func, args, cancel_event, on_done, on_error):
+        self.id = job_id
+        self.func = func
+        self.args = args
+        self.cancel_event = cancel_event
+        self.on_done = on_done
+        self.on_error = on_error
+        self.task = None
+        self._loop = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        """Marca el trabajo como cancelado; si aún no empezó, ya no se ejecutará"""
+        self.cancel_event.set()
+        if self._loop is not None and self.task is not None:
+            self._loop.call_soon_threadsafe(self.task.cancel)
+
+
+class RequestEngine:
+    """
+    Bucle asyncio en un hilo de fondo que centraliza la E/S con OpenRouter.
+
+    El hilo de Tk envía trabajos con submit(); un despachador los toma de una
+    cola acotada solo cuando hay hueco, así que con max_in_flight trabajos en
+    curso los demás esperan en la cola y, si se llena, submit() falla. Como
+    requests es bloqueante, cada trabajo corre en un pool de hilos del mismo
+    tamaño y el bucle se encarga de la concurrencia, la cancelación y el cierre.
+    Los callbacks se entregan con deliver (p. ej. lambda f: master.after(0, f)).
+    """
+
+    def __init__(self, max_in_flight=DEFAULT_MAX_IN_FLIGHT, queue_size=DEFAULT_QUEUE_SIZE, deliver=None):
+        self.max_in_flight = max(1, max_in_flight)
+        self.queue_size = queue_size
+        self.deliver = deliver or (lambda f: f())
+        self._ids = itertools.count(1)
+        self._jobs = {}
+        self._jobs_lock = threading.Lock()
+        self._running = 0
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="openrouter")
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="request-engine", daemon=True)
+        self._closed = False
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._dispatcher = self._loop.create_task(self._dispatch())
+        self._ready.set()
+        self._loop.run_forever()
+        # Tras detener el bucle, cancela lo pendiente y lo cierra ordenadamente
+        pendientes = asyncio.all_tasks(self._loop)
+        for task in pendientes:
+            task.cancel()
+        self._loop.run_until_complete(asyncio.gather(*pendientes, return_exceptions=True))
+        self._loop.close()
+
+    def submit(self, func, *args, cancel_event=None, on_done=None, on_error=None):
+        """
+        Encola func(*args) para ejecutarse fuera del hilo de la interfaz.
+        Lanza EngineBusyError si la cola está llena (contrapresión).
+        """
+        if self._closed:
+            raise RuntimeError("El motor de peticiones está cerrado")
+        job = Job(next(self._ids), func, args, cancel_event or threading.Event(), on_done, on_error)
+        job._loop = self._loop
+        aceptado = threading.Event()
+        error = []
+
+        def _enqueue():
+            try:
+                self._queue.put_nowait(job)
+            except asyncio.QueueFull:
+                error.append(EngineBusyError("Hay demasiadas solicitudes en cola, espera a que terminen."))
+            aceptado.set()
+
+        with self._jobs_lock:
+            self._jobs[job.id] = job
+        self._loop.call_soon_threadsafe(_enqueue)
+        aceptado.wait()
+        if error:
+            with self._jobs_lock:
+                self._jobs.pop(job.id, None)
+            raise error[0]
+        return job
+
+    @property
+    def in_flight(self):
+        """Trabajos en ejecución"""
+        with self._jobs_lock:
+            return self._running
+
+    @property
+    def queued(self):
+        """Trabajos aceptados que esperan hueco en la cola"""
+        with self._jobs_lock:
+            return len(self._jobs) - self._running
+
+    async def _dispatch(self):
+        while True:
+            # Primero el hueco y luego el trabajo: los que esperan siguen ocupando la cola acotada
+            await self._semaphore.acquire()
+            try:
+                job = await self._queue.get()
+            except asyncio.CancelledError:
+                self._semaphore.release()
+                raise
+            with self._jobs_lock:
+                self._running += 1
+            job.task = self._loop.create_task(self._run_job(job))
+            # En un callback y no en un finally: una tarea cancelada antes de empezar no ejecuta su cuerpo
+            job.task.add_done_callback(lambda _, job=job: self._finished(job))
+
+    def _finished(self, job):
+        self._semaphore.release()
+        with self._jobs_lock:
+            self._running -= 1
+            self._jobs.pop(job.id, None)
+
+    async def _run_job(self, job):
+        try:
+            if job.cancelled:
+                return
+            result = await self._loop.run_in_executor(self._executor, job.func, *job.args)
+            if not job.cancelled and job.on_done:
+                self.deliver(lambda: job.on_done(result))
+        except asyncio.CancelledError:
+            pass
+        except Exception as exc:
+            if not job.cancelled and job.on_error:
+                # exc deja de existir al salir del except: se pasa como argumento por defecto
+                self.deliver(lambda exc=exc: job.on_error(exc))
+            elif not job.on_error:
+                print(f"Error en trabajo {job.id}: {exc}")
+
+    def shutdown(self, timeout=2.0):
+        """Cancela todos los trabajos, detiene el bucle y libera el pool de hilos"""
+        if self._closed:
+            return
+        self._closed = True
+        with self._jobs_lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel_event.set()
+        if self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,208 @@
+import email.utils
+import random
+import threading
+import time
+
+# Estados HTTP que indican un fallo transitorio (se reintentan)
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BASE_DELAY = 1.0       # Segundos del primer reintento (se duplica en cada intento)
+DEFAULT_MAX_DELAY = 30.0
+DEFAULT_DEADLINE = 180.0       # Tiempo máximo por captura, incluidos reintentos y esperas
+DEFAULT_RATE_PER_MINUTE = 20   # Límite de los modelos gratuitos de OpenRouter
+DEFAULT_BURST = 4
+
+
+class RequestCancelled(RuntimeError):
+    """La petición se canceló mientras esperaba un reintento o un turno"""
+
+
+class DeadlineExceeded(RuntimeError):
+    """Se agotó el tiempo máximo de la captura"""
+
+
+class TokenBucket:
+    """Cubo de fichas por modelo: rate peticiones por minuto con ráfagas de hasta burst"""
+
+    def __init__(self, rate_per_minute=DEFAULT_RATE_PER_MINUTE, burst=DEFAULT_BURST):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, ahora):
+        self.tokens = min(self.capacity, self.tokens + (ahora - self.updated) * self.rate)
+        self.updated = ahora
+
+    def reserve(self):
+        """Toma una ficha y devuelve los segundos que hay que esperar para usarla"""
+        with self._lock:
+            ahora = time.monotonic()
+            self._refill(ahora)
+            self.tokens -= 1
+            espera = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(espera, self.blocked_until - ahora)
+
+    def block_for(self, seconds):
+        """Detiene el cubo (p. ej. por Retry-After o X-RateLimit-Reset)"""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+def retry_after_seconds(response):
+    """
+    Segundos que pide esperar el servidor: Retry-After (segundos o fecha HTTP)
+    o X-RateLimit-Reset (milisegundos epoch en OpenRouter) si no quedan peticiones.
+    """
+    headers = getattr(response, "headers", None) or {}
+    valor = headers.get("Retry-After")
+    if valor:
+        try:
+            return max(0.0, float(valor))
+        except ValueError:
+            fecha = email.utils.parsedate_to_datetime(valor)
+            if fecha is not None:
+                return max(0.0, fecha.timestamp() - time.time())
+    if headers.get("X-RateLimit-Remaining") == "0" and headers.get("X-RateLimit-Reset"):
+        try:
+            reset = float(headers["X-RateLimit-Reset"])
+        except ValueError:
+            return None
+        if reset > 1e11:  # milisegundos
+            reset /= 1000
+        return max(0.0, reset - time.time())
+    return None
+
+
+def backoff_delay(attempt, base=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+    """Espera exponencial con jitter completo para el intento attempt (0, 1, 2...)"""
+    return random.uniform(0, min(max_delay, base * 2 ** attempt))
+
+
+class RequestScheduler:
+    """
+    Envía peticiones a OpenRouter respetando un cubo de fichas por modelo y
+    reintentando los fallos transitorios (429, 5xx, errores de red) con
+    espera exponencial y jitter, o el tiempo que indique el servidor.
+    Nunca supera el plazo global de la captura.
+    """
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY,
+                 max_delay=DEFAULT_MAX_DELAY, rate_per_minute=DEFAULT_RATE_PER_MINUTE,
+                 burst=DEFAULT_BURST, deadline=DEFAULT_DEADLINE):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.deadline = deadline
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(max_retries=config.get('retry_max_attempts', DEFAULT_MAX_RETRIES),
+                   base_delay=config.get('retry_base_delay', DEFAULT_BASE_DELAY),
+                   max_delay=config.get('retry_max_delay', DEFAULT_MAX_DELAY),
+                   rate_per_minute=config.get('rate_limit_per_minute', DEFAULT_RATE_PER_MINUTE),
+                   burst=config.get('rate_limit_burst', DEFAULT_BURST),
+                   deadline=config.get('request_deadline_seconds', DEFAULT_DEADLINE))
+
+    def new_deadline(self):
+        """Instante (time.monotonic) límite para una captura que empieza ahora"""
+        return time.monotonic() + self.deadline
+
+    def _bucket(self, model_id):
+        with self._lock:
+            if model_id not in self._buckets:
+                self._buckets[model_id] = TokenBucket(self.rate_per_minute, self.burst)
+                self.stats[model_id] = {"requests": 0, "retries": 0, "wait_seconds": 0.0, "failures": 0}
+            return self._buckets[model_id]
+
+    def _record(self, model_id, **valores):
+        with self._lock:
+            for clave, valor in valores.items():
+                self.stats[model_id][clave] += valor
+
+    def _wait(self, seconds, deadline, cancel_event):
+        if time.monotonic() + seconds > deadline:
+            raise DeadlineExceeded(f"Se agotó el tiempo máximo de la captura ({self.deadline:.0f} s)")
+        if cancel_event is not None:
+            if cancel_event.wait(seconds):
+                raise RequestCancelled("Solicitud cancelada")
+        elif seconds > 0:
+            time.sleep(seconds)
+
+    def call(self, model_id, send, deadline=None, cancel_event=None, on_retry=None):
+        """
+        Ejecuta send(timeout) con reintentos y devuelve (respuesta, info), donde
+        info = {"retries", "wait_seconds"}. send recibe el timeout de lectura
+        que aún cabe en el plazo. on_retry(intento, espera, motivo) se llama
+        antes de cada espera por reintento.
+        """
+        import requests
+
+        bucket = self._bucket(model_id)
+        deadline = deadline if deadline is not None else self.new_deadline()
+        info = {"retries": 0, "wait_seconds": 0.0}
+        intento = 0
+        while True:
+            espera = bucket.reserve()
+            if espera > 0:
+                self._wait(espera, deadline, cancel_event)
+                info["wait_seconds"] += espera
+                self._record(model_id, wait_seconds=espera)
+            restante = deadline - time.monotonic()
+            if restante <= 0:
+                raise DeadlineExceeded(f"Se agotó el tiempo máximo de la captura ({self.deadline:.0f} s)")
+
+            self._record(model_id, requests=1)
+            servidor = None
+            try:
+                response = send(restante)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                motivo = f"error de red: {e.__class__.__name__}"
+                response = None
+            else:
+                servidor = retry_after_seconds(response)
+                if servidor is not None and response.status_code < 400:
+                    # Última petición disponible: el siguiente turno espera al reinicio
+                    bucket.block_for(servidor)
+                if response.status_code not in RETRY_STATUS:
+                    if response.status_code >= 400:
+                        response.close()
+                        self._record(model_id, failures=1)
+                        response.raise_for_status()
+                    return response, info
+                motivo = f"{response.status_code} {response.reason}"
+                response.close()
+
+            if intento >= self.max_retries:
+                self._record(model_id, failures=1)
+                raise RuntimeError(f"Sin respuesta tras {intento + 1} intentos ({motivo})")
+            espera = backoff_delay(intento, self.base_delay, self.max_delay)
+            if servidor is not None:
+                espera = max(espera, servidor)
+                bucket.block_for(servidor)
+            if time.monotonic() + espera > deadline:
+                self._record(model_id, failures=1)
+                raise DeadlineExceeded(f"Se agotó el tiempo máximo de la captura ({self.deadline:.0f} s, {motivo})")
+            intento += 1
+            info["retries"] += 1
+            info["wait_seconds"] += espera
+            self._record(model_id, retries=1, wait_seconds=espera)
+            print(f"[{model_id}] Reintento {intento}/{self.max_retries} en {espera:.1f} s ({motivo})")
+            if on_retry:
+                on_retry(intento, espera, motivo)
+            self._wait(espera, deadline, cancel_event)
+
+
+def describe_retries(info):
+    """Texto corto para la interfaz, vacío si no hubo reintentos ni esperas"""
+    if not info or (not info["retries"] and info["wait_seconds"] < 0.05):
+        return ""
+    return f"{info['retries']} reintentos, {info['wait_seconds']:.1f} s de espera"
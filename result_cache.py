@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import time
+
+from config_manager import get_config_dir
+
+DEFAULT_MAX_MB = 50
+DEFAULT_MAX_AGE_DAYS = 30
+
+
+def get_cache_dir():
+    """Obtiene el directorio de la caché de resultados dentro del de configuración"""
+    cache_dir = os.path.join(get_config_dir(), 'cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def image_digest(img):
+    """Hash de los píxeles normalizados (RGB) y las dimensiones de la imagen"""
+    normalizada = img.convert("RGB")
+    h = hashlib.sha256()
+    h.update(f"{normalizada.width}x{normalizada.height}".encode())
+    h.update(normalizada.tobytes())
+    return h.hexdigest()
+
+
+def make_key(img, model_id, mode, prompt):
+    """Clave de caché: hash de la imagen + modelo + modo + prompt final"""
+    h = hashlib.sha256()
+    for parte in (image_digest(img), model_id, mode, prompt):
+        h.update(parte.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ResultCache:
+    """Caché persistente en disco de respuestas del modelo, un archivo JSON por entrada"""
+
+    def __init__(self, directory=None, max_mb=DEFAULT_MAX_MB, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.directory = directory or get_cache_dir()
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_age_days * 24 * 3600
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(max_mb=config.get('cache_max_mb', DEFAULT_MAX_MB),
+                   max_age_days=config.get('cache_max_age_days', DEFAULT_MAX_AGE_DAYS))
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Devuelve la salida guardada para la clave, o None si no existe o caducó"""
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)  # Marca la entrada como usada recientemente
+            return entry['output']
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error al leer la caché: {e}")
+            return None
+
+    def put(self, key, output, **metadata):
+        """Guarda la salida para la clave y aplica los límites de tamaño y antigüedad"""
+        path = self._path(key)
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(dict(metadata, output=output, created=time.time()), f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self.prune()
+        except Exception as e:
+            print(f"Error al guardar en la caché: {e}")
+
+    def prune(self):
+        """Elimina entradas caducadas y, si se supera el tamaño máximo, las menos usadas"""
+        ahora = time.time()
+        entradas = []
+        for nombre in os.listdir(self.directory):
+            if not nombre.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, nombre)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if ahora - stat.st_mtime > self.max_age:
+                os.remove(path)
+            else:
+                entradas.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entradas)
+        for _, size, path in sorted(entradas):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
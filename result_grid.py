@@ -0,0 +1,181 @@
+import tkinter as tk
+from tkinter import ttk
+import tkinter.font as tkfont
+
+from table_parser import iter_tsv_rows
+
+ROW_HEIGHT = 20          # Altura por defecto de una fila del Treeview (px)
+HEADER_HEIGHT = 24       # Altura aproximada de la cabecera (px)
+MIN_COL_WIDTH = 60
+MAX_COL_WIDTH = 400
+SAMPLE_ROWS = 200        # Filas muestreadas para calcular el ancho de las columnas
+APPEND_DELAY_MS = 30     # Agrupa las filas añadidas en streaming antes de redibujar
+
+
+def iter_tsv_lines(table, num_cols=None):
+    """Genera las líneas TSV de la tabla rellenando las filas cortas"""
+    if num_cols is None:
+        num_cols = max((len(fila) for fila in table), default=0)
+    return iter_tsv_rows((fila if len(fila) == num_cols else list(fila) + [""] * (num_cols - len(fila))
+                          for fila in table), num_cols)
+
+
+def table_to_tsv(table):
+    return "\n".join(iter_tsv_lines(table))
+
+
+class VirtualGrid(tk.Frame):
+    """
+    Tabla virtualizada sobre un ttk.Treeview: solo existen tantos items como
+    filas visibles y al desplazarse se reutilizan cambiando sus valores, así
+    que mostrar miles de filas cuesta lo mismo que mostrar unas decenas.
+    """
+
+    def __init__(self, master, table=None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.table = []
+        self.num_cols = 0
+        self.offset = 0
+        self._items = []
+        self._pendientes = []
+        self._flush_id = None
+        self._font = tkfont.nametofont("TkDefaultFont")
+        self._row_height = int(ttk.Style().lookup("Treeview", "rowheight") or ROW_HEIGHT)
+
+        self.tree = ttk.Treeview(self, show="headings", selectmode="browse")
+        self.vscroll = ttk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        self.hscroll = ttk.Scrollbar(self, orient="horizontal", command=self.tree.xview)
+        self.tree.configure(xscrollcommand=self.hscroll.set)
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.vscroll.grid(row=0, column=1, sticky="ns")
+        self.hscroll.grid(row=1, column=0, sticky="ew")
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        self.tree.bind("<Configure>", lambda e: self._resize_pool())
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll_rows(-1 if e.delta > 0 else 1, 3))
+        self.tree.bind("<Button-4>", lambda e: self.scroll_rows(-1, 3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_rows(1, 3))
+        self.tree.bind("<Prior>", lambda e: self.scroll_rows(-1, len(self._items)))
+        self.tree.bind("<Next>", lambda e: self.scroll_rows(1, len(self._items)))
+
+        if table:
+            self.set_rows(table)
+
+    # --- Datos ---------------------------------------------------------------
+
+    def set_rows(self, table):
+        """Reemplaza todo el contenido de la tabla"""
+        self.table = list(table)
+        self.offset = 0
+        self._set_columns(max((len(fila) for fila in self.table), default=0))
+        self._autosize_columns()
+        self._render()
+
+    def append_rows(self, filas):
+        """Añade filas (p. ej. en streaming); se agrupan y se redibuja con after"""
+        self._pendientes.extend(filas)
+        if self._flush_id is None:
+            self._flush_id = self.after(APPEND_DELAY_MS, self._flush)
+
+    def _flush(self):
+        self._flush_id = None
+        if not self._pendientes:
+            return
+        filas, self._pendientes = self._pendientes, []
+        muestrear = len(self.table) < SAMPLE_ROWS
+        self.table.extend(filas)
+        max_cols = max(len(fila) for fila in filas)
+        if max_cols > self.num_cols:
+            self._set_columns(max_cols)
+            muestrear = True
+        if muestrear:
+            self._autosize_columns()
+        self._render()
+
+    def iter_rows(self):
+        """Filas actuales, incluidas las pendientes de dibujar (p. ej. para exportar)"""
+        self._flush()
+        return iter(self.table)
+
+    def iter_tsv(self):
+        self._flush()
+        return iter_tsv_lines(self.table, self.num_cols)
+
+    def to_tsv(self):
+        """Genera el TSV completo en el momento (p. ej. al copiar)"""
+        return "\n".join(self.iter_tsv())
+
+    # --- Columnas ------------------------------------------------------------
+
+    def _set_columns(self, num_cols):
+        self.num_cols = num_cols
+        cols = [f"Col{i+1}" for i in range(num_cols)]
+        self.tree.configure(columns=cols)
+        for i, col in enumerate(cols):
+            self.tree.heading(col, text=f"Columna {i+1}")
+            self.tree.column(col, width=120, anchor="center", stretch=False)
+
+    def _sample(self):
+        """Filas de muestra: las primeras y otras repartidas por toda la tabla"""
+        total = len(self.table)
+        if total <= SAMPLE_ROWS:
+            return self.table
+        mitad = SAMPLE_ROWS // 2
+        paso = max(1, (total - mitad) // mitad)
+        return self.table[:mitad] + self.table[mitad::paso]
+
+    def _autosize_columns(self):
+        anchos = [self._font.measure(f"Columna {i+1}") for i in range(self.num_cols)]
+        for fila in self._sample():
+            for i, celda in enumerate(fila[:self.num_cols]):
+                if celda:
+                    anchos[i] = max(anchos[i], self._font.measure(celda))
+        for i, ancho in enumerate(anchos):
+            self.tree.column(f"Col{i+1}", width=min(MAX_COL_WIDTH, max(MIN_COL_WIDTH, ancho + 16)))
+
+    # --- Ventana visible -----------------------------------------------------
+
+    def _visible_rows(self):
+        altura = self.tree.winfo_height()
+        if altura <= 1:
+            return 20
+        return max(1, (altura - HEADER_HEIGHT) // self._row_height)
+
+    def _resize_pool(self):
+        """Ajusta el número de items del Treeview a las filas que caben en pantalla"""
+        necesarios = self._visible_rows()
+        while len(self._items) < necesarios:
+            self._items.append(self.tree.insert("", "end", values=()))
+        while len(self._items) > necesarios:
+            self.tree.delete(self._items.pop())
+        self._render()
+
+    def _render(self):
+        if not self._items:
+            self._resize_pool()
+            return
+        total = len(self.table)
+        visibles = len(self._items)
+        self.offset = max(0, min(self.offset, total - visibles))
+        for i, iid in enumerate(self._items):
+            idx = self.offset + i
+            self.tree.item(iid, values=self.table[idx] if idx < total else ())
+        if total:
+            self.vscroll.set(self.offset / total, min(1.0, (self.offset + visibles) / total))
+        else:
+            self.vscroll.set(0, 1)
+
+    def scroll_rows(self, direccion, cantidad=1):
+        self.offset += direccion * cantidad
+        self.tree.selection_set(())
+        self._render()
+        return "break"
+
+    def _on_scrollbar(self, accion, valor, unidad=None):
+        if accion == "moveto":
+            self.offset = int(float(valor) * len(self.table))
+            self._render()
+        elif accion == "scroll":
+            paso = len(self._items) if unidad == "pages" else 1
+            self.scroll_rows(int(valor), paso)
@@ -0,0 +1,116 @@
+import ctypes
+import sys
+from collections import namedtuple
+
+Monitor = namedtuple("Monitor", "x y width height")
+
+MONITOR_DEFAULTTONEAREST = 2
+
+
+class _RECT(ctypes.Structure):
+    _fields_ = [("left", ctypes.c_long), ("top", ctypes.c_long),
+                ("right", ctypes.c_long), ("bottom", ctypes.c_long)]
+
+
+class _MONITORINFO(ctypes.Structure):
+    _fields_ = [("cbSize", ctypes.c_ulong), ("rcMonitor", _RECT),
+                ("rcWork", _RECT), ("dwFlags", ctypes.c_ulong)]
+
+
+class _POINT(ctypes.Structure):
+    _fields_ = [("x", ctypes.c_long), ("y", ctypes.c_long)]
+
+
+class _PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+    _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong),
+                ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+
+def _monitor_at_win32(x, y):
+    user32 = ctypes.windll.user32
+    user32.MonitorFromPoint.restype = ctypes.c_void_p
+    user32.MonitorFromPoint.argtypes = [_POINT, ctypes.c_ulong]
+    user32.GetMonitorInfoW.argtypes = [ctypes.c_void_p, ctypes.POINTER(_MONITORINFO)]
+    handle = user32.MonitorFromPoint(_POINT(x, y), MONITOR_DEFAULTTONEAREST)
+    info = _MONITORINFO()
+    info.cbSize = ctypes.sizeof(_MONITORINFO)
+    if not handle or not user32.GetMonitorInfoW(handle, ctypes.byref(info)):
+        return None
+    r = info.rcMonitor
+    return Monitor(r.left, r.top, r.right - r.left, r.bottom - r.top)
+
+
+def monitor_at(x, y, default=None):
+    """
+    Monitor que contiene el punto (x, y) en coordenadas del escritorio virtual.
+    Fuera de Windows no hay forma portable de saberlo y se devuelve default.
+    """
+    if sys.platform == "win32":
+        try:
+            return _monitor_at_win32(x, y) or default
+        except (AttributeError, OSError) as e:
+            print(f"No se pudo obtener el monitor bajo el cursor: {e}")
+    return default
+
+
+def capture_monitor(monitor):
+    """Captura solo el rectángulo del monitor (no todo el escritorio virtual)"""
+    bbox = (monitor.x, monitor.y, monitor.x + monitor.width, monitor.y + monitor.height)
+    try:
+        from PIL import ImageGrab
+        return ImageGrab.grab(bbox=bbox, all_screens=True)
+    except (ImportError, OSError) as e:
+        # Sin ImageGrab (p. ej. Wayland) se recurre a pyscreeze con la misma región
+        print(f"ImageGrab no disponible ({e}), usando pyscreeze")
+        import pyscreeze
+        return pyscreeze.screenshot(region=(monitor.x, monitor.y, monitor.width, monitor.height))
+
+
+def process_memory():
+    """Devuelve (rss, pico_rss) del proceso en bytes; None si no se puede medir"""
+    if sys.platform == "win32":
+        try:
+            contadores = _PROCESS_MEMORY_COUNTERS()
+            contadores.cb = ctypes.sizeof(_PROCESS_MEMORY_COUNTERS)
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(contadores), contadores.cb):
+                return contadores.WorkingSetSize, contadores.PeakWorkingSetSize
+        except (AttributeError, OSError):
+            pass
+        return None
+    try:
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        pico = pico if sys.platform == "darwin" else pico * 1024
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * resource.getpagesize()
+        return rss, pico
+    except (ImportError, OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryTracker:
+    """Muestrea el RSS en los puntos clave de un recorte y guarda el máximo observado"""
+
+    def __init__(self):
+        self.samples = []
+
+    def sample(self, label):
+        memoria = process_memory()
+        if memoria is not None:
+            self.samples.append((label, memoria[0]))
+        return memoria
+
+    def report(self):
+        """Texto con el RSS inicial, el pico del recorte y el pico del proceso"""
+        memoria = process_memory()
+        if not self.samples or memoria is None:
+            return None
+        mb = 1024 * 1024
+        inicial = self.samples[0][1]
+        etiqueta, pico = max(self.samples, key=lambda s: s[1])
+        return (f"Memoria del recorte: inicio {inicial / mb:.1f} MB, pico {pico / mb:.1f} MB "
+                f"({etiqueta}), ahora {memoria[0] / mb:.1f} MB, pico del proceso {memoria[1] / mb:.1f} MB")
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Modo residente: disparo de recortes por un socket local.
+
+La aplicación arrancada con --daemon queda minimizada con la ventana de
+recorte y las conexiones ya preparadas, y escucha en 127.0.0.1 comandos de
+una línea (snip, cancel, ping). Cualquier atajo global del sistema puede
+lanzar un recorte ejecutando este script:
+
+    python snip_daemon.py snip
+
+El subcomando bench mide la latencia en caliente desde el disparo hasta que
+el recorte es interactivo:
+
+    python snip_daemon.py bench -n 30 --salida bench_daemon.json
+"""
+
+import argparse
+import json
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 47821
+REPLY_TIMEOUT = 15  # Segundos que se espera la respuesta de la interfaz
+
+
+class SnipServer:
+    """
+    Servidor TCP local en un hilo de fondo. Cada línea recibida es un comando;
+    su manejador se ejecuta en el hilo de Tk (a través de deliver) y recibe
+    una función para responder y el instante (perf_counter) en que llegó.
+    """
+
+    def __init__(self, handlers, deliver, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.handlers = handlers
+        self.deliver = deliver
+        servidor = self
+
+        class _Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for linea in self.rfile:
+                    respuesta = servidor._dispatch(linea.decode("utf-8", "replace").strip(), time.perf_counter())
+                    self.wfile.write((respuesta + "\n").encode("utf-8"))
+                    self.wfile.flush()
+
+        self._server = socketserver.ThreadingTCPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="snip-server", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _dispatch(self, comando, recibido):
+        handler = self.handlers.get(comando)
+        if handler is None:
+            return f"error comando desconocido: {comando}"
+        listo = threading.Event()
+        respuesta = []
+
+        def responder(texto):
+            respuesta.append(texto)
+            listo.set()
+
+        self.deliver(lambda: handler(responder, recibido))
+        if not listo.wait(REPLY_TIMEOUT):
+            return "error tiempo de espera agotado"
+        return respuesta[0]
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def send_command(comando, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=REPLY_TIMEOUT):
+    """Envía un comando al proceso residente y devuelve su respuesta"""
+    with socket.create_connection((host, port), timeout=timeout) as conexion:
+        conexion.sendall((comando + "\n").encode("utf-8"))
+        return conexion.makefile("r", encoding="utf-8").readline().strip()
+
+
+def run_benchmark(n, warmup, host=DEFAULT_HOST, port=DEFAULT_PORT, pause=0.2):
+    """
+    Dispara n recortes (más warmup descartados) y los cancela; devuelve las
+    latencias medidas por la interfaz (disparo → recorte interactivo) y las
+    de ida y vuelta medidas por el cliente, en ms.
+    """
+    from batch_cli import percentile
+
+    interfaz, cliente = [], []
+    for i in range(warmup + n):
+        inicio = time.perf_counter()
+        respuesta = send_command("snip", host, port)
+        ida_vuelta = (time.perf_counter() - inicio) * 1000
+        if not respuesta.startswith("ready"):
+            raise RuntimeError(f"Respuesta inesperada: {respuesta}")
+        send_command("cancel", host, port)
+        if i >= warmup:
+            interfaz.append(float(respuesta.split()[1]))
+            cliente.append(ida_vuelta)
+        time.sleep(pause)
+
+    def resumen(valores):
+        return {"p50": round(percentile(valores, 50), 1), "p95": round(percentile(valores, 95), 1),
+                "max": round(max(valores), 1)}
+
+    return {
+        "timestamp": time.time(),
+        "runs": n,
+        "warmup": warmup,
+        "ready_ms": resumen(interfaz),
+        "round_trip_ms": resumen(cliente),
+        "samples_ready_ms": interfaz,
+    }
+
+
+def main(argv=None):
+    from config_manager import load_config
+    config = load_config()
+    parser = argparse.ArgumentParser(description="Controla la aplicación en modo residente (--daemon).")
+    parser.add_argument("comando", choices=["snip", "cancel", "ping", "bench"])
+    parser.add_argument("--puerto", type=int, default=config.get('daemon_port', DEFAULT_PORT))
+    parser.add_argument("-n", type=int, default=30, help="Recortes medidos (bench)")
+    parser.add_argument("--calentamiento", type=int, default=3, help="Recortes iniciales descartados (bench)")
+    parser.add_argument("--salida", help="Archivo JSON donde guardar el resultado (bench)")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.comando != "bench":
+            print(send_command(args.comando, port=args.puerto))
+            return 0
+        resultado = run_benchmark(args.n, args.calentamiento, port=args.puerto)
+    except OSError as e:
+        print(f"No se pudo conectar con la aplicación residente en el puerto {args.puerto}: {e}", file=sys.stderr)
+        return 2
+
+    print(f"Disparo → recorte interactivo p50/p95/máx: {resultado['ready_ms']['p50']} / "
+          f"{resultado['ready_ms']['p95']} / {resultado['ready_ms']['max']} ms")
+    print(f"Ida y vuelta del cliente p50/p95/máx: {resultado['round_trip_ms']['p50']} / "
+          f"{resultado['round_trip_ms']['p95']} / {resultado['round_trip_ms']['max']} ms")
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import json
+import os
+import sys
+import time
+
+# Módulos pesados que deben cargarse de forma diferida (no durante el arranque)
+LAZY_MODULES = ("requests", "pyscreeze", "cryptography", "PIL.ImageTk", "PIL.ImageGrab")
+
+
+class StartupProfiler:
+    """Registra marcas de tiempo por fase del arranque y genera un informe"""
+
+    def __init__(self, start=None):
+        self.start = start if start is not None else time.perf_counter()
+        self.marks = []
+        self.eager_modules = []
+
+    def mark(self, phase):
+        """Marca el final de una fase (el tiempo de la fase es desde la marca anterior)"""
+        self.marks.append((phase, time.perf_counter()))
+
+    def snapshot_modules(self):
+        """Anota qué módulos pesados ya están importados (llamar tras los imports del módulo principal)"""
+        self.eager_modules = [m for m in LAZY_MODULES if m in sys.modules]
+
+    def phases(self):
+        fases = []
+        anterior = self.start
+        for nombre, instante in self.marks:
+            fases.append({"phase": nombre, "ms": round((instante - anterior) * 1000, 1),
+                          "total_ms": round((instante - self.start) * 1000, 1)})
+            anterior = instante
+        return fases
+
+    def report(self):
+        """Informe con las fases y los módulos pesados que se cargaron con los imports"""
+        return {
+            "timestamp": time.time(),
+            "phases": self.phases(),
+            "eager_modules": self.eager_modules,
+        }
+
+    def print_report(self, stream=None):
+        stream = stream or sys.stderr
+        informe = self.report()
+        print("--- Perfil de arranque ---", file=stream)
+        for fase in informe["phases"]:
+            print(f"{fase['phase']:<28}{fase['ms']:>9.1f} ms{fase['total_ms']:>10.1f} ms", file=stream)
+        if informe["eager_modules"]:
+            print(f"Módulos pesados importados al inicio: {', '.join(informe['eager_modules'])}", file=stream)
+        else:
+            print("Ningún módulo pesado importado al inicio", file=stream)
+
+    def save_report(self, path):
+        """Añade el informe como una línea JSON (permite comparar entre versiones)"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.report(), ensure_ascii=False) + "\n")
@@ -0,0 +1,312 @@
+import csv
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from xml.sax.saxutils import escape, unescape
+
+EXPORT_FORMATS = {".xlsx": "xlsx", ".csv": "csv", ".tsv": "tsv", ".txt": "tsv"}
+DEFAULT_CSV_DELIMITER = ";"  # Excel en español abre así los CSV sin asistente
+MAX_ROWS = 1048576           # Límite de filas de una hoja de Excel
+MAX_CELL_CHARS = 32767
+FLUSH_ROWS = 500             # Filas que se acumulan antes de escribirlas en el zip
+
+_NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_CT_SHEET = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    f'xmlns:r="{_NS_REL}"><sheets></sheets></workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/></Relationships>'
+)
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+    '</styleSheet>'
+)
+_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_TAIL = '</sheetData></worksheet>'
+
+# Caracteres de control que no admite XML
+_ILLEGAL_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_NUM_SIMPLE = re.compile(r"-?(0|[1-9]\d*)([.,]\d+)?")
+_NUM_MILES_ES = re.compile(r"-?[1-9]\d{0,2}(\.\d{3})+(,\d+)?")
+_NUM_MILES_EN = re.compile(r"-?[1-9]\d{0,2}(,\d{3})+(\.\d+)?")
+# Un solo separador seguido de tres cifras: 3.141 o 1,234 pueden ser miles o decimales
+_NUM_AMBIGUO = re.compile(r"-?[1-9]\d{0,2}[.,]\d{3}")
+_INVALID_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+
+_path_locks = {}
+_path_locks_lock = threading.Lock()
+
+
+def _lock_for(path):
+    """Un cerrojo por archivo: las exportaciones automáticas y el lote pueden coincidir"""
+    with _path_locks_lock:
+        return _path_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def export_format(path):
+    fmt = EXPORT_FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError(f"Formato no soportado: {os.path.basename(path)} (usa .xlsx, .csv o .tsv)")
+    return fmt
+
+
+def as_number(celda, decimal=None):
+    """
+    Texto del número para Excel si la celda es numérica (1234,5 · 1.234,5 ·
+    1,234.5); None si es texto. Los ceros a la izquierda se conservan como texto.
+    Los valores como 3.141 o 1,234 solo se convierten si se indica el
+    separador decimal ("," o "."); si no, se dejan como texto.
+    """
+    celda = celda.strip()
+    if not celda or len(celda) > 20 or celda[-1] not in "0123456789":
+        return None
+    if _NUM_AMBIGUO.fullmatch(celda):
+        if decimal not in (",", "."):
+            return None
+        return celda.replace("." if decimal == "," else ",", "").replace(",", ".")
+    if _NUM_MILES_ES.fullmatch(celda):
+        return celda.replace(".", "").replace(",", ".")
+    if _NUM_SIMPLE.fullmatch(celda):
+        return celda.replace(",", ".")
+    if _NUM_MILES_EN.fullmatch(celda):
+        return celda.replace(",", "")
+    return None
+
+
+def _column_letter(indice):
+    letras = ""
+    indice += 1
+    while indice:
+        indice, resto = divmod(indice - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+
+def sheet_title(nombre, existentes=()):
+    """Nombre válido para Excel (máx. 31 caracteres, sin []:*?/\\) y distinto de los existentes"""
+    base = _INVALID_SHEET_CHARS.sub("_", nombre).strip("'") or "Hoja"
+    base = base[:31]
+    usados = {n.lower() for n in existentes}
+    titulo, n = base, 2
+    while titulo.lower() in usados:
+        sufijo = f" ({n})"
+        titulo = base[:31 - len(sufijo)] + sufijo
+        n += 1
+    return titulo
+
+
+def capture_sheet_title():
+    return time.strftime("Captura %Y-%m-%d %H.%M.%S")
+
+
+class XlsxWriter:
+    """
+    Escribe un .xlsx hoja a hoja y fila a fila directamente en el zip, con
+    memoria constante. Con base=ruta de un libro existente, copia sus partes y
+    añade las hojas nuevas al final. Se guarda en un temporal y se renombra al cerrar.
+    """
+
+    def __init__(self, path, base=None, numbers=True, decimal=None):
+        self.path = path
+        self.numbers = numbers
+        self.decimal = decimal
+        carpeta = os.path.dirname(os.path.abspath(path))
+        fd, self._tmp = tempfile.mkstemp(suffix=".xlsx", dir=carpeta)
+        os.close(fd)
+        self._zip = zipfile.ZipFile(self._tmp, "w", zipfile.ZIP_DEFLATED)
+        self._sheets = []  # (nombre, parte)
+        self._columnas = []
+        try:
+            if base:
+                self._copiar_base(base)
+            else:
+                self._workbook, self._rels, self._types = _WORKBOOK, _WORKBOOK_RELS, _CONTENT_TYPES
+                self._zip.writestr("_rels/.rels", _ROOT_RELS)
+                self._zip.writestr("xl/styles.xml", _STYLES)
+                self._existentes, self._partes = [], set()
+        except Exception:
+            self._descartar()
+            raise
+
+    def _copiar_base(self, base):
+        modificadas = {"xl/workbook.xml", "xl/_rels/workbook.xml.rels", "[Content_Types].xml"}
+        with zipfile.ZipFile(base) as origen:
+            nombres = set(origen.namelist())
+            if not modificadas <= nombres:
+                raise ValueError(f"{os.path.basename(base)} no es un libro de Excel compatible")
+            self._workbook = origen.read("xl/workbook.xml").decode("utf-8")
+            self._rels = origen.read("xl/_rels/workbook.xml.rels").decode("utf-8")
+            self._types = origen.read("[Content_Types].xml").decode("utf-8")
+            for info in origen.infolist():
+                if info.filename not in modificadas:
+                    with origen.open(info) as entrada, self._zip.open(info.filename, "w", force_zip64=True) as salida:
+                        while True:
+                            bloque = entrada.read(1 << 20)
+                            if not bloque:
+                                break
+                            salida.write(bloque)
+        self._existentes = [unescape(n, {"&quot;": '"', "&apos;": "'"})
+                            for n in re.findall(r'<sheet\b[^>]*\bname="([^"]*)"', self._workbook)]
+        self._partes = nombres
+
+    def add_sheet(self, nombre, filas):
+        """Añade una hoja con las filas (cualquier iterable); devuelve el número de filas escritas"""
+        titulo = sheet_title(nombre, self._existentes + [s[0] for s in self._sheets])
+        n = len(self._sheets) + 1
+        while f"xl/worksheets/sheet{n}.xml" in self._partes:
+            n += 1
+        parte = f"xl/worksheets/sheet{n}.xml"
+        self._partes.add(parte)
+        escritas = 0
+        with self._zip.open(parte, "w", force_zip64=True) as salida:
+            salida.write(_SHEET_HEAD.encode("utf-8"))
+            bloque = []
+            for fila in filas:
+                if escritas >= MAX_ROWS:
+                    raise ValueError(f"La tabla supera el máximo de {MAX_ROWS} filas de Excel")
+                escritas += 1
+                bloque.append(self._fila(escritas, fila))
+                if len(bloque) >= FLUSH_ROWS:
+                    salida.write("".join(bloque).encode("utf-8"))
+                    bloque = []
+            bloque.append(_SHEET_TAIL)
+            salida.write("".join(bloque).encode("utf-8"))
+        self._sheets.append((titulo, parte))
+        return escritas
+
+    def _fila(self, numero, fila):
+        while len(self._columnas) < len(fila):
+            self._columnas.append(_column_letter(len(self._columnas)))
+        celdas = []
+        for columna, celda in zip(self._columnas, fila):
+            if not celda:
+                continue
+            ref = f"{columna}{numero}"
+            numero_celda = as_number(celda, self.decimal) if self.numbers else None
+            if numero_celda is not None:
+                celdas.append(f'<c r="{ref}"><v>{numero_celda}</v></c>')
+            else:
+                texto = escape(_ILLEGAL_XML.sub("", celda[:MAX_CELL_CHARS]))
+                celdas.append(f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>')
+        return f'<row r="{numero}">{"".join(celdas)}</row>'
+
+    def close(self):
+        """Escribe el índice del libro y sustituye el archivo de destino"""
+        try:
+            ids = [int(i) for i in re.findall(r'\bsheetId="(\d+)"', self._workbook)]
+            rids = [int(i) for i in re.findall(r'\bId="rId(\d+)"', self._rels)]
+            prefijo = re.search(r'xmlns:(\w+)="' + re.escape(_NS_REL) + '"', self._workbook)
+            hojas, relaciones, tipos = [], [], []
+            for titulo, parte in self._sheets:
+                ids.append(max(ids, default=0) + 1)
+                rids.append(max(rids, default=0) + 1)
+                nombre = escape(titulo, {'"': "&quot;"})
+                if prefijo:
+                    hojas.append(f'<sheet name="{nombre}" sheetId="{ids[-1]}" {prefijo.group(1)}:id="rId{rids[-1]}"/>')
+                else:
+                    hojas.append(f'<sheet xmlns:r="{_NS_REL}" name="{nombre}" sheetId="{ids[-1]}" r:id="rId{rids[-1]}"/>')
+                relaciones.append(f'<Relationship Id="rId{rids[-1]}" Type="{_NS_REL}/worksheet" '
+                                  f'Target="{parte[len("xl/"):]}"/>')
+                tipos.append(f'<Override PartName="/{parte}" ContentType="{_CT_SHEET}"/>')
+            self._zip.writestr("xl/workbook.xml", _insertar(self._workbook, "</sheets>", hojas, "<sheets/>"))
+            self._zip.writestr("xl/_rels/workbook.xml.rels", _insertar(self._rels, "</Relationships>", relaciones))
+            self._zip.writestr("[Content_Types].xml", _insertar(self._types, "</Types>", tipos))
+            self._zip.close()
+            os.replace(self._tmp, self.path)
+        except Exception:
+            self._descartar()
+            raise
+
+    def _descartar(self):
+        self._zip.close()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        if tipo is None:
+            self.close()
+        else:
+            self._descartar()
+
+
+def _insertar(xml, cierre, elementos, vacio=None):
+    """Inserta los elementos antes de la etiqueta de cierre (o sustituye la forma vacía <x/>)"""
+    if vacio and vacio in xml and cierre not in xml:
+        return xml.replace(vacio, vacio[:-2] + ">" + "".join(elementos) + cierre, 1)
+    posicion = xml.rfind(cierre)
+    if posicion == -1:
+        raise ValueError(f"No se encontró {cierre} en el libro")
+    return xml[:posicion] + "".join(elementos) + xml[posicion:]
+
+
+def write_delimited(path, filas, delimiter, append=False):
+    """CSV/TSV fila a fila; al añadir a un archivo existente no se repite el BOM"""
+    nuevo = not (append and os.path.exists(path))
+    escritas = 0
+    with open(path, "w" if nuevo else "a", encoding="utf-8-sig" if nuevo else "utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter=delimiter, lineterminator="\r\n")
+        for fila in filas:
+            writer.writerow(fila)
+            escritas += 1
+    return escritas
+
+
+def write_workbook(path, hojas, append=False, numbers=True, decimal=None):
+    """Escribe varias hojas [(nombre, filas)] en un .xlsx; con append se añaden al libro existente"""
+    with _lock_for(path):
+        base = path if append and os.path.exists(path) else None
+        with XlsxWriter(path, base=base, numbers=numbers, decimal=decimal) as libro:
+            return sum(libro.add_sheet(nombre, filas) for nombre, filas in hojas)
+
+
+def export_table(path, filas, append=False, sheet_name=None, csv_delimiter=DEFAULT_CSV_DELIMITER, numbers=True,
+                 decimal=None):
+    """
+    Exporta una tabla según la extensión (.xlsx, .csv, .tsv). En .xlsx, append
+    añade una hoja nueva al libro; en CSV/TSV añade las filas al final.
+    Devuelve el número de filas escritas.
+    """
+    fmt = export_format(path)
+    if fmt == "xlsx":
+        return write_workbook(path, [(sheet_name or capture_sheet_title(), filas)], append, numbers, decimal)
+    with _lock_for(path):
+        return write_delimited(path, filas, "\t" if fmt == "tsv" else csv_delimiter, append)
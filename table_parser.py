@@ -0,0 +1,195 @@
+import csv
+import io
+import json
+from itertools import repeat, zip_longest
+
+# Filas de una sola celda antes o después de la tabla que se consideran texto
+# del modelo ("Aquí tienes la tabla:") y no parte de ella
+PROSE_MIN_WORDS = 7
+
+
+class Table:
+    """
+    Tabla por columnas: columns es una tupla de tuplas de texto, todas con
+    el mismo número de filas (las celdas que faltaban se rellenan con "").
+    """
+
+    __slots__ = ("columns", "format")
+
+    def __init__(self, columns=(), fmt="tsv"):
+        self.columns = tuple(columns)
+        self.format = fmt
+
+    @property
+    def n_rows(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    @property
+    def n_cols(self):
+        return len(self.columns)
+
+    def __len__(self):
+        return self.n_rows
+
+    def rows(self):
+        """Lista de filas (tuplas) ya rellenadas, lista para VirtualGrid"""
+        return list(zip(*self.columns))
+
+    def to_tsv(self):
+        return "\n".join(iter_tsv_rows(zip(*self.columns), self.n_cols))
+
+
+def quote_cell(celda):
+    """Entrecomilla una celda con tabuladores, saltos de línea o comillas iniciales (como Excel)"""
+    if "\t" in celda or "\n" in celda or "\r" in celda or celda.startswith('"'):
+        return '"' + celda.replace('"', '""') + '"'
+    return celda
+
+
+def iter_tsv_rows(filas, num_cols):
+    """Líneas TSV de las filas; solo se entrecomilla cuando una celda lo necesita"""
+    for fila in filas:
+        linea = "\t".join(fila)
+        if linea.count("\t") != num_cols - 1 or "\n" in linea or "\r" in linea or '"' in linea:
+            linea = "\t".join(quote_cell(celda) for celda in fila)
+        yield linea
+
+
+def strip_markdown(texto):
+    """Devuelve el contenido del primer bloque ``` si lo hay (descarta el texto de alrededor)"""
+    inicio = texto.find("```")
+    if inicio != -1:
+        salto = texto.find("\n", inicio)
+        if salto == -1:
+            return texto[inicio + 3:].strip("` \r\n")
+        fin = texto.find("```", salto)
+        texto = texto[salto + 1:fin if fin != -1 else len(texto)]
+    # Solo saltos de línea: un tabulador inicial es una primera celda vacía
+    return texto.strip("\r\n")
+
+
+def detect_format(texto):
+    """"json", "markdown", "tsv" o "empty" según el primer carácter significativo"""
+    for caracter in texto:
+        if caracter.isspace():
+            continue
+        if caracter in "[{":
+            return "json"
+        if caracter == "|":
+            return "markdown"
+        return "tsv"
+    return "empty"
+
+
+def _es_prosa(fila):
+    return len(fila) == 1 and (fila[0].rstrip().endswith(":") or len(fila[0].split()) >= PROSE_MIN_WORDS)
+
+
+def _quitar_prosa(filas):
+    """Quita las frases del modelo antes y después de la tabla (solo si hay filas con varias celdas)"""
+    if not any(len(fila) > 1 for fila in filas):
+        return filas
+    inicio, fin = 0, len(filas)
+    while inicio < fin and _es_prosa(filas[inicio]):
+        inicio += 1
+    while fin > inicio and _es_prosa(filas[fin - 1]):
+        fin -= 1
+    return filas[inicio:fin]
+
+
+def _filas_tsv(texto):
+    if '"' in texto:
+        # Celdas entrecomilladas con tabuladores o saltos de línea; si las
+        # comillas no están bien cerradas se tratan como texto normal
+        try:
+            return [fila for fila in csv.reader(io.StringIO(texto), delimiter="\t", strict=True)
+                    if any(celda.strip() for celda in fila)]
+        except csv.Error:
+            pass
+    return [linea.split("\t") for linea in texto.splitlines() if linea and not linea.isspace()]
+
+
+def _filas_markdown(texto):
+    filas = []
+    for linea in texto.splitlines():
+        linea = linea.strip()
+        if not linea.startswith("|"):
+            continue
+        celdas = [c.strip() for c in linea.strip("|").split("|")]
+        # Fila separadora |---|:---:|
+        if all(c and set(c) <= set("-: ") for c in celdas):
+            continue
+        filas.append(celdas)
+    return filas
+
+
+def _filas_json(datos):
+    """Celdas [{"row", "column", "text"}], lista de filas o {"rows": [...]}"""
+    if isinstance(datos, dict):
+        for clave in ("rows", "table", "data", "cells"):
+            if clave in datos:
+                return _filas_json(datos[clave])
+        raise ValueError("JSON sin tabla")
+    if not isinstance(datos, list):
+        raise ValueError("JSON sin tabla")
+    if datos and all(isinstance(item, dict) for item in datos):
+        max_row = max(int(item["row"]) for item in datos)
+        max_col = max(int(item["column"]) for item in datos)
+        filas = [[""] * max_col for _ in range(max_row)]
+        for item in datos:
+            filas[int(item["row"]) - 1][int(item["column"]) - 1] = str(item.get("text", ""))
+        return filas
+    return [[("" if celda is None else str(celda)) for celda in fila] if isinstance(fila, list) else [str(fila)]
+            for fila in datos]
+
+
+def parse_rows(texto):
+    """Como parse_table, pero devuelve las filas sin rellenar y el formato detectado"""
+    texto = strip_markdown(texto or "")
+    formato = detect_format(texto)
+    if formato == "empty":
+        return [], formato
+    if formato == "json":
+        try:
+            return _filas_json(json.loads(texto)), formato
+        except (ValueError, KeyError, TypeError):
+            formato = "tsv"
+    if formato == "markdown" and "\t" not in texto:
+        filas = _filas_markdown(texto)
+        if filas:
+            return filas, formato
+        formato = "tsv"
+    return _quitar_prosa(_filas_tsv(texto)), formato
+
+
+def parse_table(texto):
+    """
+    Convierte la respuesta del modelo en una Table: quita los bloques ``` y las
+    frases de alrededor, detecta JSON, tabla markdown o TSV (con celdas
+    entrecomilladas) y rellena las filas cortas en una sola pasada.
+    """
+    limpio = strip_markdown(texto or "")
+    columnas = _columnas_uniformes(limpio)
+    if columnas is not None:
+        return Table(columnas, "tsv")
+    filas, formato = parse_rows(limpio)
+    return Table(zip_longest(*filas, fillvalue=""), formato)
+
+
+def _columnas_uniformes(texto):
+    """
+    Caso habitual: TSV sin comillas ni líneas vacías y con las mismas columnas
+    en todas las filas. Las columnas salen directamente de una sola lista de
+    celdas, sin crear una lista por fila. None si no se cumple.
+    """
+    if not texto or "\t" not in texto or '"' in texto or "\r" in texto or texto[0] in "[{|":
+        return None
+    lineas = texto.split("\n")
+    tabs = lineas[0].count("\t")
+    if set(map(str.count, lineas, repeat("\t", len(lineas)))) != {tabs}:
+        return None
+    # Las filas vacías (solo tabuladores) se descartan, como en el caso general
+    if "\n" + "\t" * tabs + "\n" in "\n" + texto + "\n":
+        return None
+    celdas = texto.replace("\n", "\t").split("\t")
+    return tuple(tuple(celdas[c::tabs + 1]) for c in range(tabs + 1))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Telemetría local por petición: tiempos, bytes, tokens y coste por modelo y modo.
+
+Cada petición a OpenRouter añade una fila a telemetry.sqlite3 en la carpeta
+de configuración. Las filas antiguas se resumen por día y modelo y se borran
+(telemetry_retention_days). Para ver p50/p95 por modelo:
+
+    python telemetry.py --dias 30
+"""
+
+import argparse
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+DB_FILENAME = "telemetry.sqlite3"
+DEFAULT_RETENTION_DAYS = 90
+
+# Columnas numéricas de cada petición (ms, bytes, tokens, créditos)
+METRIC_FIELDS = ("capture_ms", "preprocess_ms", "encode_ms", "upload_ms", "ttfb_ms", "total_ms", "image_bytes",
+                 "request_bytes", "prompt_tokens", "completion_tokens", "cost", "retries", "wait_ms",
+                 "estimated_prompt_tokens", "estimated_cost")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    ts REAL NOT NULL,
+    model TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    source TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    {columnas}
+);
+CREATE INDEX IF NOT EXISTS requests_model_ts ON requests (model, ts);
+CREATE TABLE IF NOT EXISTS daily (
+    day TEXT NOT NULL,
+    model TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    total_ms REAL NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    cost REAL NOT NULL,
+    PRIMARY KEY (day, model, mode)
+);
+""".format(columnas=",\n    ".join(f"{campo} REAL" for campo in METRIC_FIELDS))
+
+
+def get_db_path():
+    from config_manager import get_config_dir
+    return os.path.join(get_config_dir(), DB_FILENAME)
+
+
+def percentile(values, p):
+    """Percentil p (0-100) por el método del rango más cercano; None si no hay datos"""
+    if not values:
+        return None
+    ordenados = sorted(values)
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def usage_fields(usage):
+    """Extrae tokens y coste del campo usage de la respuesta de OpenRouter"""
+    usage = usage or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "cost": usage.get("cost"),
+    }
+
+
+class TelemetryStore:
+    """Almacén SQLite de telemetría; se puede usar desde varios hilos"""
+
+    def __init__(self, path=None, retention_days=DEFAULT_RETENTION_DAYS):
+        self.path = path or get_db_path()
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+            # Las bases creadas por versiones anteriores no tienen las columnas nuevas
+            existentes = {fila[1] for fila in self._conn.execute("PRAGMA table_info(requests)")}
+            for campo in METRIC_FIELDS:
+                if campo not in existentes:
+                    self._conn.execute(f"ALTER TABLE requests ADD COLUMN {campo} REAL")
+        return self._conn
+
+    def record(self, model, mode, source="captura", status="ok", error=None, **metricas):
+        """Añade una petición; las métricas que falten quedan como NULL"""
+        valores = [metricas.get(campo) for campo in METRIC_FIELDS]
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute(
+                    f"INSERT INTO requests (ts, model, mode, source, status, error, {', '.join(METRIC_FIELDS)}) "
+                    f"VALUES (?, ?, ?, ?, ?, ?, {', '.join('?' * len(METRIC_FIELDS))})",
+                    [time.time(), model, mode, source, status, error] + valores)
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error al guardar la telemetría: {e}")
+
+    def rollup(self):
+        """Resume por día las filas más antiguas que la retención y las elimina"""
+        limite = time.time() - self.retention_days * 86400
+        with self._lock:
+            conn = self._connection()
+            conn.execute("""
+                INSERT INTO daily (day, model, mode, requests, errors, total_ms, prompt_tokens, completion_tokens, cost)
+                SELECT date(ts, 'unixepoch', 'localtime'), model, mode, COUNT(*),
+                       SUM(status != 'ok'), COALESCE(SUM(total_ms), 0), COALESCE(SUM(prompt_tokens), 0),
+                       COALESCE(SUM(completion_tokens), 0), COALESCE(SUM(cost), 0)
+                FROM requests WHERE ts < ? GROUP BY 1, 2, 3
+                ON CONFLICT (day, model, mode) DO UPDATE SET
+                    requests = requests + excluded.requests, errors = errors + excluded.errors,
+                    total_ms = total_ms + excluded.total_ms, prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                    completion_tokens = completion_tokens + excluded.completion_tokens, cost = cost + excluded.cost
+            """, (limite,))
+            conn.execute("DELETE FROM requests WHERE ts < ?", (limite,))
+            conn.commit()
+
+    def summary(self, days=30, model=None):
+        """p50/p95 de los tiempos, tokens medios y coste total por modelo y modo"""
+        consulta = f"SELECT model, mode, status, {', '.join(METRIC_FIELDS)} FROM requests WHERE ts >= ?"
+        parametros = [time.time() - days * 86400]
+        if model:
+            consulta += " AND model = ?"
+            parametros.append(model)
+        with self._lock:
+            filas = self._connection().execute(consulta, parametros).fetchall()
+
+        grupos = {}
+        for fila in filas:
+            grupos.setdefault((fila[0], fila[1]), []).append(fila[2:])
+        resumen = []
+        for (modelo, modo), filas_grupo in sorted(grupos.items()):
+            ok = [dict(zip(METRIC_FIELDS, f[1:])) for f in filas_grupo if f[0] == "ok"]
+
+            def valores(campo):
+                return [f[campo] for f in ok if f[campo] is not None]
+
+            entrada = {"model": modelo, "mode": modo, "requests": len(filas_grupo),
+                       "errors": len(filas_grupo) - len(ok)}
+            for campo in ("capture_ms", "preprocess_ms", "encode_ms", "upload_ms", "ttfb_ms", "total_ms"):
+                entrada[f"{campo[:-3]}_p50"] = percentile(valores(campo), 50)
+                entrada[f"{campo[:-3]}_p95"] = percentile(valores(campo), 95)
+            for campo in ("image_bytes", "prompt_tokens", "completion_tokens"):
+                datos = valores(campo)
+                entrada[f"{campo}_avg"] = sum(datos) / len(datos) if datos else None
+            entrada["cost_total"] = sum(valores("cost"))
+            entrada["retries"] = sum(valores("retries"))
+            # Error de la estimación previa de tokens de entrada (mediana, % con signo)
+            errores = [(f["prompt_tokens"] - f["estimated_prompt_tokens"]) / f["estimated_prompt_tokens"] * 100
+                       for f in ok if f["prompt_tokens"] and f["estimated_prompt_tokens"]]
+            entrada["estimate_error_pct"] = percentile(errores, 50)
+            resumen.append(entrada)
+        return resumen
+
+    def median_completion_tokens(self, model, mode, min_samples=3):
+        """Tokens de salida habituales del modelo y modo (None si hay pocos datos)"""
+        try:
+            with self._lock:
+                filas = self._connection().execute(
+                    "SELECT completion_tokens FROM requests WHERE model = ? AND mode = ? AND status = 'ok' "
+                    "AND completion_tokens IS NOT NULL ORDER BY ts DESC LIMIT 200", (model, mode)).fetchall()
+        except sqlite3.Error:
+            return None
+        if len(filas) < min_samples:
+            return None
+        return int(percentile([f[0] for f in filas], 50))
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _fmt(valor, decimales=0):
+    if valor is None:
+        return "-"
+    return f"{valor:.{decimales}f}"
+
+
+def format_summary(resumen):
+    """Tabla de texto con una línea por modelo y modo"""
+    cabecera = f"{'Modelo':<42}{'Modo':<7}{'N':>5}{'Err':>5}{'TTFB p50':>10}{'p95':>8}{'Total p50':>11}{'p95':>8}{'Tok in':>8}{'Tok out':>8}{'Coste':>9}{'Err est':>9}"
+    lineas = [cabecera, "-" * len(cabecera)]
+    for e in resumen:
+        lineas.append(
+            f"{e['model'][:41]:<42}{e['mode']:<7}{e['requests']:>5}{e['errors']:>5}"
+            f"{_fmt(e['ttfb_p50']):>10}{_fmt(e['ttfb_p95']):>8}{_fmt(e['total_p50']):>11}{_fmt(e['total_p95']):>8}"
+            f"{_fmt(e['prompt_tokens_avg']):>8}{_fmt(e['completion_tokens_avg']):>8}{_fmt(e['cost_total'], 4):>9}"
+            f"{_fmt(e['estimate_error_pct']) + '%' if e['estimate_error_pct'] is not None else '-':>9}")
+    return "\n".join(lineas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Muestra la telemetría por modelo (tiempos en ms).")
+    parser.add_argument("--dias", type=int, default=30, help="Días hacia atrás que se incluyen")
+    parser.add_argument("--modelo", help="Filtra por id de modelo")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args(argv)
+
+    store = TelemetryStore()
+    if not os.path.exists(store.path):
+        print("Todavía no hay telemetría registrada.", file=sys.stderr)
+        return 1
+    resumen = store.summary(args.dias, args.modelo)
+    store.close()
+    if args.json:
+        print(json.dumps(resumen, ensure_ascii=False, indent=2))
+    else:
+        print(format_summary(resumen))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
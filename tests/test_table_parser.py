@@ -0,0 +1,69 @@
+"""Pruebas basadas en propiedades de table_parser (requieren pytest e hypothesis)"""
+
+import os
+import sys
+
+from hypothesis import given, strategies as st
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from table_parser import Table, parse_table, quote_cell  # noqa: E402
+
+# Texto normal de una celda; [ { | ` al principio cambiarían el formato detectado
+TEXTO = st.characters(blacklist_categories=("Cs", "Cc", "Zl", "Zp"), blacklist_characters="[{|`")
+# Además, tabuladores, saltos de línea y comillas, que obligan a entrecomillar
+CELDA = st.text(st.one_of(TEXTO, st.sampled_from('\t\n\r"')), max_size=12)
+
+
+def _tiene_texto(fila):
+    return any(celda.strip() for celda in fila)
+
+
+@st.composite
+def tablas(draw, celda=CELDA, min_cols=1):
+    """Filas de la misma longitud; las filas sin texto se descartan al leer y no se generan"""
+    n_cols = draw(st.integers(min_cols, 6))
+    fila = st.lists(celda, min_size=n_cols, max_size=n_cols).filter(_tiene_texto)
+    return draw(st.lists(fila, min_size=1, max_size=15))
+
+
+def _columnas(filas):
+    return tuple(zip(*filas))
+
+
+@given(tablas())
+def test_tsv_ida_y_vuelta(filas):
+    tabla = parse_table(Table(_columnas(filas)).to_tsv())
+    assert tabla.format == "tsv"
+    assert tabla.columns == _columnas(filas)
+
+
+@given(tablas(), st.sampled_from(["", "tsv", "text"]), st.sampled_from(["", "Aquí tienes la tabla:\n\n"]))
+def test_bloque_de_codigo(filas, lenguaje, prosa):
+    texto = f"{prosa}```{lenguaje}\n{Table(_columnas(filas)).to_tsv()}\n```\nEspero que te sirva."
+    assert parse_table(texto).columns == _columnas(filas)
+
+
+@given(tablas(celda=st.text(st.sampled_from('ab\t\n\r" '), min_size=1, max_size=6), min_cols=2))
+def test_celdas_entrecomilladas(filas):
+    tsv = Table(_columnas(filas)).to_tsv()
+    if any(quote_cell(celda) != celda for fila in filas for celda in fila):
+        assert '"' in tsv
+    assert parse_table(tsv).columns == _columnas(filas)
+
+
+@given(tablas(celda=st.text(TEXTO.filter(lambda c: c not in "-:"), min_size=1, max_size=10).map(str.strip)
+              .filter(bool), min_cols=2))
+def test_markdown(filas):
+    lineas = ["| " + " | ".join(filas[0]) + " |", "|" + "---|" * len(filas[0])]
+    lineas += ["| " + " | ".join(fila) + " |" for fila in filas[1:]]
+    tabla = parse_table("\n".join(lineas))
+    assert tabla.format == "markdown"
+    assert tabla.columns == _columnas(filas)
+
+
+@given(st.text(max_size=200))
+def test_cualquier_texto(texto):
+    tabla = parse_table(texto)
+    assert len({len(columna) for columna in tabla.columns}) <= 1
+    assert all(isinstance(celda, str) for columna in tabla.columns for celda in columna)
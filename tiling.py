@@ -0,0 +1,88 @@
+from PIL import Image, ImageFilter
+
+DEFAULT_MIN_HEIGHT = 1600   # Altura a partir de la cual se divide la captura (px)
+DEFAULT_BAND_HEIGHT = 1000  # Altura objetivo de cada franja (px)
+DEFAULT_OVERLAP = 40        # Solapamiento entre franjas consecutivas (px)
+MAX_OVERLAP_ROWS = 3        # Filas repetidas que se buscan al unir franjas
+GAP_THRESHOLD = 1           # Intensidad media de bordes por debajo de la cual una fila está vacía
+
+
+def row_profile(img):
+    """Intensidad media de bordes por fila (proyección horizontal); 0 = fila uniforme"""
+    bordes = img.convert("L").filter(ImageFilter.FIND_EDGES)
+    return list(bordes.resize((1, img.height), Image.BOX).getdata())
+
+
+def find_cuts(profile, band_height):
+    """
+    Elige los puntos de corte cerca de cada múltiplo de band_height, preferentemente
+    en el centro del hueco en blanco (entre filas de texto) más cercano.
+    """
+    altura = len(profile)
+    cortes = []
+    inicio = 0
+    while altura - inicio > band_height * 1.25:
+        objetivo = inicio + band_height
+        ventana_inicio = max(inicio + band_height // 2, objetivo - band_height // 4)
+        ventana_fin = min(altura - 1, objetivo + band_height // 4)
+        mejor = None
+        y = ventana_inicio
+        while y <= ventana_fin:
+            if profile[y] <= GAP_THRESHOLD:
+                fin = y
+                while fin + 1 <= ventana_fin and profile[fin + 1] <= GAP_THRESHOLD:
+                    fin += 1
+                centro = (y + fin) // 2
+                if mejor is None or abs(centro - objetivo) < abs(mejor - objetivo):
+                    mejor = centro
+                y = fin + 1
+            else:
+                y += 1
+        corte = mejor if mejor is not None else objetivo
+        cortes.append(corte)
+        inicio = corte
+    return cortes
+
+
+def split_into_bands(img, band_height=DEFAULT_BAND_HEIGHT, overlap=DEFAULT_OVERLAP):
+    """Divide la imagen en franjas horizontales solapadas; devuelve [(y0, y1, franja)]"""
+    cortes = find_cuts(row_profile(img), band_height)
+    limites = [0] + cortes + [img.height]
+    franjas = []
+    for i in range(len(limites) - 1):
+        y0 = max(0, limites[i] - (overlap if i > 0 else 0))
+        y1 = min(img.height, limites[i + 1] + (overlap if i < len(limites) - 2 else 0))
+        franjas.append((y0, y1, img.crop((0, y0, img.width, y1))))
+    return franjas
+
+
+def _normalizar(fila):
+    return tuple(celda.strip() for celda in fila)
+
+
+def merge_tables(tables, max_overlap_rows=MAX_OVERLAP_ROWS):
+    """Une las tablas de franjas consecutivas eliminando las filas repetidas en el solapamiento"""
+    merged = []
+    for table in tables:
+        descartar = 0
+        limite = min(max_overlap_rows, len(merged), len(table))
+        for k in range(limite, 0, -1):
+            if [_normalizar(f) for f in merged[-k:]] == [_normalizar(f) for f in table[:k]]:
+                descartar = k
+                break
+        merged.extend(table[descartar:])
+    return merged
+
+
+def check_columns(tables, expected_cols=None):
+    """
+    Comprueba que todas las franjas tengan el mismo número de columnas (o el
+    indicado en modo Manual). Devuelve una lista de avisos legibles.
+    """
+    avisos = []
+    conteos = [max((len(fila) for fila in table), default=0) for table in tables]
+    referencia = expected_cols or (max(set(conteos), key=conteos.count) if conteos else 0)
+    for i, conteo in enumerate(conteos, 1):
+        if conteo and conteo != referencia:
+            avisos.append(f"Franja {i}: {conteo} columnas (se esperaban {referencia})")
+    return avisos